@@ -90,13 +90,12 @@ export default function FileManager() {
     if (!confirm(t('deleteSelectedConfirm').replace('{count}', selectedFiles.length))) return
     
     setLoading(true)
-    let successCount = 0
-    for (const path of selectedFiles) {
-      try {
-        await api.delete(`/admin/instances/${id}/files`, { params: { path } })
-        successCount++
-      } catch (e) { console.error(e) }
-    }
+    try {
+      // Один запрос и одна новая версия вместо удаления по файлу
+      await api.post(`/admin/instances/${id}/files/bulk`, {
+        operations: selectedFiles.map(path => ({ op: 'delete', path }))
+      })
+    } catch (e) { console.error(e) }
     setSelectedFiles([])
     fetchFiles()
   }
@@ -5,7 +5,7 @@ import {
   AlertTriangle, Activity, Command, HelpCircle, Check, X, Shield,
   HardDrive, Globe, ChevronRight
 } from 'lucide-react';
-import api from '../lib/api';
+import api, { API_URL } from '../lib/api';
 import { useLanguage } from '../lib/LanguageContext';
 import FileManager from './FileManager'; 
 
@@ -220,11 +220,26 @@ export default function InstanceSettings() {
     const time = new Date().toLocaleTimeString();
     setSyncLogs(prev => prev + `\n[${time}] 🚀 ${t('syncInitializing')} ${id}...\n`);
     try {
+        // Сервер отвечает сразу, ход синхронизации приходит через SSE
         const res = await api.post(`/admin/sftp/${id}/sync`);
-        setSyncLogs(prev => prev + res.data.logs + `\n✅ ${t('syncSuccess')}\n`);
+        const params = new URLSearchParams({ last_event_id: res.data.last_event_id, ticket: res.data.events_ticket });
+        const source = new EventSource(`${API_URL}/admin/sftp/${id}/sync/events?${params}`);
+        source.onmessage = (e) => {
+            const event = JSON.parse(e.data);
+            if (event.phase === 'done') {
+                source.close();
+                setSyncLogs(prev => prev + (event.status === 'success'
+                    ? `\n✅ ${t('syncSuccess')}\n`
+                    : `❌ ${t('syncError')}${event.message}\n`));
+                setSyncing(false);
+                return;
+            }
+            if (event.message) {
+                setSyncLogs(prev => prev + (event.target ? `[${event.target}] ` : '') + event.message + '\n');
+            }
+        };
     } catch (e) {
         setSyncLogs(prev => prev + `❌ ${t('syncError')}${e.response?.data?.detail || e.message}\n`);
-    } finally {
         setSyncing(false);
     }
   };
@@ -20,26 +20,40 @@ export default function Login() {
       });
   }, []);
 
-  // 2. Опрашиваем сервер каждые 2 секунды
+  // 2. Long-poll: сервер держит запрос, пока бот не подтвердит вход (до 25 секунд)
   useEffect(() => {
     if (!code) return;
 
-    const interval = setInterval(async () => {
-      try {
-        const res = await api.get(`/auth/check/${code}`);
-        if (res.data.status === 'success') {
-          localStorage.setItem('token', res.data.access_token);
-          navigate('/');
-        }
-      } catch (e) {
-        // 404 = код истёк, остальные ошибки игнорируем
-        if (e.response?.status === 404) {
-          clearInterval(interval);
+    const controller = new AbortController();
+    let stopped = false;
+
+    const waitForConfirm = async () => {
+      while (!stopped) {
+        try {
+          const res = await api.get(`/auth/check/${code}`, {
+            params: { wait: 25 },
+            signal: controller.signal,
+          });
+          if (res.data.status === 'success') {
+            localStorage.setItem('token', res.data.access_token);
+            navigate('/');
+            return;
+          }
+        } catch (e) {
+          if (controller.signal.aborted) return;
+          // 404 = код истёк
+          if (e.response?.status === 404) return;
+          // Сеть/сервер недоступны — короткая пауза перед повтором
+          await new Promise(resolve => setTimeout(resolve, 3000));
         }
       }
-    }, 3000); // Увеличен интервал с 2 до 3 секунд
+    };
+    waitForConfirm();
 
-    return () => clearInterval(interval);
+    return () => {
+      stopped = true;
+      controller.abort();
+    };
   }, [code, navigate]);
 
   return (
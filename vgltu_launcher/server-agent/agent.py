@@ -0,0 +1,188 @@
+"""
+Агент синхронизации для игрового сервера (pull-режим вместо заливки по SFTP).
+
+Запускается рядом с сервером Minecraft, long-poll'ом ждет новую версию сборки,
+сверяет ее с локальным кешем хешей, параллельно качает изменившиеся файлы прямо
+из хранилища и применяет их только после того, как скачано и проверено всё.
+
+Только стандартная библиотека Python 3.8+.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+# Конфигурация
+API_URL = os.getenv("AGENT_API_URL", "http://localhost:8000").rstrip("/")
+AGENT_TOKEN = os.getenv("AGENT_TOKEN")
+if not AGENT_TOKEN:
+    raise RuntimeError("AGENT_TOKEN environment variable is required!")
+SERVER_DIR = os.path.abspath(os.getenv("AGENT_SERVER_DIR", "."))
+DOWNLOAD_WORKERS = int(os.getenv("AGENT_DOWNLOAD_WORKERS", "8"))
+WAIT_SECONDS = 55
+
+STATE_FILE = os.path.join(SERVER_DIR, ".agent-state.json")
+STAGING_DIR = os.path.join(SERVER_DIR, ".agent-staging")
+CHUNK_SIZE = 1024 * 1024
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("agent")
+
+
+def api_request(method: str, path: str, body: dict = None, timeout: float = 30):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(f"{API_URL}{path}", data=data, method=method)
+    request.add_header("Authorization", f"Bearer {AGENT_TOKEN}")
+    if data is not None:
+        request.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        if response.status == 204:
+            return None
+        return json.loads(response.read())
+
+
+# --- Локальный кеш хешей: {path: [size, mtime_ns, sha256]} ---
+
+def load_state() -> dict:
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"version": None, "files": {}}
+
+
+def save_state(state: dict):
+    tmp = f"{STATE_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def local_hash(rel: str, cache: dict):
+    """Хеш файла на диске; пересчитываем только если size/mtime не совпали с кешем"""
+    full = os.path.join(SERVER_DIR, rel)
+    try:
+        st = os.stat(full)
+    except OSError:
+        return None
+    cached = cache.get(rel)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached[2]
+    sha = file_sha256(full)
+    cache[rel] = [st.st_size, st.st_mtime_ns, sha]
+    return sha
+
+
+def local_files(folders: list) -> set:
+    found = set()
+    for folder in folders:
+        root = os.path.join(SERVER_DIR, folder)
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                found.add(os.path.relpath(os.path.join(dirpath, name), SERVER_DIR).replace(os.sep, "/"))
+    return found
+
+
+# --- Применение манифеста ---
+
+def download(item: dict, staged_path: str):
+    os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+    digest = hashlib.sha256()
+    with urllib.request.urlopen(item["url"], timeout=60) as response, open(staged_path, "wb") as out:
+        for block in iter(lambda: response.read(CHUNK_SIZE), b""):
+            digest.update(block)
+            out.write(block)
+    if digest.hexdigest() != item["hash"]:
+        raise ValueError(f"Hash mismatch for {item['path']}")
+
+
+def apply_manifest(manifest: dict, state: dict):
+    """
+    1) качаем всё изменившееся в .agent-staging и проверяем sha256;
+    2) только потом переносим файлы на место (os.replace атомарен в пределах ФС)
+       и удаляем лишние файлы из раздаваемых папок.
+    Если хоть одна загрузка упала — живые файлы не трогаем вовсе.
+    """
+    cache = state["files"]
+    expected = {item["path"]: item for item in manifest["files"]}
+    changed = [item for path, item in expected.items() if local_hash(path, cache) != item["hash"]]
+    extra = local_files(manifest["folders"]) - set(expected)
+
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    if changed:
+        logger.info(f"⬇️ Downloading {len(changed)} files ({sum(i['size'] for i in changed)} bytes)")
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            list(pool.map(lambda item: download(item, os.path.join(STAGING_DIR, item["path"])), changed))
+
+    for item in changed:
+        target = os.path.join(SERVER_DIR, item["path"])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(os.path.join(STAGING_DIR, item["path"]), target)
+        st = os.stat(target)
+        cache[item["path"]] = [st.st_size, st.st_mtime_ns, item["hash"]]
+
+    for rel in extra:
+        try:
+            os.remove(os.path.join(SERVER_DIR, rel))
+        except OSError as e:
+            logger.warning(f"Cannot remove {rel}: {e}")
+        cache.pop(rel, None)
+
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    state["version"] = manifest["version"]
+    save_state(state)
+    logger.info(f"✅ Version {manifest['version']}: {len(changed)} updated, {len(extra)} removed")
+
+
+def main():
+    state = load_state()
+    logger.info(f"🚀 Agent started for {SERVER_DIR}, current version: {state['version']}")
+    backoff = 1
+    while True:
+        try:
+            query = f"?since={state['version']}&wait={WAIT_SECONDS}" if state["version"] is not None else ""
+            manifest = api_request("GET", f"/api/agent/manifest{query}", timeout=WAIT_SECONDS + 15)
+            backoff = 1
+            if manifest is None:
+                continue  # 204: обновлений не было, ждем дальше
+
+            try:
+                apply_manifest(manifest, state)
+                api_request("POST", "/api/agent/report", {"version": manifest["version"], "status": "success"})
+            except Exception as e:
+                logger.error(f"❌ Failed to apply version {manifest['version']}: {e}")
+                api_request("POST", "/api/agent/report", {
+                    "version": manifest["version"], "status": "error", "message": str(e)[:2000]
+                })
+                raise
+        except KeyboardInterrupt:
+            sys.exit(0)
+        except urllib.error.HTTPError as e:
+            if e.code == 401:
+                logger.error("❌ Agent token rejected, check AGENT_TOKEN")
+            else:
+                logger.error(f"❌ API error: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 300)
+        except Exception as e:
+            logger.error(f"❌ {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 300)
+
+
+if __name__ == "__main__":
+    main()
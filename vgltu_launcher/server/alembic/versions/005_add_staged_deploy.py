@@ -0,0 +1,21 @@
+"""Add staged_deploy flag to SFTPConnection
+
+Revision ID: 005_staged_deploy
+Revises: 004_side
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '005_staged_deploy'
+down_revision = '004_side'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('sftp_connections', sa.Column('staged_deploy', sa.Boolean(), nullable=False, server_default='false'))
+
+
+def downgrade() -> None:
+    op.drop_column('sftp_connections', 'staged_deploy')
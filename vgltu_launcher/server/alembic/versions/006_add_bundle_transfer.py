@@ -0,0 +1,21 @@
+"""Add bundle_transfer flag to SFTPConnection
+
+Revision ID: 006_bundle_transfer
+Revises: 005_staged_deploy
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '006_bundle_transfer'
+down_revision = '005_staged_deploy'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('sftp_connections', sa.Column('bundle_transfer', sa.Boolean(), nullable=False, server_default='false'))
+
+
+def downgrade() -> None:
+    op.drop_column('sftp_connections', 'bundle_transfer')
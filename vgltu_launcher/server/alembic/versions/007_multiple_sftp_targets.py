@@ -0,0 +1,31 @@
+"""Allow several SFTP targets per instance
+
+Revision ID: 007_sftp_targets
+Revises: 006_bundle_transfer
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '007_sftp_targets'
+down_revision = '006_bundle_transfer'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('sftp_connections', sa.Column('name', sa.String(50), nullable=False, server_default='main'))
+
+    # instance_id больше не уникален: уникальна пара (instance_id, name)
+    op.drop_constraint('sftp_connections_instance_id_key', 'sftp_connections', type_='unique')
+    op.drop_index('ix_sftp_connections_instance_id', table_name='sftp_connections')
+    op.create_index('ix_sftp_connections_instance_id', 'sftp_connections', ['instance_id'], unique=False)
+    op.create_unique_constraint('uq_sftp_connections_instance_name', 'sftp_connections', ['instance_id', 'name'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_sftp_connections_instance_name', 'sftp_connections', type_='unique')
+    op.drop_index('ix_sftp_connections_instance_id', table_name='sftp_connections')
+    op.create_index('ix_sftp_connections_instance_id', 'sftp_connections', ['instance_id'], unique=True)
+    op.create_unique_constraint('sftp_connections_instance_id_key', 'sftp_connections', ['instance_id'])
+    op.drop_column('sftp_connections', 'name')
@@ -0,0 +1,24 @@
+"""Add game server address to SFTPConnection
+
+Revision ID: 008_game_address
+Revises: 007_sftp_targets
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '008_game_address'
+down_revision = '007_sftp_targets'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Если game_host не задан, пингуем rcon_host или host от SFTP
+    op.add_column('sftp_connections', sa.Column('game_host', sa.String(255), nullable=True))
+    op.add_column('sftp_connections', sa.Column('game_port', sa.Integer(), nullable=False, server_default='25565'))
+
+
+def downgrade() -> None:
+    op.drop_column('sftp_connections', 'game_port')
+    op.drop_column('sftp_connections', 'game_host')
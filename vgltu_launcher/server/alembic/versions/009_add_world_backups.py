@@ -0,0 +1,56 @@
+"""Add incremental world backups
+
+Revision ID: 009_world_backups
+Revises: 008_game_address
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '009_world_backups'
+down_revision = '008_game_address'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('sftp_connections', sa.Column('world_path', sa.String(255), nullable=False, server_default='world'))
+
+    op.create_table(
+        'world_snapshots',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('instance_id', sa.String(), nullable=False),
+        sa.Column('target_id', sa.Integer(), nullable=True),
+        sa.Column('world_path', sa.String(255), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False, server_default='running'),
+        sa.Column('manifest_path', sa.String(255), nullable=True),
+        sa.Column('files_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('files_changed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_bytes', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('new_bytes', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('error', sa.String(1000), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['instance_id'], ['instances.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['target_id'], ['sftp_connections.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_world_snapshots_instance_id', 'world_snapshots', ['instance_id'])
+    op.create_index('ix_world_snapshots_target_id', 'world_snapshots', ['target_id'])
+
+    op.create_table(
+        'backup_chunks',
+        sa.Column('sha256', sa.String(64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('s3_path', sa.String(255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('sha256')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('backup_chunks')
+    op.drop_index('ix_world_snapshots_target_id', table_name='world_snapshots')
+    op.drop_index('ix_world_snapshots_instance_id', table_name='world_snapshots')
+    op.drop_table('world_snapshots')
+    op.drop_column('sftp_connections', 'world_path')
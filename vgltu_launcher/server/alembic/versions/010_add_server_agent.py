@@ -0,0 +1,28 @@
+"""Add pull-based server agent transport
+
+Revision ID: 010_server_agent
+Revises: 009_world_backups
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '010_server_agent'
+down_revision = '009_world_backups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('sftp_connections', sa.Column('transport', sa.String(10), nullable=False, server_default='sftp'))
+    op.add_column('sftp_connections', sa.Column('agent_token_hash', sa.String(64), nullable=True))
+    op.create_unique_constraint('uq_sftp_connections_agent_token_hash', 'sftp_connections', ['agent_token_hash'])
+    # Серверу с агентом SSH-пароль не нужен
+    op.alter_column('sftp_connections', 'password', existing_type=sa.String(), nullable=True)
+
+
+def downgrade() -> None:
+    op.alter_column('sftp_connections', 'password', existing_type=sa.String(), nullable=False)
+    op.drop_constraint('uq_sftp_connections_agent_token_hash', 'sftp_connections', type_='unique')
+    op.drop_column('sftp_connections', 'agent_token_hash')
+    op.drop_column('sftp_connections', 'transport')
@@ -0,0 +1,22 @@
+"""Add case-insensitive username index
+
+Revision ID: 011_username_lower
+Revises: 010_server_agent
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '011_username_lower'
+down_revision = '010_server_agent'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Пакетный поиск профилей: WHERE lower(username) IN (...)
+    op.create_index('ix_users_username_lower', 'users', [sa.text('lower(username)')])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_username_lower', table_name='users')
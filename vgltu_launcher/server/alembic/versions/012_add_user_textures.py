@@ -0,0 +1,27 @@
+"""Add skin and cape textures to users
+
+Revision ID: 012_user_textures
+Revises: 011_username_lower
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '012_user_textures'
+down_revision = '011_username_lower'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('skin_hash', sa.String(64), nullable=True))
+    op.add_column('users', sa.Column('skin_model', sa.String(10), nullable=False, server_default='classic'))
+    op.add_column('users', sa.Column('cape_hash', sa.String(64), nullable=True))
+    op.add_column('users', sa.Column('textures_property', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'textures_property')
+    op.drop_column('users', 'cape_hash')
+    op.drop_column('users', 'skin_model')
+    op.drop_column('users', 'skin_hash')
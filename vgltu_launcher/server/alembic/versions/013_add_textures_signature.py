@@ -0,0 +1,23 @@
+"""Add textures signature and signing key id to users
+
+Revision ID: 013_textures_signature
+Revises: 012_user_textures
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '013_textures_signature'
+down_revision = '012_user_textures'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('textures_signature', sa.Text(), nullable=True))
+    op.add_column('users', sa.Column('textures_key_id', sa.String(20), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'textures_key_id')
+    op.drop_column('users', 'textures_signature')
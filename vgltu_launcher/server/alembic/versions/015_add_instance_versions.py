@@ -0,0 +1,125 @@
+"""Immutable instance versions instead of instance_files
+
+Revision ID: 015_instance_versions
+Revises: 013_textures_signature
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '015_instance_versions'
+down_revision = '013_textures_signature'
+branch_labels = None
+depends_on = None
+
+# Тип уже создан миграцией 004
+sidetype = postgresql.ENUM('CLIENT', 'SERVER', 'BOTH', name='sidetype', create_type=False)
+
+# Содержимое instance_files: при ключе (instance_id, file_hash) один путь мог оказаться
+# в сборке дважды с разными хешами — берем по одной строке на путь
+IMPORTED_FILES_SQL = """
+    SELECT DISTINCT ON (instance_id, path) instance_id, path, file_hash, side
+    FROM instance_files
+    ORDER BY instance_id, path, file_hash
+"""
+
+# Набор файлов текущей версии каждой сборки (для отката миграции)
+RESOLVED_CURRENT_SQL = """
+    WITH RECURSIVE chain(instance_id, version_id, parent_id, distance) AS (
+        SELECT i.id, v.id, v.parent_id, 0
+        FROM instances i JOIN instance_versions v ON v.id = i.current_version_id
+        UNION ALL
+        SELECT c.instance_id, v.id, v.parent_id, c.distance + 1
+        FROM instance_versions v JOIN chain c ON v.id = c.parent_id
+    )
+    SELECT DISTINCT ON (instance_id, file_hash) instance_id, file_hash, path, side FROM (
+        SELECT DISTINCT ON (c.instance_id, vf.path) c.instance_id, vf.file_hash, vf.path, vf.side
+        FROM version_files vf JOIN chain c ON vf.version_id = c.version_id
+        ORDER BY c.instance_id, vf.path, c.distance
+    ) resolved
+    WHERE file_hash IS NOT NULL
+    ORDER BY instance_id, file_hash, path
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        'instance_versions',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('instance_id', sa.String(50), nullable=False),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.Column('depth', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('comment', sa.String(255), nullable=True),
+        sa.Column('files_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_size', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['instance_id'], ['instances.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['parent_id'], ['instance_versions.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_instance_versions_instance_id', 'instance_versions', ['instance_id'])
+
+    op.create_table(
+        'version_files',
+        sa.Column('version_id', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('file_hash', sa.String(), nullable=True),
+        sa.Column('side', sidetype, nullable=False, server_default='BOTH'),
+        sa.ForeignKeyConstraint(['version_id'], ['instance_versions.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['file_hash'], ['files.sha256']),
+        # Разрешение версии идет по version_id из цепочки — хватает первичного ключа
+        sa.PrimaryKeyConstraint('version_id', 'path')
+    )
+    # Поиск осиротевших файлов (NOT EXISTS по file_hash): index-only scan вместо
+    # полного прохода по version_files, см. bench/explain_version_files.py
+    op.create_index('ix_version_files_file_hash', 'version_files', ['file_hash'])
+
+    op.add_column('instances', sa.Column('current_version_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'fk_instances_current_version', 'instances', 'instance_versions', ['current_version_id'], ['id']
+    )
+
+    # Текущее содержимое каждой сборки становится ее первой (базовой) версией
+    op.execute(f"""
+        INSERT INTO instance_versions (instance_id, parent_id, depth, comment, files_count, total_size, created_at)
+        SELECT i.id, NULL, 0, 'Imported from instance_files',
+               count(f.sha256), coalesce(sum(f.size), 0), now()
+        FROM instances i
+        LEFT JOIN ({IMPORTED_FILES_SQL}) inf ON inf.instance_id = i.id
+        LEFT JOIN files f ON f.sha256 = inf.file_hash
+        GROUP BY i.id
+    """)
+    op.execute(f"""
+        INSERT INTO version_files (version_id, path, file_hash, side)
+        SELECT v.id, inf.path, inf.file_hash, inf.side
+        FROM ({IMPORTED_FILES_SQL}) inf JOIN instance_versions v ON v.instance_id = inf.instance_id
+    """)
+    op.execute("""
+        UPDATE instances i SET current_version_id = v.id
+        FROM instance_versions v WHERE v.instance_id = i.id
+    """)
+
+    op.drop_table('instance_files')
+
+
+def downgrade() -> None:
+    op.create_table(
+        'instance_files',
+        sa.Column('instance_id', sa.String(), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('file_hash', sa.String(), nullable=False),
+        sa.Column('side', sidetype, nullable=False, server_default='BOTH'),
+        sa.ForeignKeyConstraint(['file_hash'], ['files.sha256']),
+        sa.ForeignKeyConstraint(['instance_id'], ['instances.id']),
+        sa.PrimaryKeyConstraint('instance_id', 'file_hash')
+    )
+    # Старый ключ не допускает один блоб по двум путям — остается первый по пути
+    op.execute(f"INSERT INTO instance_files (instance_id, file_hash, path, side) {RESOLVED_CURRENT_SQL}")
+
+    op.drop_constraint('fk_instances_current_version', 'instances', type_='foreignkey')
+    op.drop_column('instances', 'current_version_id')
+    op.drop_index('ix_version_files_file_hash', table_name='version_files')
+    op.drop_table('version_files')
+    op.drop_index('ix_instance_versions_instance_id', table_name='instance_versions')
+    op.drop_table('instance_versions')
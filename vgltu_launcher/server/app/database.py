@@ -1,16 +1,105 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
+import sqlalchemy as sa
 import redis.asyncio as redis
 from minio import Minio
+import asyncio
+import logging
+import time
 import os
 
+logger = logging.getLogger(__name__)
+
 # --- 1. POSTGRES ---
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL environment variable is required!")
-engine = create_async_engine(DATABASE_URL, echo=False)
+
+def engine_options(url: str, prefix: str = "DB_") -> dict:
+    """Настройки пула из env. У SQLite (тесты, бенчмарки) своего пула нет — ничего не передаем"""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": int(os.getenv(f"{prefix}POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv(f"{prefix}MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv(f"{prefix}POOL_TIMEOUT", "30")),
+        # Соединения старше получаса пересоздаются (pgbouncer/NAT режут простаивающие)
+        "pool_recycle": int(os.getenv(f"{prefix}POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv(f"{prefix}POOL_PRE_PING", "true").lower() == "true",
+    }
+
+engine = create_async_engine(DATABASE_URL, echo=False, **engine_options(DATABASE_URL))
 async_session_factory = async_sessionmaker(engine, expire_on_commit=False)
 
+# --- 1.1 POSTGRES READ REPLICA (опционально) ---
+# Чтения лаунчера (список сборок, манифесты) и поиск профилей идут сюда, чтобы шторм
+# запусков не отнимал соединения у записей админки. Пул реплики — DB_READ_POOL_SIZE и т.д.
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+# Реплика, отставшая больше чем на столько секунд, не используется
+READ_REPLICA_MAX_LAG = float(os.getenv("READ_REPLICA_MAX_LAG", "5"))
+READ_REPLICA_CHECK_INTERVAL = 5
+READ_REPLICA_CHECK_TIMEOUT = 2
+
+read_engine = (
+    create_async_engine(READ_DATABASE_URL, echo=False, **engine_options(READ_DATABASE_URL, "DB_READ_"))
+    if READ_DATABASE_URL else None
+)
+read_session_factory = async_sessionmaker(read_engine, expire_on_commit=False) if read_engine else None
+
+# Отставание реплики; 0, если все полученное уже применено (на простое
+# pg_last_xact_replay_timestamp стоит на месте, хотя реплика актуальна)
+_REPLICA_LAG_SQL = sa.text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class ReplicaHealth:
+    """
+    Состояние реплики с кешем на READ_REPLICA_CHECK_INTERVAL секунд: проверку делает
+    один запрос, остальные в это время пользуются прошлым результатом.
+    """
+
+    def __init__(self):
+        self.healthy = True
+        self.lag = 0.0
+        self._checked = 0.0
+        self._checking = False
+
+    async def is_usable(self) -> bool:
+        if time.monotonic() - self._checked >= READ_REPLICA_CHECK_INTERVAL and not self._checking:
+            await self.check()
+        return self.healthy
+
+    async def check(self):
+        self._checking = True
+        try:
+            # Таймаут на всю проверку, включая ожидание соединения из пула (до pool_timeout)
+            # и подключение к упавшему хосту: проверка идет прямо в запросе пользователя
+            lag = await asyncio.wait_for(self._probe(), timeout=READ_REPLICA_CHECK_TIMEOUT)
+            self.lag = float(lag or 0)
+            healthy = self.lag <= READ_REPLICA_MAX_LAG
+            if healthy != self.healthy:
+                logger.warning(f"{'✅' if healthy else '⚠️'} Read replica {'back' if healthy else 'lagging'}: {self.lag:.1f}s")
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"⚠️ Read replica unavailable, reads go to primary: {e or type(e).__name__}")
+            healthy = False
+        finally:
+            self._checked = time.monotonic()
+            self._checking = False
+        self.healthy = healthy
+
+    async def _probe(self):
+        async with read_engine.connect() as conn:
+            return await conn.scalar(_REPLICA_LAG_SQL)
+
+
+replica_health = ReplicaHealth()
+
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
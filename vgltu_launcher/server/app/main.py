@@ -3,17 +3,16 @@ from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
-from .database import engine, Base, redis_client
+from .database import engine, read_engine, redis_client
 import sqlalchemy as sa
-from app.routes import yggdrasil, admin, client, auth, sftp
-
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
-
-# Redis URL для rate limiter storage
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+from app.routes import yggdrasil, admin, client, auth, sftp, rcon, backups, agent, users
+from app.services.sftp_pool import sftp_pool
+from app.services.rcon import rcon_manager
+from app.services.server_status import server_status_poller
+from app.services.pubsub import notifier
+from app.services.signing import signing_keys
+from app.services.rate_limit import rate_limiter, RateLimitMiddleware
+import asyncio
 
 # --- LIFESPAN ---
 @asynccontextmanager
@@ -34,14 +33,34 @@ async def lifespan(app: FastAPI):
         print("✅ Redis: Connected")
     except Exception as e:
         print(f"❌ Redis Error: {e}")
+
+    # 3. Ключ подписи профилей (создается при первом запуске)
+    signing_keys.load()
+
+    # 4. Фоновый опрос игровых серверов (Server List Ping)
+    status_task = asyncio.create_task(server_status_poller())
         
     yield
     
     print("🛑 [SHUTDOWN] Closing connections...")
+    status_task.cancel()
+    await notifier.close()
+    await rate_limiter.close()
     await engine.dispose()
+    if read_engine is not None:
+        await read_engine.dispose()
     await redis_client.aclose()
+    sftp_pool.close_all()
+    await rcon_manager.close_all()
 
 app = FastAPI(lifespan=lifespan)
+
+# --- RATE LIMITING ---
+# Лимиты по группам маршрутов (launcher / yggdrasil / admin ...): локальные корзины,
+# синхронизация с Redis пачками в фоне — см. app/services/rate_limit.py.
+# Добавляется до CORS, чтобы ответы 429 тоже шли с CORS-заголовками
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # --- НАСТРОЙКА CORS ---
 # Читаем разрешённые origins из env (через запятую)
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
@@ -60,18 +79,10 @@ app.include_router(admin.router)
 app.include_router(client.router)
 app.include_router(auth.router)
 app.include_router(sftp.router)
-
-# --- RATE LIMITING ---
-# Global limiter с Redis storage и default limits
-limiter = Limiter(
-    key_func=get_remote_address,
-    storage_uri=REDIS_URL,
-    default_limits=["100/minute"],  # Default для всех endpoints
-    application_limits=["1000/hour"]  # Общий лимит на приложение
-)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-app.add_middleware(SlowAPIMiddleware)
+app.include_router(rcon.router)
+app.include_router(backups.router)
+app.include_router(agent.router)
+app.include_router(users.router)
 
 
 @app.get("/")
@@ -1,10 +1,10 @@
 import uuid
 import enum  # <--- NEW
 from datetime import datetime
-from sqlalchemy import Column, String, BigInteger, Boolean, ForeignKey, DateTime, Table, Integer, Enum # <--- IMPORT ENUM
+from sqlalchemy import Column, String, BigInteger, Boolean, ForeignKey, DateTime, Table, Integer, Enum, UniqueConstraint, Index, Text # <--- IMPORT ENUM
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from .database import Base
 
 # === НОВЫЙ ENUM ===
@@ -13,26 +13,57 @@ class SideType(str, enum.Enum):
     SERVER = "SERVER"
     BOTH = "BOTH"
 
-# --- Таблица связи: Сборка <-> Файл ---
-instance_files = Table(
-    "instance_files",
+# --- Версии сборки ---
+# Версия неизменяема. Базовая версия (parent_id IS NULL) хранит полный набор файлов,
+# производная — только отличия от родителя: измененные пути и "надгробия"
+# (file_hash IS NULL — файл удален). Итоговый набор — ближайшая по цепочке запись
+# для каждого пути, см. app/services/instance_versions.py
+version_files = Table(
+    "version_files",
     Base.metadata,
-    Column("instance_id", String, ForeignKey("instances.id"), primary_key=True),
-    Column("file_hash", String, ForeignKey("files.sha256"), primary_key=True),
-    Column("path", String, nullable=False), 
-    # === НОВОЕ ПОЛЕ ===
-    Column("side", Enum(SideType), default=SideType.BOTH, nullable=False)
+    Column("version_id", Integer, ForeignKey("instance_versions.id", ondelete="CASCADE"), primary_key=True),
+    Column("path", String, primary_key=True),
+    Column("file_hash", String, ForeignKey("files.sha256"), nullable=True),
+    Column("side", Enum(SideType), default=SideType.BOTH, nullable=False),
+    # Поиск осиротевших файлов
+    Index("ix_version_files_file_hash", "file_hash"),
 )
 
+class InstanceVersion(Base):
+    __tablename__ = "instance_versions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    instance_id: Mapped[str] = mapped_column(String(50), ForeignKey("instances.id", ondelete="CASCADE"), nullable=False, index=True)
+    # Родитель для diff; NULL — полный снимок
+    parent_id: Mapped[int] = mapped_column(Integer, ForeignKey("instance_versions.id"), nullable=True)
+    # Сколько diff-звеньев до полного снимка (ограничено, см. MAX_VERSION_DEPTH)
+    depth: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    comment: Mapped[str] = mapped_column(String(255), nullable=True)
+    # Итог по набору файлов версии (считается при публикации)
+    files_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    total_size: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
 # --- Пользователи ---
 class User(Base):
     __tablename__ = "users"
+    # Поиск по нику без учета регистра (hasJoined, пакетный поиск профилей)
+    __table_args__ = (Index("ix_users_username_lower", text("lower(username)")),)
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False, index=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
     role: Mapped[str] = mapped_column(String(20), default="student") 
     is_banned: Mapped[bool] = mapped_column(Boolean, default=False)
     mc_uuid: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    # Скин/плащ — sha256 текстуры в бакете (textures/<hash>)
+    skin_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+    skin_model: Mapped[str] = mapped_column(String(10), default="classic")  # classic | slim
+    cape_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+    # Готовое base64-значение свойства textures (пересчитывается при изменении скина/ника)
+    textures_property: Mapped[str] = mapped_column(Text, nullable=True)
+    # Подпись textures и id ключа, которым она сделана (при ротации переподписываем лениво)
+    textures_signature: Mapped[str] = mapped_column(Text, nullable=True)
+    textures_key_id: Mapped[str] = mapped_column(String(20), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 # --- Сборки ---
@@ -44,11 +75,13 @@ class Instance(Base):
     loader_type: Mapped[str] = mapped_column(String(20), nullable=False) 
     loader_version: Mapped[str] = mapped_column(String(50), nullable=True)
     manifest_url: Mapped[str] = mapped_column(String(255), nullable=True)
+    # Опубликованная версия: откат — смена этого указателя
+    current_version_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("instance_versions.id", use_alter=True, name="fk_instances_current_version"), nullable=True
+    )
 
-    files = relationship("File", secondary=instance_files, back_populates="instances", cascade="all, delete")
-    
-    # Связь с настройками SFTP
-    sftp_connection = relationship("SFTPConnection", uselist=False, back_populates="instance", cascade="all, delete-orphan")
+    # Связь с настройками SFTP (одна сборка может раздаваться на несколько серверов)
+    sftp_connections = relationship("SFTPConnection", back_populates="instance", cascade="all, delete-orphan", order_by="SFTPConnection.id")
 
 # --- Файлы ---
 class File(Base):
@@ -58,25 +91,39 @@ class File(Base):
     size: Mapped[int] = mapped_column(BigInteger, nullable=False)
     s3_path: Mapped[str] = mapped_column(String(255), nullable=False)
     uploaded_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    instances = relationship("Instance", secondary=instance_files, back_populates="files")
 
 # --- SFTP Connection (Соответствует твоей таблице в БД) ---
 class SFTPConnection(Base):
     __tablename__ = "sftp_connections"
+    __table_args__ = (UniqueConstraint("instance_id", "name", name="uq_sftp_connections_instance_name"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    instance_id: Mapped[str] = mapped_column(String, ForeignKey("instances.id"), nullable=False, unique=True)
+    instance_id: Mapped[str] = mapped_column(String, ForeignKey("instances.id"), nullable=False, index=True)
+    # Имя целевого сервера внутри сборки (survival, creative, event...)
+    name: Mapped[str] = mapped_column(String(50), nullable=False, default="main")
     
     host: Mapped[str] = mapped_column(String, nullable=False)
     port: Mapped[int] = mapped_column(Integer, default=22)
     username: Mapped[str] = mapped_column(String, nullable=False)
-    password: Mapped[str] = mapped_column(String, nullable=False)
+    # Для серверов с агентом SSH-пароль не нужен
+    password: Mapped[str] = mapped_column(String, nullable=True)
+
+    # sftp — бэкенд сам заливает файлы; agent — агент на сервере забирает их по токену
+    transport: Mapped[str] = mapped_column(String(10), default="sftp")
+    agent_token_hash: Mapped[str] = mapped_column(String(64), nullable=True, unique=True)
     
     # === НОВЫЕ ПОЛЯ ===
     # Если rcon_host не задан, используем host от SFTP
     rcon_host: Mapped[str] = mapped_column(String, nullable=True)
     rcon_port: Mapped[int] = mapped_column(Integer, default=25575)
     rcon_password: Mapped[str] = mapped_column(String, nullable=True)
+
+    # Игровой порт для Server List Ping (хост: game_host -> rcon_host -> host)
+    game_host: Mapped[str] = mapped_column(String, nullable=True)
+    game_port: Mapped[int] = mapped_column(Integer, default=25565)
+
+    # Папка мира относительно корня SFTP (для бэкапов)
+    world_path: Mapped[str] = mapped_column(String(255), default="world")
     
     # Настройки синхронизации
     sync_mods: Mapped[bool] = mapped_column(Boolean, default=True)
@@ -85,10 +132,44 @@ class SFTPConnection(Base):
     sync_resourcepacks: Mapped[bool] = mapped_column(Boolean, default=False)
     sync_scripts: Mapped[bool] = mapped_column(Boolean, default=False)
     
+    # Заливать в .staging/ и подменять папки rename'ом (с откатом через .previous/)
+    staged_deploy: Mapped[bool] = mapped_column(Boolean, default=False)
+    # Много мелких файлов — одним tar-архивом через SSH exec вместо сотен SFTP-запросов
+    bundle_transfer: Mapped[bool] = mapped_column(Boolean, default=False)
+    
     auto_sync: Mapped[bool] = mapped_column(Boolean, default=False)
     sync_interval_minutes: Mapped[int] = mapped_column(Integer, default=30)
     last_sync: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, onupdate=func.now(), nullable=True)
     
-    instance = relationship("Instance", back_populates="sftp_connection")
\ No newline at end of file
+    instance = relationship("Instance", back_populates="sftp_connections")
+
+# --- Бэкапы миров ---
+class WorldSnapshot(Base):
+    """Снапшот мира: сам список файлов и их чанков лежит в MinIO (manifest_path)"""
+    __tablename__ = "world_snapshots"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    instance_id: Mapped[str] = mapped_column(String, ForeignKey("instances.id", ondelete="CASCADE"), nullable=False, index=True)
+    target_id: Mapped[int] = mapped_column(Integer, ForeignKey("sftp_connections.id", ondelete="SET NULL"), nullable=True, index=True)
+    world_path: Mapped[str] = mapped_column(String(255), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), default="running")  # running | success | failed
+    manifest_path: Mapped[str] = mapped_column(String(255), nullable=True)
+    files_count: Mapped[int] = mapped_column(Integer, default=0)
+    files_changed: Mapped[int] = mapped_column(Integer, default=0)
+    total_bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+    # Сколько байт реально легло в хранилище (новые чанки)
+    new_bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+    error: Mapped[str] = mapped_column(String(1000), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+class BackupChunk(Base):
+    """Чанк бэкапа (content-defined chunking), общий для всех снапшотов всех серверов"""
+    __tablename__ = "backup_chunks"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    s3_path: Mapped[str] = mapped_column(String(255), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -1,16 +1,21 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Body, Path, Query
 from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, or_, func, update
+from sqlalchemy import select, func
 from starlette.concurrency import run_in_threadpool
-from app.database import async_session_factory, minio_client
-from app.models import Instance, File as FileModel, instance_files, User, SideType
+from app.database import minio_client
+from app.models import Instance, InstanceVersion, File as FileModel, SideType, WorldSnapshot
 from app.utils import calculate_sha256, validate_uploaded_archive, get_current_admin, generate_instance_id, get_db, validate_instance_id, validate_file_path
 import rarfile
-from app.schemas import AdminInstanceView, FileNode, ConfigUpdateRequest, FileUpdateSide
+from app.schemas import AdminInstanceView, FileNode, ConfigUpdateRequest, FileUpdateSide, InstanceVersionView, VersionRollbackRequest, InstanceCloneRequest, FileBulkRequest, Principal
 from app.services.sftp_sync import SFTPSyncService
+from app.services.agent_manifest import publish_instance_update
+from app.services.instance_versions import (
+    resolved_files, get_entries, start_version, snapshot_version, put_files, publish_version,
+    list_versions, prune_versions, delete_orphan_files,
+    bulk_set_side, bulk_delete, bulk_move, drop_base_tombstones, set_current_version,
+)
 from typing import List
-from pydantic import BaseModel
 import zipfile
 import io
 import os
@@ -30,15 +35,84 @@ def decode_archive_filename(filename: str, archive_type: str) -> str:
     except:
         return filename
 
+def archive_entries(archive_obj, archive_type: str):
+    """
+    Файлы архива, которые попадут в сборку: (file_info, имя в архиве, путь в сборке, сторона, явная ли сторона).
+    Явная — из префикса client-mods/ или server-mods/, остальное угадывается по пути.
+    """
+    for file_info in archive_obj.infolist():
+        is_dir = file_info.is_dir() if archive_type == 'zip' else file_info.isdir()
+        if is_dir: continue
+        fixed_filename = decode_archive_filename(file_info.filename, archive_type)
+        if not validate_file_path(fixed_filename): continue
+        if "__MACOSX" in fixed_filename or ".DS_Store" in fixed_filename: continue
+
+        # === SIDE LOGIC ===
+        side = SideType.BOTH
+        explicit = False
+        final_path = fixed_filename
+        if fixed_filename.startswith("client-mods/"):
+            side = SideType.CLIENT
+            explicit = True
+            final_path = fixed_filename.replace("client-mods/", "mods/", 1)
+        elif fixed_filename.startswith("server-mods/"):
+            side = SideType.SERVER
+            explicit = True
+            final_path = fixed_filename.replace("server-mods/", "mods/", 1)
+        elif fixed_filename.startswith("shaderpacks/"):
+            side = SideType.CLIENT
+        elif fixed_filename.startswith("resourcepacks/"):
+            side = SideType.CLIENT
+
+        if "tlskincape" in fixed_filename.lower() or "optifine" in fixed_filename.lower():
+            side = SideType.CLIENT
+
+        yield file_info, fixed_filename, final_path, side, explicit
+
+async def get_instance_or_404(db: AsyncSession, instance_id: str) -> Instance:
+    instance = (await db.execute(select(Instance).where(Instance.id == instance_id))).scalars().first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    return instance
+
+async def commit_change(db: AsyncSession, instance: Instance, comment: str, rows: list) -> InstanceVersion:
+    """Изменение файлов сборки = новая версия-diff поверх текущей + уведомление агентов"""
+    version = await start_version(db, instance, comment)
+    await put_files(db, version, rows)
+    await publish_version(db, instance, version)
+    await publish_instance_update(instance.id)
+    return version
+
+async def store_blob(db: AsyncSession, content: bytes, filename: str) -> str:
+    """Кладет содержимое в хранилище (если такого хеша еще нет) и возвращает хеш"""
+    file_hash = calculate_sha256(content)
+    existing = (await db.execute(select(FileModel).where(FileModel.sha256 == file_hash))).scalars().first()
+    if existing:
+        return file_hash
+
+    s3_path = f"objects/{file_hash[:2]}/{file_hash}"
+    db.add(FileModel(sha256=file_hash, filename=filename, size=len(content), s3_path=s3_path))
+    await db.flush()
+    try:
+        if not await run_in_threadpool(minio_client.bucket_exists, BUCKET_NAME):
+            await run_in_threadpool(minio_client.make_bucket, BUCKET_NAME)
+    except Exception:
+        pass
+    await run_in_threadpool(
+        minio_client.put_object, BUCKET_NAME, s3_path, io.BytesIO(content), length=len(content)
+    )
+    return file_hash
+
 @router.get("/instances", response_model=List[AdminInstanceView])
 async def get_admin_instances(
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin) 
+    current_admin: Principal = Depends(get_current_admin) 
 ):
+    # Число файлов считается при публикации версии — без пересчета по файлам
     stmt = (
-        select(Instance, func.count(instance_files.c.file_hash).label("files_count"))
-        .outerjoin(instance_files, Instance.id == instance_files.c.instance_id)
-        .group_by(Instance.id)
+        select(Instance, func.coalesce(InstanceVersion.files_count, 0).label("files_count"))
+        .outerjoin(InstanceVersion, Instance.current_version_id == InstanceVersion.id)
+        .order_by(Instance.id)
     )
     result = await db.execute(stmt)
     
@@ -56,13 +130,9 @@ async def delete_instance(
     instance_id: str = Path(..., regex=r"^[a-z0-9][a-z0-9-]*[a-z0-9]$", min_length=3, max_length=50),
     cleanup_remote: bool = Query(False),
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
-    stmt = select(Instance).where(Instance.id == instance_id)
-    instance = (await db.execute(stmt)).scalars().first()
-    
-    if not instance:
-        raise HTTPException(status_code=404, detail="Instance not found")
+    instance = await get_instance_or_404(db, instance_id)
 
     if cleanup_remote:
         try:
@@ -71,28 +141,26 @@ async def delete_instance(
         except Exception as e:
             logger.error(f"Remote cleanup failed: {e}")
 
-    await db.execute(
-        instance_files.delete().where(instance_files.c.instance_id == instance_id)
-    )
+    # Манифесты бэкапов миров лежат в MinIO — строки снапшотов уйдут каскадом, а их нет
+    manifests = (await db.execute(
+        select(WorldSnapshot.manifest_path)
+        .where(WorldSnapshot.instance_id == instance_id, WorldSnapshot.manifest_path.isnot(None))
+    )).scalars().all()
+
+    # Версии и их файлы, снапшоты миров удаляются каскадом вместе со сборкой
     await db.delete(instance)
-    
-    orphan_stmt = select(FileModel).outerjoin(
-        instance_files, FileModel.sha256 == instance_files.c.file_hash
-    ).where(instance_files.c.instance_id == None)
-    
-    orphans = (await db.execute(orphan_stmt)).scalars().all()
-    deleted_files_count = 0
-    deleted_size_bytes = 0
+    await db.flush()
 
-    for file_obj in orphans:
-        try:
-            await run_in_threadpool(minio_client.remove_object, BUCKET_NAME, file_obj.s3_path)
-        except: pass
-        await db.delete(file_obj)
-        deleted_files_count += 1
-        deleted_size_bytes += file_obj.size
+    deleted_files_count, deleted_size_bytes = await delete_orphan_files(db)
 
     await db.commit()
+
+    # Чанки бэкапов общие для всех серверов — их убирает tools/gc_minio.py
+    for manifest_path in manifests:
+        try:
+            await run_in_threadpool(minio_client.remove_object, BUCKET_NAME, manifest_path)
+        except Exception as e:
+            logger.warning(f"⚠️ Cannot remove backup manifest {manifest_path}: {e}")
     return {"status": "deleted", "gc_stats": {"files": deleted_files_count, "mb": round(deleted_size_bytes/1024/1024, 2)}}
 @router.post("/upload-zip")
 async def upload_instance_zip(
@@ -101,49 +169,39 @@ async def upload_instance_zip(
     mc_version: str = Form(...),
     loader_type: str = Form("forge"),
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     instance_id = generate_instance_id(title, mc_version)
     archive_buffer, archive_type = await validate_uploaded_archive(file)
     
     stmt = select(Instance).where(Instance.id == instance_id)
-    if not (await db.execute(stmt)).scalars().first():
-        db.add(Instance(id=instance_id, title=title, mc_version=mc_version, loader_type=loader_type))
-    else:
-        await db.execute(instance_files.delete().where(instance_files.c.instance_id == instance_id))
-    
-    await db.flush()
+    instance = (await db.execute(stmt)).scalars().first()
+    if not instance:
+        instance = Instance(id=instance_id, title=title, mc_version=mc_version, loader_type=loader_type)
+        db.add(instance)
+        await db.flush()
+
+    # Архив — полный новый набор файлов: новая базовая версия.
+    # Прежняя остается в истории, откат на нее — POST /instances/{id}/rollback
+    version = await start_version(db, instance, f"Upload {file.filename}", base=True)
+    rows = []
 
     processed = 0
     skipped = 0
     uploaded_paths = []
+    seen_paths = set()
+    conflicts = []
 
     try:
         archive_obj = zipfile.ZipFile(archive_buffer) if archive_type == 'zip' else rarfile.RarFile(archive_buffer)
         with archive_obj:
-            for file_info in archive_obj.infolist():
-                is_dir = file_info.is_dir() if archive_type == 'zip' else file_info.isdir()
-                if is_dir: continue
-                fixed_filename = decode_archive_filename(file_info.filename, archive_type)
-                if not validate_file_path(fixed_filename): continue
-                if "__MACOSX" in fixed_filename or ".DS_Store" in fixed_filename: continue
-
-                # === SIDE LOGIC ===
-                side = SideType.BOTH
-                final_path = fixed_filename
-                if fixed_filename.startswith("client-mods/"):
-                    side = SideType.CLIENT
-                    final_path = fixed_filename.replace("client-mods/", "mods/", 1)
-                elif fixed_filename.startswith("server-mods/"):
-                    side = SideType.SERVER
-                    final_path = fixed_filename.replace("server-mods/", "mods/", 1)
-                elif fixed_filename.startswith("shaderpacks/"):
-                    side = SideType.CLIENT
-                elif fixed_filename.startswith("resourcepacks/"):
-                    side = SideType.CLIENT
-                
-                if "tlskincape" in fixed_filename.lower() or "optifine" in fixed_filename.lower():
-                    side = SideType.CLIENT
+            for file_info, fixed_filename, final_path, side, _ in archive_entries(archive_obj, archive_type):
+                # Путь в сборке уникален: client-mods/x.jar и server-mods/x.jar оба
+                # ложатся в mods/x.jar — оставляем первый, остальные в отчет
+                if final_path in seen_paths:
+                    conflicts.append(fixed_filename)
+                    continue
+                seen_paths.add(final_path)
 
                 file_data = archive_obj.read(file_info)
                 file_hash = calculate_sha256(file_data)
@@ -163,13 +221,10 @@ async def upload_instance_zip(
                 else:
                     skipped += 1
 
-                await db.execute(instance_files.insert().values(
-                    instance_id=instance_id,
-                    file_hash=file_hash,
-                    path=final_path,
-                    side=side
-        ))
-        await db.commit() 
+                rows.append({"path": final_path, "file_hash": file_hash, "side": side})
+
+        await put_files(db, version, rows)
+        await publish_version(db, instance, version)
     except Exception as e:
         await db.rollback()
         for p in uploaded_paths:
@@ -177,23 +232,168 @@ async def upload_instance_zip(
                 minio_client.remove_object(BUCKET_NAME, p)
             except:
                 pass
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
     
-    return {"status": "success", "stats": {"new_files_uploaded": processed, "files_deduplicated": skipped}}
+    if conflicts:
+        logger.warning(f"⚠️ {instance_id}: {len(conflicts)} archive entries skipped, path already taken")
+    await publish_instance_update(instance_id)
+    return {"status": "success", "stats": {"new_files_uploaded": processed, "files_deduplicated": skipped, "path_conflicts": conflicts}}
+
+@router.post("/instances/{instance_id}/patch")
+async def patch_instance(
+    instance_id: str,
+    file: UploadFile = File(None),
+    delete_paths: List[str] = Form([]),
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """
+    Патч поверх текущей версии: архив с добавленными/измененными файлами и
+    список путей на удаление. Остальные файлы сборки не трогаются.
+    Сторона существующего файла сохраняется, если архив не задает ее явно
+    (client-mods/, server-mods/). Заливаются только блобы, которых еще нет в files.
+    """
+    instance = await get_instance_or_404(db, instance_id)
+    if file is None and not delete_paths:
+        raise HTTPException(status_code=400, detail="Nothing to patch")
+    for path in delete_paths:
+        if not validate_file_path(path):
+            raise HTTPException(status_code=400, detail=f"Invalid path: {path}")
+
+    changes = {}  # path -> {"path", "file_hash", "side"}
+    conflicts = []
+    unchanged = 0
+    uploaded_paths = []
+
+    existing = await get_entries(db, instance.current_version_id, delete_paths)
+    missing = [path for path in delete_paths if path not in existing]
+    for path in existing:
+        changes[path] = {"path": path, "file_hash": None, "side": None}
+
+    try:
+        if file is not None:
+            archive_buffer, archive_type = await validate_uploaded_archive(file)
+            archive_obj = zipfile.ZipFile(archive_buffer) if archive_type == 'zip' else rarfile.RarFile(archive_buffer)
+            with archive_obj:
+                # Первый проход: только хеши, содержимое не держим
+                entries = {}  # final_path -> (file_info, file_hash, side, explicit)
+                for file_info, fixed_filename, final_path, side, explicit in archive_entries(archive_obj, archive_type):
+                    if final_path in entries:
+                        conflicts.append(fixed_filename)
+                        continue
+                    entries[final_path] = (file_info, calculate_sha256(archive_obj.read(file_info)), side, explicit)
+
+                current = await get_entries(db, instance.current_version_id, list(entries))
+                # Какие блобы уже лежат в хранилище — один запрос на весь архив
+                hashes = {file_hash for _, file_hash, _, _ in entries.values()}
+                stored = set((await db.execute(
+                    select(FileModel.sha256).where(FileModel.sha256.in_(hashes))
+                )).scalars().all()) if hashes else set()
+
+                for final_path, (file_info, file_hash, side, explicit) in entries.items():
+                    if final_path in current and not explicit:
+                        side = current[final_path][1]
+                    if current.get(final_path) == (file_hash, side):
+                        # Тот же файл в архиве и в списке удаления — остается как был
+                        changes.pop(final_path, None)
+                        unchanged += 1
+                        continue
+                    changes[final_path] = {"path": final_path, "file_hash": file_hash, "side": side}
+
+                    if file_hash in stored:
+                        continue
+                    # Второй проход — только для новых блобов
+                    file_data = archive_obj.read(file_info)
+                    s3_path = f"objects/{file_hash[:2]}/{file_hash}"
+                    db.add(FileModel(sha256=file_hash, filename=os.path.basename(final_path), size=len(file_data), s3_path=s3_path))
+                    await db.flush()
+                    await run_in_threadpool(minio_client.put_object, BUCKET_NAME, s3_path, io.BytesIO(file_data), length=len(file_data))
+                    uploaded_paths.append(s3_path)
+                    stored.add(file_hash)
+
+        if changes:
+            version = await start_version(db, instance, f"Patch {file.filename if file else ''}".strip())
+            await put_files(db, version, list(changes.values()))
+            await publish_version(db, instance, version)
+    except Exception as e:
+        await db.rollback()
+        for p in uploaded_paths:
+            try:
+                minio_client.remove_object(BUCKET_NAME, p)
+            except:
+                pass
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Patch failed: {str(e)}")
+
+    if changes:
+        await publish_instance_update(instance_id)
+    deleted = sum(1 for row in changes.values() if row["file_hash"] is None)
+    return {
+        "status": "success" if changes else "unchanged",
+        "version_id": instance.current_version_id,
+        "stats": {
+            "changed": len(changes) - deleted,
+            "deleted": deleted,
+            "unchanged": unchanged,
+            "new_files_uploaded": len(uploaded_paths),
+            "path_conflicts": conflicts,
+            "missing_paths": missing,
+        },
+    }
+
+@router.post("/instances/{instance_id}/clone")
+async def clone_instance(
+    instance_id: str,
+    body: InstanceCloneRequest,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """
+    Копия сборки (тестовая, ивентовая): новая сборка получает полный снимок
+    текущей версии исходной. Блобы не копируются и не перехешируются —
+    только строки version_files одним INSERT ... SELECT.
+    """
+    source = await get_instance_or_404(db, instance_id)
+    mc_version = body.mc_version or source.mc_version
+    clone_id = generate_instance_id(body.title, mc_version)
+    if not validate_instance_id(clone_id):
+        raise HTTPException(status_code=400, detail="Invalid instance title")
+    if await db.get(Instance, clone_id):
+        raise HTTPException(status_code=409, detail=f"Instance {clone_id} already exists")
+
+    clone = Instance(
+        id=clone_id,
+        title=body.title,
+        mc_version=mc_version,
+        loader_type=source.loader_type,
+        loader_version=source.loader_version,
+    )
+    db.add(clone)
+    await db.flush()
+
+    version = await snapshot_version(
+        db, source.current_version_id, clone, f"Clone of {source.id} (version {source.current_version_id})"
+    )
+    await publish_version(db, clone, version)
+    return {"status": "cloned", "id": clone_id, "version_id": version.id, "files_count": version.files_count}
 
 @router.get("/instances/{instance_id}/files", response_model=List[FileNode])
 async def get_instance_files(
     instance_id: str,
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
-    if not (await db.execute(select(Instance).where(Instance.id == instance_id))).scalars().first():
-        raise HTTPException(status_code=404, detail="Instance not found")
+    instance = await get_instance_or_404(db, instance_id)
+    if instance.current_version_id is None:
+        return []
 
+    resolved = resolved_files(instance.current_version_id)
     stmt = (
-        select(FileModel, instance_files.c.path, instance_files.c.side)
-        .join(instance_files, FileModel.sha256 == instance_files.c.file_hash)
-        .where(instance_files.c.instance_id == instance_id)
+        select(FileModel, resolved.c.path, resolved.c.side)
+        .join(resolved, FileModel.sha256 == resolved.c.file_hash)
     )
     results = await db.execute(stmt)
     
@@ -210,18 +410,15 @@ async def update_file_side(
     instance_id: str,
     body: FileUpdateSide,
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
-    stmt = (
-        instance_files.update()
-        .where(instance_files.c.instance_id == instance_id)
-        .where(instance_files.c.path == body.path)
-        .values(side=body.side)
-    )
-    result = await db.execute(stmt)
-    await db.commit()
-    if result.rowcount == 0:
+    instance = await get_instance_or_404(db, instance_id)
+    entry = (await get_entries(db, instance.current_version_id, [body.path])).get(body.path)
+    if entry is None:
         raise HTTPException(status_code=404, detail="File not found")
+    await commit_change(db, instance, f"Side {body.side.value}: {body.path}", [
+        {"path": body.path, "file_hash": entry[0], "side": body.side}
+    ])
     return {"status": "updated"}
 
 @router.delete("/instances/{instance_id}/files")
@@ -229,31 +426,16 @@ async def delete_file(
     instance_id: str = Path(..., regex=r"^[a-z0-9][a-z0-9-]*[a-z0-9]$", min_length=3, max_length=50),
     path: str = Query(..., min_length=1, max_length=500),
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     if not validate_file_path(path):
         raise HTTPException(status_code=400, detail="Invalid file path")
-    result = await db.execute(
-        instance_files.delete()
-        .where(instance_files.c.instance_id == instance_id)
-        .where(instance_files.c.path == path)
-    )
-    
-    if result.rowcount == 0:
+    instance = await get_instance_or_404(db, instance_id)
+    if path not in await get_entries(db, instance.current_version_id, [path]):
         raise HTTPException(status_code=404, detail="File not found in instance")
-    
-    orphan_stmt = select(FileModel).outerjoin(
-        instance_files, FileModel.sha256 == instance_files.c.file_hash
-    ).where(instance_files.c.instance_id == None)
-    
-    orphans = (await db.execute(orphan_stmt)).scalars().all()
-    for file_obj in orphans:
-        try:
-            await run_in_threadpool(minio_client.remove_object, BUCKET_NAME, file_obj.s3_path)
-        except: pass
-        await db.delete(file_obj)
-    
-    await db.commit()
+
+    # Надгробие в новой версии; сам файл остается в истории (и в хранилище)
+    await commit_change(db, instance, f"Delete {path}", [{"path": path, "file_hash": None}])
     return {"status": "deleted", "path": path}
 
 @router.post("/instances/{instance_id}/files")
@@ -262,66 +444,82 @@ async def upload_single_file(
     path: str = Form(..., min_length=1, max_length=500),
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     if not validate_file_path(path):
         raise HTTPException(status_code=400, detail="Invalid file path")
+    instance = await get_instance_or_404(db, instance_id)
     content = await file.read()
-    file_hash = calculate_sha256(content)
-    file_size = len(content)
-    s3_path = f"objects/{file_hash[:2]}/{file_hash}"
-    
-    stmt = select(FileModel).where(FileModel.sha256 == file_hash)
-    existing = (await db.execute(stmt)).scalars().first()
-    
-    if not existing:
-        new_file = FileModel(
-            sha256=file_hash, filename=file.filename, size=file_size, s3_path=s3_path
-        )
-        db.add(new_file)
-        await db.flush()
-        
-        try:
-            if not await run_in_threadpool(minio_client.bucket_exists, BUCKET_NAME):
-                await run_in_threadpool(minio_client.make_bucket, BUCKET_NAME)
-        except Exception:
-            pass
-            
-        await run_in_threadpool(
-            minio_client.put_object, BUCKET_NAME, s3_path, io.BytesIO(content), length=file_size
-        )
-    
-    await db.execute(
-        instance_files.delete()
-        .where(instance_files.c.instance_id == instance_id)
-        .where(instance_files.c.path == path)
-    )
-    
-    await db.execute(instance_files.insert().values(
-        instance_id=instance_id,
-        file_hash=file_hash,
-        path=path
-    ))
-    
-    await db.commit()
+    file_hash = await store_blob(db, content, file.filename)
+
+    # side у существующего файла сохраняется
+    entry = (await get_entries(db, instance.current_version_id, [path])).get(path)
+    side = entry[1] if entry else SideType.BOTH
+    await commit_change(db, instance, f"Upload {path}", [{"path": path, "file_hash": file_hash, "side": side}])
     return {"status": "uploaded", "path": path}
 
+@router.post("/instances/{instance_id}/files/bulk")
+async def bulk_file_operations(
+    instance_id: str,
+    body: FileBulkRequest,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """
+    Пачка операций (set_side / delete / move) по путям, папкам или glob-шаблонам.
+    Каждая операция — один INSERT ... SELECT по набору файлов, все вместе —
+    одна новая версия и одно уведомление агентов. Операции видят результат
+    предыдущих.
+    """
+    for index, operation in enumerate(body.operations):
+        if (operation.path is None) == (operation.pattern is None):
+            raise HTTPException(status_code=400, detail=f"Operation {index}: exactly one of path or pattern is required")
+        if not validate_file_path(operation.path or operation.pattern):
+            raise HTTPException(status_code=400, detail=f"Operation {index}: invalid path")
+        if operation.op == "set_side" and operation.side is None:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: side is required")
+        if operation.op == "move":
+            if not operation.target or not validate_file_path(operation.target):
+                raise HTTPException(status_code=400, detail=f"Operation {index}: invalid target")
+            many = operation.pattern is not None or operation.path.endswith("/")
+            if many != operation.target.endswith("/"):
+                raise HTTPException(status_code=400, detail=f"Operation {index}: folder and pattern moves need a folder target ending with '/'")
+
+    instance = await get_instance_or_404(db, instance_id)
+    current_version_id = instance.current_version_id
+    version = await start_version(db, instance, body.comment or f"Bulk: {len(body.operations)} operations")
+
+    results = []
+    for operation in body.operations:
+        if operation.op == "set_side":
+            affected = await bulk_set_side(db, version, operation.side, operation.path, operation.pattern)
+        elif operation.op == "delete":
+            affected = await bulk_delete(db, version, operation.path, operation.pattern)
+        else:
+            affected = await bulk_move(db, version, operation.target, operation.path, operation.pattern)
+        results.append({"op": operation.op, "affected": affected})
+
+    if not any(result["affected"] for result in results):
+        await db.rollback()
+        return {"status": "unchanged", "version_id": current_version_id, "results": results}
+
+    await drop_base_tombstones(db, version)
+    await publish_version(db, instance, version)
+    await publish_instance_update(instance.id)
+    return {"status": "success", "version_id": version.id, "results": results}
+
 @router.get("/instances/{instance_id}/config", response_class=PlainTextResponse)
 async def get_config_content(
     instance_id: str = Path(..., regex=r"^[a-z0-9][a-z0-9-]*[a-z0-9]$", min_length=3, max_length=50),
     path: str = Query(..., min_length=1, max_length=500),
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     if not validate_file_path(path):
         raise HTTPException(status_code=400, detail="Invalid file path")
-    stmt = (
-        select(FileModel)
-        .join(instance_files, FileModel.sha256 == instance_files.c.file_hash)
-        .where(instance_files.c.instance_id == instance_id)
-        .where(instance_files.c.path == path)
-    )
-    file_obj = (await db.execute(stmt)).scalars().first()
+    instance = await get_instance_or_404(db, instance_id)
+    entry = (await get_entries(db, instance.current_version_id, [path])).get(path)
+    file_obj = await db.get(FileModel, entry[0]) if entry else None
     
     if not file_obj:
         raise HTTPException(status_code=404, detail="File not found")
@@ -344,51 +542,64 @@ async def update_config_content(
     path: str = Query(..., min_length=1, max_length=500),
     body: ConfigUpdateRequest = Body(...),
     db: AsyncSession = Depends(get_db),
-    current_admin: User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     if not validate_file_path(path):
         raise HTTPException(status_code=400, detail="Invalid file path")
-    content_bytes = body.content.encode('utf-8')
-    file_hash = calculate_sha256(content_bytes)
-    file_size = len(content_bytes)
-    s3_path = f"objects/{file_hash[:2]}/{file_hash}"
-    
-    stmt = select(FileModel).where(FileModel.sha256 == file_hash)
-    existing = (await db.execute(stmt)).scalars().first()
-    
-    if not existing:
-        filename = os.path.basename(path)
-        new_file = FileModel(
-            sha256=file_hash, filename=filename, size=file_size, s3_path=s3_path
-        )
-        db.add(new_file)
-        await db.flush()
-        await run_in_threadpool(
-            minio_client.put_object, BUCKET_NAME, s3_path, io.BytesIO(content_bytes), length=file_size
-        )
-    
-    await db.execute(
-        instance_files.delete()
-        .where(instance_files.c.instance_id == instance_id)
-        .where(instance_files.c.path == path)
-    )
-    
-    await db.execute(instance_files.insert().values(
-        instance_id=instance_id,
-        file_hash=file_hash,
-        path=path
-    ))
-    
-    orphan_stmt = select(FileModel).outerjoin(
-        instance_files, FileModel.sha256 == instance_files.c.file_hash
-    ).where(instance_files.c.instance_id == None)
-    
-    orphans = (await db.execute(orphan_stmt)).scalars().all()
-    for file_obj in orphans:
-        try:
-            await run_in_threadpool(minio_client.remove_object, BUCKET_NAME, file_obj.s3_path)
-        except: pass
-        await db.delete(file_obj)
+    instance = await get_instance_or_404(db, instance_id)
+    file_hash = await store_blob(db, body.content.encode('utf-8'), os.path.basename(path))
 
-    await db.commit()
+    entry = (await get_entries(db, instance.current_version_id, [path])).get(path)
+    side = entry[1] if entry else SideType.BOTH
+    await commit_change(db, instance, f"Edit {path}", [{"path": path, "file_hash": file_hash, "side": side}])
     return {"status": "updated", "path": path}
+
+# --- Версии сборки ---
+@router.get("/instances/{instance_id}/versions", response_model=List[InstanceVersionView])
+async def get_instance_versions(
+    instance_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    instance = await get_instance_or_404(db, instance_id)
+    views = []
+    for version in await list_versions(db, instance_id):
+        view = InstanceVersionView.model_validate(version)
+        view.is_current = version.id == instance.current_version_id
+        views.append(view)
+    return views
+
+@router.post("/instances/{instance_id}/rollback")
+async def rollback_instance_version(
+    instance_id: str,
+    body: VersionRollbackRequest,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Откат = перевод указателя на прежнюю версию; файлы уже лежат в хранилище"""
+    instance = await get_instance_or_404(db, instance_id)
+    version = await db.get(InstanceVersion, body.version_id)
+    if not version or version.instance_id != instance_id:
+        raise HTTPException(status_code=404, detail="Version not found")
+
+    await set_current_version(db, instance, version.id)
+    await publish_instance_update(instance_id)
+    return {"status": "rolled_back", "version_id": version.id}
+
+@router.post("/instances/{instance_id}/versions/prune")
+async def prune_instance_versions(
+    instance_id: str,
+    keep: int = Query(10, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Чистка истории: остаются keep последних версий и то, от чего они зависят"""
+    instance = await get_instance_or_404(db, instance_id)
+    deleted_versions = await prune_versions(db, instance, keep)
+    deleted_files_count, deleted_size_bytes = await delete_orphan_files(db)
+    await db.commit()
+    return {
+        "status": "pruned",
+        "versions": deleted_versions,
+        "gc_stats": {"files": deleted_files_count, "mb": round(deleted_size_bytes/1024/1024, 2)},
+    }
@@ -0,0 +1,81 @@
+from fastapi import APIRouter, HTTPException, Header, Query, Response
+from sqlalchemy import select
+from app.database import async_session_factory
+from app.models import SFTPConnection
+from app.schemas import AgentReport
+from app.services.agent_manifest import get_instance_version, get_server_files, instance_topic, hash_agent_token
+from app.services.pubsub import notifier
+from app.services.sftp_sync import folders_to_sync
+from datetime import datetime
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/agent", tags=["Server Agent"])
+
+# Дольше не держим: прокси по дороге обычно рвут соединение через 60 с
+AGENT_MAX_WAIT = 55
+
+async def get_agent_target(authorization: Optional[str]) -> SFTPConnection:
+    # Отдельная короткая сессия: long-poll не должен держать соединение из пула БД
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Agent token required")
+    async with async_session_factory() as db:
+        stmt = select(SFTPConnection).where(
+            SFTPConnection.agent_token_hash == hash_agent_token(authorization[7:]),
+            SFTPConnection.transport == "agent"
+        )
+        target = (await db.execute(stmt)).scalars().first()
+    if not target:
+        raise HTTPException(status_code=401, detail="Invalid agent token")
+    return target
+
+@router.get("/manifest")
+async def get_manifest(
+    since: Optional[int] = Query(None, description="Version the agent already has"),
+    wait: int = Query(0, ge=0, le=AGENT_MAX_WAIT, description="Long-poll timeout, seconds"),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Манифест серверной части сборки для агента.
+    Если версия не изменилась с since — ждем публикации до wait секунд, затем 204.
+    """
+    target = await get_agent_target(authorization)
+    topic = instance_topic(target.instance_id)
+
+    future = await notifier.subscribe(topic) if since is not None and wait else None
+    version = await get_instance_version(target.instance_id)
+    if since is not None and version == since:
+        if future is not None:
+            await notifier.wait(topic, future, wait)
+            version = await get_instance_version(target.instance_id)
+        if version == since:
+            return Response(status_code=204)
+    elif future is not None:
+        notifier.discard(topic, future)
+
+    async with async_session_factory() as db:
+        files = await get_server_files(db, target.instance_id)
+
+    folders = folders_to_sync(target)
+    return {
+        "instance_id": target.instance_id,
+        "version": version,
+        "folders": folders,
+        "files": [f for f in files if f["path"].split("/", 1)[0] in folders],
+    }
+
+@router.post("/report")
+async def report(body: AgentReport, authorization: Optional[str] = Header(None)):
+    """Агент сообщает, какую версию применил"""
+    target = await get_agent_target(authorization)
+    if body.status == "success":
+        async with async_session_factory() as db:
+            config = await db.get(SFTPConnection, target.id)
+            config.last_sync = datetime.utcnow()
+            await db.commit()
+        logger.info(f"Agent [{target.instance_id}/{target.name}] applied version {body.version}")
+    else:
+        logger.warning(f"Agent [{target.instance_id}/{target.name}] failed version {body.version}: {body.message}")
+    return {"status": "ok"}
@@ -1,20 +1,18 @@
 # app/routes/auth.py
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.database import redis_client
 from app.models import User
 from app.utils import create_access_token, get_db
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from app.services.pubsub import notifier, notify
+from app.services.rate_limit import rate_limiter as limiter
 import uuid
 import os
 
 router = APIRouter(prefix="/api/auth", tags=["Auth"])
 
-limiter = Limiter(key_func=get_remote_address)
-
 ADMIN_IDS = [int(id) for id in os.getenv("ADMIN_IDS", "").split(",") if id]
 BOT_USERNAME = os.getenv("BOT_USERNAME", "vgltuminecraftbot")
 
@@ -57,13 +55,31 @@ async def bot_callback(data: BotCallback, db: AsyncSession = Depends(get_db)):
         )
         
         await redis_client.set(f"auth_code:{data.code}", access_token, ex=300)
+        # Будим браузер, который висит на /check/{code}
+        await notify(f"auth_code:{data.code}")
         return {"status": "ok", "role": "admin"}
 
     raise HTTPException(status_code=403, detail="User not authorized")
 
+# Дольше не держим: прокси по дороге обычно рвут соединение через 60 с
+AUTH_CHECK_MAX_WAIT = 30
+
 @router.get("/check/{code}")
-async def check_auth_status(code: str):
-    token = await redis_client.get(f"auth_code:{code}")
+async def check_auth_status(code: str, wait: int = Query(0, ge=0, le=AUTH_CHECK_MAX_WAIT)):
+    """
+    Long-poll: с wait > 0 ответ приходит сразу после подтверждения в боте
+    (или pending по таймауту). Ожидание — через общий pub/sub, без опроса Redis.
+    """
+    topic = f"auth_code:{code}"
+    # Подписываемся ДО чтения статуса, чтобы не пропустить подтверждение между ними
+    future = await notifier.subscribe(topic) if wait else None
+    token = await redis_client.get(topic)
+    if token == "pending" and future is not None:
+        await notifier.wait(topic, future, wait)
+        token = await redis_client.get(topic)
+    elif future is not None:
+        notifier.discard(topic, future)
+
     if not token:
         raise HTTPException(status_code=404, detail="Code expired")
     
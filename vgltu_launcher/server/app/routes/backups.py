@@ -0,0 +1,98 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from app.database import async_session_factory, redis_client, minio_client, BUCKET_NAME
+from app.models import SFTPConnection, WorldSnapshot
+from app.schemas import WorldSnapshotView, Principal
+from app.services.world_backup import WorldBackupService, iter_snapshot_tar, RUNNING_TIMEOUT
+from app.utils import get_db, get_current_admin
+from typing import List
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/backups", tags=["Backups"])
+
+# Держим ссылки на фоновые бэкапы, чтобы их не собрал GC
+_background_backups = set()
+BACKUP_LOCK_TTL = RUNNING_TIMEOUT
+
+def backup_lock_key(target_id: int) -> str:
+    return f"backup:lock:{target_id}"
+
+async def get_snapshot_or_404(db: AsyncSession, snapshot_id: int) -> WorldSnapshot:
+    snapshot = (await db.execute(select(WorldSnapshot).where(WorldSnapshot.id == snapshot_id))).scalars().first()
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return snapshot
+
+async def run_backup_job(target_id: int):
+    try:
+        async with async_session_factory() as db:
+            await WorldBackupService(db).backup_target(target_id)
+    except Exception as e:
+        logger.error(f"Backup of target {target_id} failed: {e}")
+    finally:
+        await redis_client.delete(backup_lock_key(target_id))
+
+@router.post("/{target_id}", status_code=202)
+async def start_backup(
+    target_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Запускает бэкап мира в фоне; результат — в списке снапшотов"""
+    if not (await db.execute(select(SFTPConnection.id).where(SFTPConnection.id == target_id))).first():
+        raise HTTPException(status_code=404, detail="Server not found")
+    if not await redis_client.set(backup_lock_key(target_id), "1", nx=True, ex=BACKUP_LOCK_TTL):
+        raise HTTPException(status_code=409, detail="Backup is already running for this server")
+
+    task = asyncio.create_task(run_backup_job(target_id))
+    _background_backups.add(task)
+    task.add_done_callback(_background_backups.discard)
+    return {"status": "started"}
+
+@router.get("/{target_id}", response_model=List[WorldSnapshotView])
+async def list_snapshots(
+    target_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    stmt = select(WorldSnapshot).where(WorldSnapshot.target_id == target_id).order_by(WorldSnapshot.id.desc())
+    return (await db.execute(stmt)).scalars().all()
+
+@router.get("/snapshots/{snapshot_id}/download")
+async def download_snapshot(
+    snapshot_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Мир из снапшота одним tar-потоком, собранным из чанков на лету"""
+    snapshot = await get_snapshot_or_404(db, snapshot_id)
+    if snapshot.status != "success":
+        raise HTTPException(status_code=409, detail="Snapshot is not complete")
+
+    manifest = await run_in_threadpool(WorldBackupService.load_manifest, snapshot)
+    filename = f"{snapshot.instance_id}-{snapshot.id}-{snapshot.created_at:%Y%m%d-%H%M}.tar"
+    return StreamingResponse(
+        iter_snapshot_tar(manifest),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.delete("/snapshots/{snapshot_id}")
+async def delete_snapshot(
+    snapshot_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Удаляет манифест; чанки, на которые больше никто не ссылается, убирает tools/gc_minio.py"""
+    snapshot = await get_snapshot_or_404(db, snapshot_id)
+    if snapshot.manifest_path:
+        await run_in_threadpool(minio_client.remove_object, BUCKET_NAME, snapshot.manifest_path)
+    await db.delete(snapshot)
+    await db.commit()
+    return {"status": "deleted"}
@@ -1,22 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends, Path, Query
+from fastapi import APIRouter, HTTPException, Depends, Path, Query, Header, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
-from app.models import Instance, File as FileModel, instance_files, SideType # <--- IMPORT SideType
-from app.schemas import InstanceManifest, FileManifest
-from app.utils import get_db, validate_instance_id
+from app.models import Instance
+from app.schemas import InstanceManifest, ServerStatus
+from app.services.server_status import get_instance_statuses
+from app.services.instance_versions import get_manifest_files, CLIENT_SIDES
+from app.utils import get_read_db
 from typing import List, Optional
 from pydantic import BaseModel
-import os
+import json
 
 router = APIRouter(prefix="/api/client", tags=["Client"])
 
-STORAGE_URL = os.getenv("STORAGE_BASE_URL", "http://localhost:9000/launcher-files")
-
 class InstanceSummary(BaseModel):
     id: str
     title: str
     mc_version: str
     loader_type: str
+    # Статус игровых серверов из кеша поллера (может быть пустым, если сервер не настроен)
+    servers: List[ServerStatus] = []
 
 class PaginatedInstances(BaseModel):
     items: List[InstanceSummary]
@@ -29,7 +31,7 @@ class PaginatedInstances(BaseModel):
 async def get_instances(
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(20, ge=1, le=100, description="Items per page"),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     count_result = await db.execute(select(func.count(Instance.id)))
     total = count_result.scalar() or 0
@@ -39,6 +41,7 @@ async def get_instances(
         select(Instance).offset(offset).limit(page_size)
     )
     instances = result.scalars().all()
+    statuses = await get_instance_statuses([i.id for i in instances])
     
     return PaginatedInstances(
         items=[
@@ -46,7 +49,8 @@ async def get_instances(
                 id=i.id,
                 title=i.title,
                 mc_version=i.mc_version,
-                loader_type=i.loader_type
+                loader_type=i.loader_type,
+                servers=statuses.get(i.id, [])
             ) for i in instances
         ],
         total=total,
@@ -58,7 +62,8 @@ async def get_instances(
 @router.get("/instances/{instance_id}/manifest", response_model=InstanceManifest)
 async def get_instance_manifest(
     instance_id: str = Path(..., regex=r"^[a-z0-9][a-z0-9-]*[a-z0-9]$", min_length=3, max_length=50),
-    db: AsyncSession = Depends(get_db)
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db)
 ):
     result = await db.execute(select(Instance).where(Instance.id == instance_id))
     instance = result.scalars().first()
@@ -66,32 +71,24 @@ async def get_instance_manifest(
     if not instance:
         raise HTTPException(status_code=404, detail="Instance not found")
 
-    # === ФИЛЬТРАЦИЯ СТОРОН ===
-    stmt = (
-        select(FileModel, instance_files.c.path)
-        .join(instance_files, FileModel.sha256 == instance_files.c.file_hash)
-        .where(instance_files.c.instance_id == instance_id)
-        # ⚠️ КРИТИЧНО: Исключаем файлы, которые только для сервера
-        .where(instance_files.c.side.in_([SideType.CLIENT, SideType.BOTH])) 
-    )
-    
-    files_result = await db.execute(stmt)
-    
-    manifest_files = []
-    for file_obj, install_path in files_result:
-        download_url = f"{STORAGE_URL}/{file_obj.s3_path}"
-        
-        manifest_files.append(FileManifest(
-            filename=file_obj.filename,
-            hash=file_obj.sha256,
-            size=file_obj.size,
-            path=install_path, 
-            url=download_url
-        ))
+    # Манифест однозначно задается версией: ETag — id версии,
+    # лаунчер с актуальной версией получает 304 без тела
+    etag = f'"v{instance.current_version_id or 0}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # === ФИЛЬТРАЦИЯ СТОРОН === (только CLIENT и BOTH; список по версии берется из кеша)
+    files = await get_manifest_files(db, instance.current_version_id, CLIENT_SIDES)
 
-    return InstanceManifest(
-        instance_id=instance_id,
-        mc_version=instance.mc_version,
-        loader_type=instance.loader_type,
-        files=manifest_files
-    )
\ No newline at end of file
+    # Собираем JSON сами: поля ровно как у InstanceManifest, без валидации тысяч FileManifest
+    manifest = {
+        "instance_id": instance_id,
+        "mc_version": instance.mc_version,
+        "loader_type": instance.loader_type,
+        "files": files,
+    }
+    return Response(
+        content=json.dumps(manifest),
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
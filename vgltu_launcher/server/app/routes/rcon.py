@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from app.models import SFTPConnection
+from app.schemas import RconCommandRequest, RconBatchRequest, RconBroadcastRequest, RconResult, Principal
+from app.services.rcon import rcon_manager, RCONError
+from app.utils import get_db, get_current_admin
+from typing import List
+import asyncio
+
+router = APIRouter(prefix="/api/admin/rcon", tags=["RCON"])
+
+async def get_target(db: AsyncSession, target_id: int) -> SFTPConnection:
+    target = (await db.execute(select(SFTPConnection).where(SFTPConnection.id == target_id))).scalars().first()
+    if not target:
+        raise HTTPException(status_code=404, detail="Server not found")
+    return target
+
+async def run_on_target(target: SFTPConnection, command: str) -> RconResult:
+    try:
+        response = await rcon_manager.client_for(target).command(command)
+        return RconResult(target_id=target.id, target_name=target.name, ok=True, response=response)
+    except RCONError as e:
+        return RconResult(target_id=target.id, target_name=target.name, ok=False, error=str(e))
+
+@router.post("/{target_id}/command", response_model=RconResult)
+async def send_command(
+    target_id: int,
+    body: RconCommandRequest,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    target = await get_target(db, target_id)
+    result = await run_on_target(target, body.command)
+    if not result.ok:
+        raise HTTPException(status_code=502, detail=result.error)
+    return result
+
+@router.post("/{target_id}/batch", response_model=List[RconResult])
+async def send_batch(
+    target_id: int,
+    body: RconBatchRequest,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Команды уходят по одному соединению подряд, ответы собираются по request id"""
+    target = await get_target(db, target_id)
+    return await asyncio.gather(*(run_on_target(target, command) for command in body.commands))
+
+@router.post("/broadcast", response_model=List[RconResult])
+async def broadcast(
+    body: RconBroadcastRequest,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Одна команда на все серверы (или на все серверы одной сборки) параллельно"""
+    stmt = select(SFTPConnection).where(SFTPConnection.rcon_password.isnot(None))
+    if body.instance_id:
+        stmt = stmt.where(SFTPConnection.instance_id == body.instance_id)
+    targets = (await db.execute(stmt.order_by(SFTPConnection.id))).scalars().all()
+    return await asyncio.gather(*(run_on_target(target, body.command) for target in targets))
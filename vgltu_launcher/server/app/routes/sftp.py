@@ -1,59 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Header
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.database import async_session_factory
+from app.database import async_session_factory, redis_client
 from app.models import SFTPConnection
-from app.schemas import SFTPConfigCreate, SFTPConfigResponse 
+from app.schemas import SFTPConfigCreate, SFTPConfigUpdate, Principal
 from app.services.sftp_sync import SFTPSyncService
+from app.services.agent_manifest import hash_agent_token, publish_instance_update
+from app.services.sync_events import SyncProgress, publish_sync_event, sse_sync_events, sync_lock_key
+from app.utils import get_current_admin, create_scoped_token, decode_scoped_token
+from typing import Optional
+import asyncio
+import logging
+import uuid
+import secrets
 # from app.utils import encrypt_password
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api/admin/sftp", tags=["SFTP"])
 
 async def get_db():
     async with async_session_factory() as session:
         yield session
 
-@router.get("/{instance_id}")
-async def get_config(instance_id: str, db: AsyncSession = Depends(get_db)):
-    stmt = select(SFTPConnection).where(SFTPConnection.instance_id == instance_id)
-    config = (await db.execute(stmt)).scalars().first()
-    
-    if not config:
-        raise HTTPException(status_code=404, detail="Config not found")
-    
+def serialize_config(config: SFTPConnection) -> dict:
     # === МАСКИРОВКА ПАРОЛЕЙ ===
     # Мы не отдаем пароли на фронт. Мы отдаем плейсхолдеры.
     return {
         "id": config.id,
         "instance_id": config.instance_id,
+        "name": config.name,
+        "transport": config.transport,
+        "has_agent_token": bool(config.agent_token_hash),
         "host": config.host,
         "port": config.port,
         "username": config.username,
         "rcon_host": config.rcon_host,
         "rcon_port": config.rcon_port,
+        "game_host": config.game_host,
+        "game_port": config.game_port,
+        "world_path": config.world_path,
 
         # Отдаем ******** если пароль есть, иначе пустую строку
         "password": "********" if config.password else "",
         "rcon_password": "********" if config.rcon_password else "",
-        
+
         # Остальные поля
         "sync_mods": config.sync_mods,
         "sync_config": config.sync_config,
-        # ... добавь остальные поля sync ...
+        "sync_scripts": config.sync_scripts,
+        "sync_shaderpacks": config.sync_shaderpacks,
+        "sync_resourcepacks": config.sync_resourcepacks,
+        "staged_deploy": config.staged_deploy,
+        "bundle_transfer": config.bundle_transfer,
         "last_sync": config.last_sync
     }
 
-@router.post("/{instance_id}")
-async def create_or_update_config(
-    instance_id: str, 
-    config: SFTPConfigCreate, 
-    db: AsyncSession = Depends(get_db)
-):
-    stmt = select(SFTPConnection).where(SFTPConnection.instance_id == instance_id)
-    existing = (await db.execute(stmt)).scalars().first()
-    
-    config_dict = config.dict(exclude_unset=True)
-    
+def strip_masked_passwords(config_dict: dict) -> dict:
     # === ЛОГИКА СОХРАНЕНИЯ ПАРОЛЕЙ ===
     # Если пароль пришел как "********", значит юзер его не менял -> удаляем из обновления
     if config_dict.get("password") == "********":
@@ -61,7 +65,7 @@ async def create_or_update_config(
     elif config_dict.get("password"):
         # TODO: Здесь вставь шифрование!
         # config_dict["password"] = encrypt_password(config_dict["password"])
-        pass 
+        pass
 
     if config_dict.get("rcon_password") == "********":
         del config_dict["rcon_password"]
@@ -69,6 +73,45 @@ async def create_or_update_config(
         # TODO: Здесь вставь шифрование!
         # config_dict["rcon_password"] = encrypt_password(config_dict["rcon_password"])
         pass
+    return config_dict
+
+async def get_target_or_404(db: AsyncSession, instance_id: str, target_id: int) -> SFTPConnection:
+    stmt = select(SFTPConnection).where(
+        SFTPConnection.instance_id == instance_id,
+        SFTPConnection.id == target_id
+    )
+    target = (await db.execute(stmt)).scalars().first()
+    if not target:
+        raise HTTPException(status_code=404, detail="Target not found")
+    return target
+
+# --- Один сервер на сборку (совместимость со старой админкой: работает с первым сервером) ---
+
+@router.get("/{instance_id}")
+async def get_config(
+    instance_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    stmt = select(SFTPConnection).where(SFTPConnection.instance_id == instance_id).order_by(SFTPConnection.id)
+    config = (await db.execute(stmt)).scalars().first()
+
+    if not config:
+        raise HTTPException(status_code=404, detail="Config not found")
+
+    return serialize_config(config)
+
+@router.post("/{instance_id}")
+async def create_or_update_config(
+    instance_id: str,
+    config: SFTPConfigCreate,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    stmt = select(SFTPConnection).where(SFTPConnection.instance_id == instance_id).order_by(SFTPConnection.id)
+    existing = (await db.execute(stmt)).scalars().first()
+
+    config_dict = strip_masked_passwords(config.dict(exclude_unset=True))
 
     if existing:
         for key, value in config_dict.items():
@@ -77,15 +120,172 @@ async def create_or_update_config(
         # При создании, если пароль не передан, будет ошибка (если поле nullable=False)
         new_config = SFTPConnection(instance_id=instance_id, **config_dict)
         db.add(new_config)
-    
+
     await db.commit()
     return {"status": "saved"}
 
-@router.post("/{instance_id}/sync")
-async def run_sync(instance_id: str, db: AsyncSession = Depends(get_db)):
+# --- Несколько серверов на сборку ---
+
+@router.get("/{instance_id}/targets")
+async def list_targets(
+    instance_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    stmt = select(SFTPConnection).where(SFTPConnection.instance_id == instance_id).order_by(SFTPConnection.id)
+    return [serialize_config(c) for c in (await db.execute(stmt)).scalars().all()]
+
+@router.post("/{instance_id}/targets")
+async def create_target(
+    instance_id: str,
+    config: SFTPConfigCreate,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    stmt = select(SFTPConnection).where(
+        SFTPConnection.instance_id == instance_id,
+        SFTPConnection.name == config.name
+    )
+    if (await db.execute(stmt)).scalars().first():
+        raise HTTPException(status_code=409, detail="Target with this name already exists")
+
+    target = SFTPConnection(instance_id=instance_id, **strip_masked_passwords(config.dict(exclude_unset=True)))
+    db.add(target)
+    await db.commit()
+    return {"status": "created", "id": target.id}
+
+@router.put("/{instance_id}/targets/{target_id}")
+async def update_target(
+    instance_id: str,
+    target_id: int,
+    config: SFTPConfigUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    target = await get_target_or_404(db, instance_id, target_id)
+    for key, value in strip_masked_passwords(config.dict(exclude_unset=True)).items():
+        setattr(target, key, value)
+    await db.commit()
+    if target.transport == "agent":
+        # Могли поменяться раздаваемые папки — агент должен перечитать манифест
+        await publish_instance_update(instance_id)
+    return {"status": "saved"}
+
+@router.post("/{instance_id}/targets/{target_id}/agent-token")
+async def issue_agent_token(
+    instance_id: str,
+    target_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """
+    Выдает новый токен агента (старый перестает работать) и переводит сервер на pull-режим.
+    Токен показывается один раз — в БД храним только sha256.
+    """
+    target = await get_target_or_404(db, instance_id, target_id)
+    token = secrets.token_urlsafe(32)
+    target.agent_token_hash = hash_agent_token(token)
+    target.transport = "agent"
+    await db.commit()
+    return {"status": "issued", "token": token}
+
+@router.delete("/{instance_id}/targets/{target_id}")
+async def delete_target(
+    instance_id: str,
+    target_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    target = await get_target_or_404(db, instance_id, target_id)
+    await db.delete(target)
+    await db.commit()
+    return {"status": "deleted"}
+
+# --- Операции ---
+
+# Держим ссылки на фоновые синхронизации, чтобы их не собрал GC
+_background_syncs = set()
+# Страховка: если процесс упал посреди синхронизации, блокировка сама истечет
+SYNC_LOCK_TTL = 3600
+
+async def run_sync_job(instance_id: str, target_id: Optional[int], sync_id: str):
+    """Фоновая синхронизация со своей сессией БД; прогресс уходит в Redis Stream"""
+    status, message = "error", ""
+    try:
+        async with async_session_factory() as db:
+            async with SyncProgress(instance_id, sync_id) as progress:
+                try:
+                    await SFTPSyncService(db).sync_instance(instance_id, target_id, progress)
+                    status, message = "success", "Sync finished"
+                except Exception as e:
+                    message = str(e)
+        await publish_sync_event(instance_id, sync_id, "done", message, status=status)
+    except Exception as e:
+        logger.error(f"Sync job {sync_id} for {instance_id} failed: {e}")
+    finally:
+        if await redis_client.get(sync_lock_key(instance_id)) == sync_id:
+            await redis_client.delete(sync_lock_key(instance_id))
+
+@router.post("/{instance_id}/sync", status_code=202)
+async def run_sync(
+    instance_id: str,
+    target_id: Optional[int] = Query(None, description="Sync only this target (default: all)"),
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """
+    Запускает синхронизацию в фоне и сразу отвечает.
+    Ход работы — через GET /{instance_id}/sync/events (SSE), начиная с last_event_id.
+    """
+    stmt = select(SFTPConnection.id).where(SFTPConnection.instance_id == instance_id)
+    if target_id is not None:
+        stmt = stmt.where(SFTPConnection.id == target_id)
+    if not (await db.execute(stmt)).first():
+        raise HTTPException(status_code=404, detail="SFTP configuration not found")
+
+    sync_id = uuid.uuid4().hex
+    if not await redis_client.set(sync_lock_key(instance_id), sync_id, nx=True, ex=SYNC_LOCK_TTL):
+        raise HTTPException(status_code=409, detail="Sync is already running for this instance")
+
+    last_event_id = await publish_sync_event(instance_id, sync_id, "queued", "Sync queued", target_id=target_id)
+    task = asyncio.create_task(run_sync_job(instance_id, target_id, sync_id))
+    _background_syncs.add(task)
+    task.add_done_callback(_background_syncs.discard)
+
+    # EventSource не умеет Authorization — поток событий открывается по короткому билету
+    events_ticket = create_scoped_token(
+        {"sub": str(current_admin.telegram_id), "instance_id": instance_id}, "sync_events", SYNC_LOCK_TTL
+    )
+    return {"status": "started", "sync_id": sync_id, "last_event_id": last_event_id, "events_ticket": events_ticket}
+
+@router.get("/{instance_id}/sync/events")
+async def sync_events(
+    instance_id: str,
+    request: Request,
+    ticket: str = Query(..., description="events_ticket from POST /{instance_id}/sync"),
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    if decode_scoped_token(ticket, "sync_events").get("instance_id") != instance_id:
+        raise HTTPException(status_code=403, detail="Ticket is for another instance")
+    # При автопереподключении EventSource сам шлет Last-Event-ID — он важнее query-параметра
+    return StreamingResponse(
+        sse_sync_events(instance_id, last_event_id_header or last_event_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/{instance_id}/rollback")
+async def run_rollback(
+    instance_id: str,
+    target_id: Optional[int] = Query(None, description="Roll back only this target (default: all)"),
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
     service = SFTPSyncService(db)
     try:
-        logs = await service.sync_instance(instance_id)
+        logs = await service.rollback_instance(instance_id, target_id)
         return {"status": "success", "logs": logs}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,81 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
+from app.models import User
+from app.schemas import AdminUserView, UserUpdateRequest, Principal
+from app.services.profile_cache import invalidate_profile
+from app.services.sessions import revoke_user_sessions
+from app.services.principal_cache import invalidate_principals
+from app.services.textures import apply_textures
+from app.utils import get_db, get_current_admin
+from typing import List, Optional
+import uuid
+
+router = APIRouter(prefix="/api/admin/users", tags=["Users"])
+
+async def get_user_or_404(db: AsyncSession, user_id: uuid.UUID) -> User:
+    user = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+@router.get("", response_model=List[AdminUserView])
+async def list_users(
+    search: Optional[str] = Query(None, max_length=50),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    stmt = select(User).order_by(User.created_at.desc())
+    if search:
+        stmt = stmt.where(func.lower(User.username).contains(search.lower()))
+    stmt = stmt.offset((page - 1) * page_size).limit(page_size)
+    return (await db.execute(stmt)).scalars().all()
+
+@router.patch("/{user_id}", response_model=AdminUserView)
+async def update_user(
+    user_id: uuid.UUID,
+    body: UserUpdateRequest,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    """Бан/разбан, переименование, смена роли. Кеш профиля сбрасывается сразу"""
+    user = await get_user_or_404(db, user_id)
+    old_username = user.username
+
+    if body.username is not None and body.username != user.username:
+        taken = (await db.execute(select(User.id).where(User.username == body.username))).first()
+        if taken:
+            raise HTTPException(status_code=409, detail="Username is already taken")
+        user.username = body.username
+        # В свойстве textures зашит ник — пересобираем
+        apply_textures(user)
+    if body.role is not None:
+        user.role = body.role
+    if body.is_banned is not None:
+        user.is_banned = body.is_banned
+
+    await db.commit()
+    await invalidate_profile(user, old_username)
+    await invalidate_principals(user.id)
+    if user.is_banned or user.username != old_username:
+        # Бан или новый ник — выкидываем из всех лаунчеров, пусть войдут заново
+        await revoke_user_sessions(user.id)
+    return user
+
+@router.delete("/{user_id}")
+async def delete_user(
+    user_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    current_admin: Principal = Depends(get_current_admin)
+):
+    user = await get_user_or_404(db, user_id)
+    if user.id == current_admin.id:
+        raise HTTPException(status_code=400, detail="You cannot delete yourself")
+    await db.delete(user)
+    await db.commit()
+    await invalidate_profile(user)
+    await revoke_user_sessions(user.id)
+    await invalidate_principals(user.id)
+    return {"status": "deleted"}
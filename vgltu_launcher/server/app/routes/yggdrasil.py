@@ -1,11 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Request
+from fastapi import APIRouter, HTTPException, Depends, status, Request, Response, UploadFile, File, Form, Header, Path
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.models import User
-from app.schemas import AuthenticateRequest, AuthenticateResponse, JoinRequest, UserCreate
+from app.schemas import AuthenticateRequest, AuthenticateResponse, JoinRequest, UserCreate, RefreshRequest, ValidateRequest, SignoutRequest
 from app.database import redis_client
-from app.utils import get_db
-from slowapi.util import get_remote_address
+from app.utils import get_db, get_read_db
+from app.services.profile_cache import profile_name_key, load_profile_by_name, get_profile_by_uuid, get_profiles_by_names, public_profile, build_profile, store_profile, ensure_signed
+from app.services.sessions import create_session, get_session, delete_session, revoke_user_sessions, join_session
+from app.services.textures import SKIN_DOMAINS, TEXTURE_MAX_BYTES, TextureError, validate_texture, store_texture, apply_textures
+from app.services.signing import signing_keys
+from app.services.rate_limit import rate_limiter as limiter, client_ip
+from typing import List, Optional
 import uuid
 import json
 
@@ -24,8 +30,9 @@ async def authserver_metadata():
             "feature.legacy_skin_api": True,
             "feature.enable_profile_key": False
         },
-        "skinDomains": ["localhost"]
-        # signaturePublickey не указываем — скины без подписи
+        "skinDomains": SKIN_DOMAINS,
+        # Публичный ключ активной подписи — им authlib-injector проверяет textures
+        "signaturePublickey": signing_keys.public_key_pem()
     }
 
 # Хелпер: UUID в формат без дефисов (Mojang style)
@@ -58,42 +65,40 @@ async def dev_create_user(user_data: UserCreate, db: AsyncSession = Depends(get_
         return {"error": str(e)}
 
 # --- Rate Limiter ---
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-limiter = Limiter(key_func=get_remote_address)
+# Ключи эндпоинтов учитывают NAT: компьютерный класс выходит в сеть с одного IP,
+# поэтому вход лимитируется на пару IP+ник, а операции с токеном — на сам токен
+def by_ip_and_username(request: Request, kwargs) -> str:
+    return f"{client_ip(request.scope)}:{kwargs['payload'].username.lower()}"
+
+def by_access_token(request: Request, kwargs) -> str:
+    return kwargs["payload"].accessToken
+
+def by_player(request: Request, kwargs) -> str:
+    return kwargs["player_uuid"]
 
 # --- 1. AUTHSERVER: Вход (Вызывает Лаунчер) ---
 @router.post("/authserver/authenticate", response_model=AuthenticateResponse)
-@limiter.limit("10/minute")
+@limiter.limit("10/minute", key_func=by_ip_and_username)
 async def authenticate(
     request: Request,
     payload: AuthenticateRequest, 
     db: AsyncSession = Depends(get_db)
 ):
-    # Rate limiting настроен глобально в main.py через SlowAPIMiddleware
+    # Лимит группы yggdrasil — в RateLimitMiddleware (main.py), здесь — на IP+ник
     # 1. Ищем юзера по нику (в будущем тут будет проверка JWT от телеги)
     # Пока считаем, что payload.password - это секрет, или просто пускаем по нику для теста
     result = await db.execute(select(User).where(User.username == payload.username))
     user = result.scalars().first()
 
-    if not user:
+    if not user or user.is_banned:
         raise HTTPException(status_code=403, detail="Invalid credentials")
 
-    # 2. Генерируем Access Token (сессионный ключ для игры)
-    access_token = uuid.uuid4().hex
+    # 2. Генерируем Access Token и сохраняем сессию в Redis (живет сутки)
+    # Hash "ygg:session:<access_token>" + индекс сессий юзера — одним скриптом
     client_token = payload.clientToken or uuid.uuid4().hex
+    access_token = await create_session(str(user.id), user.username, to_hex(user.mc_uuid), client_token)
 
-    # 3. Сохраняем сессию в Redis (живет 24 часа)
-    # Ключ: "token:<access_token>" -> Значение: JSON с данными
-    session_data = {
-        "user_id": str(user.id),
-        "username": user.username,
-        "mc_uuid": to_hex(user.mc_uuid),
-        "ip": "127.0.0.1" # В реале брать из request.client.host
-    }
-    await redis_client.set(f"session:{access_token}", json.dumps(session_data), ex=86400)
-
-    # 4. Ответ в формате Yggdrasil
+    # 3. Ответ в формате Yggdrasil
     profile = {"id": to_hex(user.mc_uuid), "name": user.username}
     
     return {
@@ -104,68 +109,115 @@ async def authenticate(
         "user": {"id": to_hex(user.mc_uuid), "properties": []}
     }
 
+# --- 1.1 AUTHSERVER: Refresh (лаунчер продлевает сессию без повторного входа) ---
+@router.post("/authserver/refresh", response_model=AuthenticateResponse)
+@limiter.limit("30/minute", key_func=by_access_token)
+async def refresh(request: Request, payload: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    session = await get_session(payload.accessToken, payload.clientToken)
+    if not session:
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    # Профиль из кеша: заодно ловим бан и переименование с момента входа
+    profile = await get_profile_by_uuid(db, from_hex(session["mc_uuid"]))
+    if not profile or profile["banned"]:
+        await delete_session(payload.accessToken, session)
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    # Старый токен больше не действует
+    await delete_session(payload.accessToken, session)
+    access_token = await create_session(session["user_id"], profile["name"], profile["id"], session["client_token"])
+
+    game_profile = {"id": profile["id"], "name": profile["name"]}
+    return {
+        "accessToken": access_token,
+        "clientToken": session["client_token"],
+        "selectedProfile": game_profile,
+        "availableProfiles": [game_profile],
+        "user": {"id": profile["id"], "properties": []} if payload.requestUser else None
+    }
+
+# --- 1.2 AUTHSERVER: Validate (токен еще действует?) ---
+@router.post("/authserver/validate", status_code=204)
+async def validate(payload: ValidateRequest):
+    if not await get_session(payload.accessToken, payload.clientToken):
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return Response(status_code=204)
+
+# --- 1.3 AUTHSERVER: Invalidate (выход из одного лаунчера) ---
+@router.post("/authserver/invalidate", status_code=204)
+async def invalidate(payload: ValidateRequest):
+    session = await get_session(payload.accessToken, payload.clientToken)
+    if session:
+        await delete_session(payload.accessToken, session)
+    return Response(status_code=204)
+
+# --- 1.4 AUTHSERVER: Signout (выход отовсюду) ---
+@router.post("/authserver/signout", status_code=204)
+@limiter.limit("10/minute", key_func=by_ip_and_username)
+async def signout(request: Request, payload: SignoutRequest, db: AsyncSession = Depends(get_db)):
+    # Та же проверка учетных данных, что и в authenticate
+    result = await db.execute(select(User).where(User.username == payload.username))
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=403, detail="Invalid credentials")
+    await revoke_user_sessions(user.id)
+    return Response(status_code=204)
+
 # --- 2. SESSIONSERVER: Join (Вызывает Клиент Игры) ---
 @router.post("/sessionserver/session/minecraft/join")
-@limiter.limit("30/minute")
+@limiter.limit("30/minute", key_func=by_access_token)
 async def join_server(request: Request, payload: JoinRequest):
     # Клиент говорит: "Я (accessToken) хочу зайти на сервер (serverId)"
     
-    # 1. Проверяем токен в Redis
-    data_raw = await redis_client.get(f"session:{payload.accessToken}")
-    if not data_raw:
-        raise HTTPException(status_code=403, detail="Invalid session")
-    
-    session_data = json.loads(data_raw)
-    
-    # 2. Связываем ServerID с Юзером (Это проверит сервер Minecraft)
-    # Ключ: "join:<serverId>" -> Значение: username
+    # 1. Проверяем токен (и что он выдан этому профилю) и 2. связываем ServerID с юзером —
+    # одним скриптом в Redis. Ключ: "join:<serverId>" -> username, живет 60 сек.
     # Важно: ServerID генерируется клиентом и сервером на основе хешей, он уникален для сессии входа
-    await redis_client.set(f"join:{payload.serverId}", session_data["username"], ex=60) # Живет 60 сек
+    username = await join_session(payload.accessToken, payload.selectedProfile.replace("-", "").lower(), payload.serverId)
+    if not username:
+        raise HTTPException(status_code=403, detail="Invalid session")
 
     return status.HTTP_204_NO_CONTENT
 
 # --- 3. SESSIONSERVER: HasJoined (Вызывает Сервер Minecraft) ---
 @router.get("/sessionserver/session/minecraft/hasJoined")
-async def has_joined(username: str, serverId: str, ip: str = None, db: AsyncSession = Depends(get_db)):
+async def has_joined(username: str, serverId: str, ip: str = None, db: AsyncSession = Depends(get_read_db)):
     # Сервер спрашивает: "Чувак с ником X и id Y реально залогинился?"
     
-    # 1. Проверяем запись в Redis
-    real_username = await redis_client.get(f"join:{serverId}")
+    # 1. Запись о входе и кешированный профиль — одним походом в Redis
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(f"join:{serverId}")
+        pipe.get(profile_name_key(username))
+        real_username, cached_profile = await pipe.execute()
     
     if not real_username or real_username != username:
         # Либо сессия истекла, либо ник не совпадает (хакер)
         raise HTTPException(status_code=204) # 204 значит "Неа, не знаю такого"
 
-    # 2. Достаем профиль из БД
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalars().first()
-    
-    if not user:
+    # 2. Профиль из кеша; в БД идем только при промахе
+    profile = json.loads(cached_profile) if cached_profile else await load_profile_by_name(db, username)
+
+    # Ключ кеша без учета регистра, а ники в базе — с учетом: под ключом мог
+    # оказаться "Steve" вместо "steve". Тогда ищем точно, ключ не перезаписывая
+    if profile and profile["name"] != username:
+        profile = await load_profile_by_name(db, username, cache_name=False)
+    if not profile:
          raise HTTPException(status_code=204)
      
-    # 🔥🔥🔥 ВОТ СЮДА ВСТАВЛЯЕМ ПРОВЕРКУ 🔥🔥🔥
-    if user.is_banned:
+    if profile["banned"]:
         # Если юзер забанен, мы говорим серверу Майнкрафта, 
         # что такого игрока "как бы нет" или сессия невалидна.
         # Сервер Майнкрафта сам кикнет игрока с ошибкой "Authentication failed".
         raise HTTPException(status_code=204) 
-    # 🔥🔥🔥 КОНЕЦ ВСТАВКИ 🔥🔥🔥
 
-    # 3. Отдаем профиль (Тут в будущем будут Скины!)
+    # 3. Отдаем профиль (hasJoined всегда с подписью)
     # Формат ответа критически важен
-    return {
-        "id": to_hex(user.mc_uuid),
-        "name": user.username,
-        "properties": [
-            # Сюда потом вставим textures (base64)
-        ]
-    }
+    return public_profile(await ensure_signed(profile))
 
 # --- 4. SESSIONSERVER: Profile (Вызывает Клиент для получения профиля по UUID) ---
 # Два пути: authlib-injector может запрашивать с префиксом /authserver или без
 @router.get("/sessionserver/session/minecraft/profile/{player_uuid}")
 @router.get("/authserver/sessionserver/session/minecraft/profile/{player_uuid}")
-async def get_profile(player_uuid: str, unsigned: bool = True, db: AsyncSession = Depends(get_db)):
+async def get_profile(player_uuid: str, unsigned: bool = True, db: AsyncSession = Depends(get_read_db)):
     """
     Возвращает профиль игрока по UUID.
     Вызывается клиентом при создании мира, входе на сервер и т.д.
@@ -176,18 +228,93 @@ async def get_profile(player_uuid: str, unsigned: bool = True, db: AsyncSession
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    # Ищем юзера по mc_uuid
-    result = await db.execute(select(User).where(User.mc_uuid == parsed_uuid))
-    user = result.scalars().first()
+    # Ищем профиль по mc_uuid (кеш -> Redis -> БД)
+    profile = await get_profile_by_uuid(db, parsed_uuid)
     
-    if not user:
+    if not profile:
         raise HTTPException(status_code=204)  # Профиль не найден
     
-    # Возвращаем профиль в формате Yggdrasil
-    return {
-        "id": to_hex(user.mc_uuid),
-        "name": user.username,
-        "properties": [
-            # Текстуры скинов добавим позже
-        ]
-    }
\ No newline at end of file
+    # Возвращаем профиль в формате Yggdrasil (подпись — только по unsigned=false)
+    if not unsigned:
+        profile = await ensure_signed(profile)
+    return public_profile(profile, signed=not unsigned)
+
+# --- 5. API: Пакетный поиск профилей по никам (аналог api.mojang.com/profiles/minecraft) ---
+# Плагины вайтлистов/прав резолвят сотни ников разом — один запрос вместо сотни get_profile
+PROFILES_BULK_LIMIT = 1000
+
+@router.post("/api/profiles/minecraft")
+@limiter.limit("30/minute")
+async def bulk_profiles(request: Request, names: List[str], db: AsyncSession = Depends(get_read_db)):
+    if len(names) > PROFILES_BULK_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Too many names (max {PROFILES_BULK_LIMIT})")
+    if any(not name or len(name) > 16 for name in names):
+        raise HTTPException(status_code=400, detail="Invalid player name")
+
+    profiles = await get_profiles_by_names(db, names)
+    # Формат Mojang: только id и name, ненайденные ники просто пропускаются
+    return [{"id": p["id"], "name": p["name"]} for p in profiles]
+
+# --- 6. API: Загрузка скина/плаща (authlib-injector texture upload API) ---
+async def get_texture_owner(player_uuid: str, authorization: Optional[str], db: AsyncSession) -> User:
+    """Менять текстуры может только владелец профиля — по игровому accessToken"""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Access token required")
+    session = await get_session(authorization[7:])
+    if not session or session["mc_uuid"] != player_uuid.replace("-", "").lower():
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    user = (await db.execute(select(User).where(User.mc_uuid == from_hex(session["mc_uuid"])))).scalars().first()
+    if not user or user.is_banned:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return user
+
+async def save_textures(user: User, db: AsyncSession):
+    apply_textures(user)
+    await db.commit()
+    # Сразу кладем свежий профиль в кеш — следующий hasJoined уже с новым скином
+    await store_profile(build_profile(user))
+
+@router.put("/api/user/profile/{player_uuid}/{texture_type}", status_code=204)
+@limiter.limit("10/minute", key_func=by_player)
+async def upload_texture(
+    request: Request,
+    player_uuid: str,
+    texture_type: str = Path(..., pattern="^(skin|cape)$"),
+    file: UploadFile = File(...),
+    model: str = Form(""),
+    authorization: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    user = await get_texture_owner(player_uuid, authorization, db)
+
+    data = await file.read(TEXTURE_MAX_BYTES + 1)
+    try:
+        validate_texture(data, texture_type)
+    except TextureError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    texture_hash = await run_in_threadpool(store_texture, data)
+    if texture_type == "skin":
+        user.skin_hash = texture_hash
+        user.skin_model = "slim" if model == "slim" else "classic"
+    else:
+        user.cape_hash = texture_hash
+    await save_textures(user, db)
+    return Response(status_code=204)
+
+@router.delete("/api/user/profile/{player_uuid}/{texture_type}", status_code=204)
+async def delete_texture(
+    player_uuid: str,
+    texture_type: str = Path(..., pattern="^(skin|cape)$"),
+    authorization: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    user = await get_texture_owner(player_uuid, authorization, db)
+    if texture_type == "skin":
+        user.skin_hash = None
+        user.skin_model = "classic"
+    else:
+        user.cape_hash = None
+    await save_textures(user, db)
+    return Response(status_code=204)
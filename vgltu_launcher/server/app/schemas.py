@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal
 from datetime import datetime
 import uuid
 from enum import Enum  # <--- NEW
@@ -33,6 +33,20 @@ class AuthenticateResponse(BaseModel):
     availableProfiles: List[GameProfile] = []
     user: Optional[Dict] = None
 
+class RefreshRequest(BaseModel):
+    accessToken: str
+    clientToken: Optional[str] = None
+    requestUser: bool = False
+    selectedProfile: Optional[GameProfile] = None
+
+class ValidateRequest(BaseModel):
+    accessToken: str
+    clientToken: Optional[str] = None
+
+class SignoutRequest(BaseModel):
+    username: str
+    password: str
+
 class JoinRequest(BaseModel):
     accessToken: str
     selectedProfile: str 
@@ -52,6 +66,17 @@ class FileManifest(BaseModel):
     url: str
     # side клиенту знать не обязательно, он получает уже отфильтрованный список
 
+class ServerStatus(BaseModel):
+    target_id: int
+    name: str
+    online: bool
+    players_online: int = 0
+    players_max: int = 0
+    motd: Optional[str] = None
+    version: Optional[str] = None
+    latency_ms: Optional[int] = None
+    checked_at: Optional[int] = None
+
 class InstanceManifest(BaseModel):
     instance_id: str
     mc_version: str
@@ -82,20 +107,63 @@ class FileUpdateSide(BaseModel):
     path: str
     side: SideType
 
+# --- Пакетные операции над файлами ---
+class FileBulkOperation(BaseModel):
+    op: Literal["set_side", "delete", "move"]
+    # Ровно одно из двух: путь (папка — с '/' на конце) или glob по пути
+    path: Optional[str] = Field(None, min_length=1, max_length=500)
+    pattern: Optional[str] = Field(None, min_length=1, max_length=500)
+    side: Optional[SideType] = None
+    target: Optional[str] = Field(None, min_length=1, max_length=500)
+
+class FileBulkRequest(BaseModel):
+    operations: List[FileBulkOperation] = Field(..., min_length=1, max_length=2000)
+    comment: Optional[str] = Field(None, max_length=255)
+
+# --- Версии сборки ---
+class InstanceVersionView(BaseModel):
+    id: int
+    parent_id: Optional[int] = None
+    depth: int
+    comment: Optional[str] = None
+    files_count: int
+    total_size: int
+    created_at: datetime
+    is_current: bool = False
+
+    class Config:
+        from_attributes = True
+
+class VersionRollbackRequest(BaseModel):
+    version_id: int
+
+class InstanceCloneRequest(BaseModel):
+    title: str = Field(..., min_length=1, max_length=100)
+    # Не задана — как у исходной сборки
+    mc_version: Optional[str] = Field(None, max_length=20)
+
 # --- SFTP Schemas ---
 class SFTPConfigBase(BaseModel):
+    name: str = Field("main", min_length=1, max_length=50)
+    transport: str = Field("sftp", pattern="^(sftp|agent)$")
     host: str
     port: int = 22
     username: str
     
     rcon_host: Optional[str] = None
     rcon_port: int = 25575
+
+    game_host: Optional[str] = None
+    game_port: int = 25565
+    world_path: str = "world"
     
     sync_mods: bool = True
     sync_config: bool = True
     sync_scripts: bool = False
     sync_shaderpacks: bool = False
     sync_resourcepacks: bool = False
+    staged_deploy: bool = False
+    bundle_transfer: bool = False
     auto_sync: bool = False
     sync_interval_minutes: int = 60
 
@@ -104,6 +172,8 @@ class SFTPConfigCreate(SFTPConfigBase):
     rcon_password: Optional[str] = None 
 
 class SFTPConfigUpdate(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=50)
+    transport: Optional[str] = Field(None, pattern="^(sftp|agent)$")
     host: Optional[str] = None
     port: Optional[int] = None
     username: Optional[str] = None
@@ -111,11 +181,16 @@ class SFTPConfigUpdate(BaseModel):
     rcon_host: Optional[str] = None
     rcon_port: Optional[int] = None
     rcon_password: Optional[str] = None
+    game_host: Optional[str] = None
+    game_port: Optional[int] = None
+    world_path: Optional[str] = None
     sync_mods: Optional[bool] = None
     sync_config: Optional[bool] = None
     sync_shaderpacks: Optional[bool] = None
     sync_resourcepacks: Optional[bool] = None
     sync_scripts: Optional[bool] = None
+    staged_deploy: Optional[bool] = None
+    bundle_transfer: Optional[bool] = None
     auto_sync: Optional[bool] = None
     sync_interval_minutes: Optional[int] = None
 
@@ -132,4 +207,72 @@ class SFTPConfigResponse(SFTPConfigBase):
 class SyncLog(BaseModel):
     status: str 
     details: str
-    timestamp: datetime
\ No newline at end of file
+    timestamp: datetime
+
+# --- RCON Schemas ---
+class RconCommandRequest(BaseModel):
+    command: str = Field(..., min_length=1, max_length=1000)
+
+class RconBatchRequest(BaseModel):
+    commands: List[str] = Field(..., min_length=1, max_length=50)
+
+class RconBroadcastRequest(BaseModel):
+    command: str = Field(..., min_length=1, max_length=1000)
+    instance_id: Optional[str] = None  # если не задан — на все серверы всех сборок
+
+class RconResult(BaseModel):
+    target_id: int
+    target_name: str
+    ok: bool
+    response: Optional[str] = None
+    error: Optional[str] = None
+
+# --- Агент на игровом сервере ---
+class AgentReport(BaseModel):
+    version: int
+    status: str = Field(..., pattern="^(success|error)$")
+    message: Optional[str] = Field(None, max_length=2000)
+
+# --- Бэкапы миров ---
+class WorldSnapshotView(BaseModel):
+    id: int
+    instance_id: str
+    target_id: Optional[int] = None
+    world_path: str
+    status: str
+    files_count: int
+    files_changed: int
+    total_bytes: int
+    new_bytes: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# --- Пользователи (админка) ---
+class AdminUserView(BaseModel):
+    id: uuid.UUID
+    telegram_id: int
+    username: str
+    role: str
+    is_banned: bool
+    mc_uuid: uuid.UUID
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class UserUpdateRequest(BaseModel):
+    username: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_]{3,16}$")
+    role: Optional[str] = Field(None, pattern="^(student|admin)$")
+    is_banned: Optional[bool] = None
+
+class Principal(BaseModel):
+    """Кто делает запрос в админке: то, что get_current_user держит в кеше вместо строки из users"""
+    id: uuid.UUID
+    telegram_id: int
+    username: str
+    role: str
+    is_banned: bool = False
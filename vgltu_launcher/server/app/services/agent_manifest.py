@@ -0,0 +1,39 @@
+import hashlib
+from app.database import redis_client
+from app.services.instance_versions import get_current_version_id, get_manifest_files, SERVER_SIDES
+from app.services.pubsub import notify
+
+
+def hash_agent_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def instance_version_key(instance_id: str) -> str:
+    return f"agent:version:{instance_id}"
+
+
+def instance_topic(instance_id: str) -> str:
+    return f"instance:{instance_id}"
+
+
+async def publish_instance_update(instance_id: str) -> int:
+    """
+    Вызывается после любого изменения файлов сборки: новая версия + будим long-poll агентов.
+    Сами агенты потом забирают манифест — бэкенд не ходит на серверы.
+    """
+    version = await redis_client.incr(instance_version_key(instance_id))
+    await notify(instance_topic(instance_id), str(version))
+    return version
+
+
+async def get_instance_version(instance_id: str) -> int:
+    return int(await redis_client.get(instance_version_key(instance_id)) or 0)
+
+
+async def get_server_files(db, instance_id: str) -> list:
+    """
+    Серверная часть (SERVER/BOTH) опубликованной версии сборки. Список кешируется
+    по id версии — сколько бы агентов ни пришло за обновлением, к БД будет один запрос.
+    """
+    version_id = await get_current_version_id(db, instance_id)
+    return await get_manifest_files(db, version_id, SERVER_SIDES)
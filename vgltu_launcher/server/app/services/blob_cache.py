@@ -0,0 +1,90 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from app.database import minio_client, BUCKET_NAME
+
+# Общий бюджет памяти на одну fan-out синхронизацию
+SFTP_BLOB_CACHE_MB = int(os.getenv("SFTP_BLOB_CACHE_MB", "256"))
+
+
+class BlobCache:
+    """
+    Ограниченный по размеру LRU-кеш блобов из MinIO на время одной синхронизации.
+    Несколько потоков (по одному на целевой сервер) просят одни и те же файлы
+    примерно в одном порядке — каждый блоб читается из хранилища один раз.
+    Слишком большие файлы (больше четверти бюджета) не кешируются, а стримятся напрямую.
+    """
+
+    def __init__(self, max_bytes: int = SFTP_BLOB_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_item = max_bytes // 4
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # sha256 -> bytes
+        self._size = 0
+        self._loading = {}          # sha256 -> Lock (один загрузчик на ключ)
+        self.storage_reads = 0
+
+    @contextmanager
+    def open(self, file_obj):
+        """Файлоподобный объект с содержимым блоба"""
+        if file_obj.size > self.max_item:
+            response = self._fetch(file_obj)
+            try:
+                yield response
+            finally:
+                response.close()
+                response.release_conn()
+            return
+        yield io.BytesIO(self.get(file_obj))
+
+    def get(self, file_obj) -> bytes:
+        key = file_obj.sha256
+        with self._lock:
+            data = self._hit(key)
+            if data is not None:
+                return data
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Пока ждали, соседний поток мог уже загрузить
+            with self._lock:
+                data = self._hit(key)
+            if data is not None:
+                return data
+
+            try:
+                response = self._fetch(file_obj)
+                try:
+                    data = response.read()
+                finally:
+                    response.close()
+                    response.release_conn()
+                with self._lock:
+                    self._store(key, data)
+            finally:
+                # И при ошибке MinIO: иначе блокировка ключа остается в _loading навсегда
+                with self._lock:
+                    self._loading.pop(key, None)
+            return data
+
+    def _fetch(self, file_obj):
+        with self._lock:
+            self.storage_reads += 1
+        return minio_client.get_object(BUCKET_NAME, file_obj.s3_path)
+
+    def _hit(self, key):
+        data = self._data.get(key)
+        if data is not None:
+            self._data.move_to_end(key)
+        return data
+
+    def _store(self, key, data):
+        if key in self._data:
+            return
+        self._data[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes and self._data:
+            _, evicted = self._data.popitem(last=False)
+            self._size -= len(evicted)
@@ -0,0 +1,41 @@
+import time
+from collections import OrderedDict
+
+
+class LocalTTLCache:
+    """
+    Маленький LRU-кеш в памяти процесса с временем жизни записей.
+    Без блокировок: используется только из event loop.
+    TTL держим коротким — другие воркеры про инвалидацию не узнают,
+    и устаревшая запись живет не дольше ttl секунд.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
@@ -0,0 +1,393 @@
+import os
+import json
+from fastapi import HTTPException
+from sqlalchemy import select, delete, update, func, literal, literal_column, null, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from starlette.concurrency import run_in_threadpool
+from app.database import redis_client, minio_client, BUCKET_NAME
+from app.models import Instance, InstanceVersion, version_files, File as FileModel, SideType
+
+STORAGE_URL = os.getenv("STORAGE_BASE_URL", "http://localhost:9000/launcher-files")
+# Длиннее цепочки diff'ов не растим: новая версия сворачивается в полный снимок
+MAX_VERSION_DEPTH = int(os.getenv("MAX_VERSION_DEPTH", "16"))
+# Версия неизменяема — манифест по ней можно кешировать сколько угодно;
+# TTL нужен только чтобы старые версии не копились в Redis
+MANIFEST_CACHE_TTL = 7 * 24 * 3600
+
+CLIENT_SIDES = (SideType.CLIENT, SideType.BOTH)
+SERVER_SIDES = (SideType.SERVER, SideType.BOTH)
+
+
+def resolved_files(version_id: int, paths: list = None):
+    """
+    Итоговый набор файлов версии — подзапрос с колонками path, file_hash, side.
+    Идем по цепочке родителей до полного снимка и для каждого пути берем
+    ближайшую запись; надгробия (file_hash IS NULL) отбрасываем.
+    paths — ограничить разрешение конкретными путями.
+    """
+    chain = (
+        select(InstanceVersion.id.label("version_id"), InstanceVersion.parent_id, literal_column("0").label("distance"))
+        .where(InstanceVersion.id == version_id)
+        .cte("version_chain", recursive=True)
+    )
+    parent = aliased(InstanceVersion)
+    chain = chain.union_all(
+        select(parent.id, parent.parent_id, chain.c.distance + 1).where(parent.id == chain.c.parent_id)
+    )
+
+    ranked = (
+        select(
+            version_files.c.path,
+            version_files.c.file_hash,
+            version_files.c.side,
+            func.row_number().over(partition_by=version_files.c.path, order_by=chain.c.distance).label("rank"),
+        )
+        .join(chain, version_files.c.version_id == chain.c.version_id)
+    )
+    if paths is not None:
+        ranked = ranked.where(version_files.c.path.in_(paths))
+    ranked = ranked.subquery("ranked")
+
+    return (
+        select(ranked.c.path, ranked.c.file_hash, ranked.c.side)
+        .where(ranked.c.rank == 1, ranked.c.file_hash.isnot(None))
+        .subquery("resolved")
+    )
+
+
+async def get_current_version_id(db, instance_id: str):
+    return (await db.execute(
+        select(Instance.current_version_id).where(Instance.id == instance_id)
+    )).scalar()
+
+
+async def get_entries(db, version_id: int, paths: list) -> dict:
+    """{path: (file_hash, side)} для существующих в версии путей"""
+    if version_id is None or not paths:
+        return {}
+    resolved = resolved_files(version_id, paths)
+    rows = await db.execute(select(resolved.c.path, resolved.c.file_hash, resolved.c.side))
+    return {path: (file_hash, side) for path, file_hash, side in rows}
+
+
+async def snapshot_version(db, source_version_id: int, instance: Instance, comment: str) -> InstanceVersion:
+    """
+    Новый полный снимок сборки instance с набором файлов версии source_version_id
+    (в том числе чужой сборки). Один INSERT ... SELECT: копируются только строки
+    version_files, блобы в хранилище общие.
+    """
+    version = InstanceVersion(instance_id=instance.id, parent_id=None, depth=0, comment=comment)
+    db.add(version)
+    await db.flush()
+    if source_version_id is not None:
+        resolved = resolved_files(source_version_id)
+        await db.execute(
+            insert(version_files).from_select(
+                ["version_id", "path", "file_hash", "side"],
+                select(literal_column(str(version.id)), resolved.c.path, resolved.c.file_hash, resolved.c.side),
+            )
+        )
+    return version
+
+
+async def start_version(db, instance: Instance, comment: str, base: bool = False) -> InstanceVersion:
+    """
+    Черновик новой версии поверх текущей. Пока не вызван publish_version,
+    клиенты его не видят.
+    base=True — пустой полный снимок (загрузка архива целиком).
+    """
+    parent = None
+    if instance.current_version_id is not None and not base:
+        parent = await db.get(InstanceVersion, instance.current_version_id)
+
+    if parent is not None and parent.depth + 1 > MAX_VERSION_DEPTH:
+        # Цепочка слишком длинная: копируем итоговый набор в новый полный снимок,
+        # чтобы разрешение версии оставалось одним коротким рекурсивным запросом
+        return await snapshot_version(db, parent.id, instance, comment)
+
+    version = InstanceVersion(
+        instance_id=instance.id,
+        parent_id=parent.id if parent else None,
+        depth=parent.depth + 1 if parent else 0,
+        comment=comment,
+    )
+    db.add(version)
+    await db.flush()
+    return version
+
+
+async def put_files(db, version: InstanceVersion, rows: list):
+    """
+    Записывает изменения в черновик: rows — [{"path", "file_hash", "side"}],
+    file_hash=None — путь удален. Повторная запись того же пути заменяет прежнюю.
+    """
+    if not rows:
+        return
+    if version.parent_id is None:
+        # В полном снимке надгробия не нужны — строку просто убираем
+        removed = [row["path"] for row in rows if row["file_hash"] is None]
+        rows = [row for row in rows if row["file_hash"] is not None]
+        if removed:
+            await db.execute(
+                delete(version_files)
+                .where(version_files.c.version_id == version.id)
+                .where(version_files.c.path.in_(removed))
+            )
+        if not rows:
+            return
+
+    stmt = insert(version_files)
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[version_files.c.version_id, version_files.c.path],
+            set_={"file_hash": stmt.excluded.file_hash, "side": stmt.excluded.side},
+        ),
+        [
+            {"version_id": version.id, "path": row["path"], "file_hash": row["file_hash"], "side": row.get("side") or SideType.BOTH}
+            for row in rows
+        ],
+    )
+
+
+async def publish_version(db, instance: Instance, version: InstanceVersion):
+    """Считает итоги версии, делает ее текущей и коммитит"""
+    resolved = resolved_files(version.id)
+    files_count, total_size = (await db.execute(
+        select(func.count(), func.coalesce(func.sum(FileModel.size), 0))
+        .select_from(resolved)
+        .join(FileModel, FileModel.sha256 == resolved.c.file_hash)
+    )).one()
+    version.files_count = files_count
+    version.total_size = total_size
+    await set_current_version(db, instance, version.id)
+
+
+async def set_current_version(db, instance: Instance, version_id: int):
+    """
+    Переводит указатель сборки и коммитит. Compare-and-set: указатель меняется,
+    только если он все еще тот, что был прочитан в начале правки (instance не
+    перечитывается). Иначе параллельная правка уже опубликовала свою версию,
+    и наша, построенная от старой, ее бы молча затерла — откат и 409.
+    """
+    result = await db.execute(
+        update(Instance)
+        .where(Instance.id == instance.id)
+        .where(Instance.current_version_id.is_not_distinct_from(instance.current_version_id))
+        .values(current_version_id=version_id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Instance was changed concurrently, reload and retry")
+    set_committed_value(instance, "current_version_id", version_id)
+    await db.commit()
+
+
+def glob_to_like(pattern: str) -> str:
+    """mods/*.jar -> mods/%.jar; как в fnmatch, * захватывает и '/'"""
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+def match_paths(column, path: str = None, pattern: str = None):
+    """
+    Условие на путь: path — конкретный файл или папка (с '/' на конце),
+    pattern — glob по всему пути.
+    """
+    if pattern is not None:
+        return column.like(glob_to_like(pattern), escape="\\")
+    if path.endswith("/"):
+        return column.like(glob_to_like(path) + "%", escape="\\")
+    return column == path
+
+
+async def _write_rows(db, version: InstanceVersion, rows) -> list:
+    """
+    INSERT ... SELECT строк (path, file_hash, side) в черновик поверх уже
+    записанных. Возвращает file_hash записанных строк (None — надгробие).
+    """
+    stmt = insert(version_files).from_select(
+        ["version_id", "path", "file_hash", "side"],
+        select(literal(version.id), rows.c.path, rows.c.file_hash, rows.c.side),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[version_files.c.version_id, version_files.c.path],
+        set_={"file_hash": stmt.excluded.file_hash, "side": stmt.excluded.side},
+    ).returning(version_files.c.file_hash)
+    return list((await db.execute(stmt)).scalars().all())
+
+
+async def bulk_set_side(db, version: InstanceVersion, side: SideType, path: str = None, pattern: str = None) -> int:
+    """Меняет сторону у всех подходящих файлов черновика одним запросом"""
+    current = resolved_files(version.id)
+    rows = (
+        select(current.c.path, current.c.file_hash, literal(side, version_files.c.side.type).label("side"))
+        .where(match_paths(current.c.path, path, pattern))
+        .where(current.c.side != side)
+        .subquery()
+    )
+    return len(await _write_rows(db, version, rows))
+
+
+async def bulk_delete(db, version: InstanceVersion, path: str = None, pattern: str = None) -> int:
+    """Надгробия на все подходящие файлы черновика"""
+    current = resolved_files(version.id)
+    rows = (
+        select(current.c.path, null().label("file_hash"), current.c.side)
+        .where(match_paths(current.c.path, path, pattern))
+        .subquery()
+    )
+    return len(await _write_rows(db, version, rows))
+
+
+async def bulk_move(db, version: InstanceVersion, target: str, path: str = None, pattern: str = None) -> int:
+    """
+    Перемещение одним запросом: файл на новое место, надгробие на старое.
+    path-файл -> target (новый путь); path-папка -> target-папка с той же
+    структурой внутри; pattern -> в папку target, имя файла сохраняется.
+    Занятый целевой путь перезаписывается, как у mv.
+    """
+    current = resolved_files(version.id)
+    if pattern is not None:
+        new_path = literal(target) + func.regexp_replace(current.c.path, "^.*/", "")
+    elif path.endswith("/"):
+        new_path = literal(target) + func.substr(current.c.path, len(path) + 1)
+    else:
+        new_path = literal(target)
+
+    # Файлы, которые уже на своем месте, не трогаем
+    matched = match_paths(current.c.path, path, pattern) & (new_path != current.c.path)
+
+    # Несколько источников в один путь (*/config.json -> backup/): выжил бы один,
+    # остальные ушли бы в надгробия — такую операцию не выполняем вовсе
+    collisions = (await db.execute(
+        select(new_path).where(matched).group_by(new_path).having(func.count() > 1).limit(10)
+    )).scalars().all()
+    if collisions:
+        raise HTTPException(status_code=400, detail=f"Several files would be moved to the same path: {', '.join(collisions)}")
+
+    moved = select(
+        new_path.label("path"), current.c.file_hash, current.c.side,
+        literal(0).label("priority"),
+    ).where(matched)
+    removed = select(
+        current.c.path, null(), current.c.side, literal(1),
+    ).where(matched)
+    combined = union_all(moved, removed).subquery("combined")
+    # Один путь — одна строка: новое содержимое важнее надгробия (обмен a <-> b)
+    rows = (
+        select(combined.c.path, combined.c.file_hash, combined.c.side)
+        .distinct(combined.c.path)
+        .order_by(combined.c.path, combined.c.priority)
+        .subquery()
+    )
+    written = await _write_rows(db, version, rows)
+    return sum(1 for file_hash in written if file_hash is not None)
+
+
+async def drop_base_tombstones(db, version: InstanceVersion):
+    """В полном снимке надгробия не нужны (см. put_files)"""
+    if version.parent_id is None:
+        await db.execute(
+            delete(version_files)
+            .where(version_files.c.version_id == version.id)
+            .where(version_files.c.file_hash.is_(None))
+        )
+
+
+def manifest_cache_key(version_id: int, sides: tuple) -> str:
+    return f"manifest:{version_id}:{'client' if sides == CLIENT_SIDES else 'server'}"
+
+
+async def get_manifest_files(db, version_id: int, sides: tuple) -> list:
+    """
+    Файлы версии для одной стороны: [{filename, hash, size, path, url}].
+    Версия неизменяема, поэтому список считается один раз и дальше берется из Redis.
+    """
+    if version_id is None:
+        return []
+    cache_key = manifest_cache_key(version_id, sides)
+    cached = await redis_client.get(cache_key)
+    if cached:
+        return json.loads(cached)
+
+    resolved = resolved_files(version_id)
+    stmt = (
+        select(FileModel.filename, FileModel.sha256, FileModel.size, FileModel.s3_path, resolved.c.path)
+        .join(resolved, FileModel.sha256 == resolved.c.file_hash)
+        .where(resolved.c.side.in_(sides))
+        .order_by(resolved.c.path)
+    )
+    files = [
+        {"filename": filename, "hash": sha256, "size": size, "path": path, "url": f"{STORAGE_URL}/{s3_path}"}
+        for filename, sha256, size, s3_path, path in (await db.execute(stmt)).all()
+    ]
+    await redis_client.set(cache_key, json.dumps(files), ex=MANIFEST_CACHE_TTL)
+    return files
+
+
+async def list_versions(db, instance_id: str) -> list:
+    return list((await db.execute(
+        select(InstanceVersion)
+        .where(InstanceVersion.instance_id == instance_id)
+        .order_by(InstanceVersion.id.desc())
+    )).scalars().all())
+
+
+async def prune_versions(db, instance: Instance, keep: int) -> int:
+    """
+    Удаляет старую историю: остаются keep последних версий, текущая и все их
+    предки по diff-цепочке (без предков их набор файлов не восстановить).
+    Блобы, на которые больше никто не ссылается, убирает delete_orphan_files.
+    """
+    newest = (
+        select(InstanceVersion.id)
+        .where(InstanceVersion.instance_id == instance.id)
+        .order_by(InstanceVersion.id.desc())
+        .limit(keep)
+    )
+    kept = list((await db.execute(newest)).scalars().all())
+    if instance.current_version_id is not None:
+        kept.append(instance.current_version_id)
+
+    chain = (
+        select(InstanceVersion.id, InstanceVersion.parent_id)
+        .where(InstanceVersion.id.in_(kept))
+        .cte("kept_chain", recursive=True)
+    )
+    parent = aliased(InstanceVersion)
+    chain = chain.union(select(parent.id, parent.parent_id).where(parent.id == chain.c.parent_id))
+
+    result = await db.execute(
+        delete(InstanceVersion)
+        .where(InstanceVersion.instance_id == instance.id)
+        .where(InstanceVersion.id.notin_(select(chain.c.id)))
+    )
+    return result.rowcount
+
+
+async def delete_orphan_files(db) -> tuple:
+    """
+    Файлы, на которые не ссылается ни одна версия ни одной сборки: удаляем объект
+    из MinIO и строку из files. Возвращает (сколько файлов, сколько байт).
+    Коммит — на вызывающем.
+    """
+    orphans = (await db.execute(
+        select(FileModel).where(
+            ~select(version_files.c.file_hash)
+            .where(version_files.c.file_hash == FileModel.sha256)
+            .exists()
+        )
+    )).scalars().all()
+
+    deleted_bytes = 0
+    for file_obj in orphans:
+        try:
+            await run_in_threadpool(minio_client.remove_object, BUCKET_NAME, file_obj.s3_path)
+        except Exception:
+            pass
+        await db.delete(file_obj)
+        deleted_bytes += file_obj.size
+    return len(orphans), deleted_bytes
@@ -0,0 +1,58 @@
+import os
+from app.database import redis_client
+from app.services.cache import LocalTTLCache
+
+# Сколько живет закешированный админ в Redis и в памяти процесса.
+# Инвалидация чистит Redis и локальный кеш своего воркера; чужие воркеры
+# увидят бан или смену роли не позже PRINCIPAL_LOCAL_TTL секунд.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+PRINCIPAL_LOCAL_TTL = 15
+
+_local = LocalTTLCache(1000, PRINCIPAL_LOCAL_TTL)
+
+
+def principal_key(token_id: str) -> str:
+    return f"principal:{token_id}"
+
+
+def user_principals_key(user_id: str) -> str:
+    return f"principal_tokens:{user_id}"
+
+
+# Сброс всех токенов юзера одной операцией (как и отзыв игровых сессий)
+_INVALIDATE = redis_client.register_script("""
+local tokens = redis.call('SMEMBERS', KEYS[1])
+for _, token in ipairs(tokens) do
+    redis.call('DEL', ARGV[1] .. token)
+end
+redis.call('DEL', KEYS[1])
+return tokens
+""")
+
+
+async def get_principal(token_id: str):
+    principal = _local.get(token_id)
+    if principal is not None:
+        return principal
+    principal = await redis_client.hgetall(principal_key(token_id))
+    if principal:
+        _local.set(token_id, principal)
+        return principal
+    return None
+
+
+async def store_principal(token_id: str, principal: dict):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(principal_key(token_id), mapping=principal)
+        pipe.expire(principal_key(token_id), PRINCIPAL_CACHE_TTL)
+        pipe.sadd(user_principals_key(principal["id"]), token_id)
+        pipe.expire(user_principals_key(principal["id"]), PRINCIPAL_CACHE_TTL)
+        await pipe.execute()
+    _local.set(token_id, principal)
+
+
+async def invalidate_principals(user_id):
+    """После смены роли, бана или удаления — следующий запрос пойдет в БД"""
+    tokens = await _INVALIDATE(keys=[user_principals_key(str(user_id))], args=[principal_key("")])
+    for token_id in tokens or []:
+        _local.delete(token_id)
@@ -0,0 +1,179 @@
+import json
+import os
+import uuid
+from sqlalchemy import select, func, update
+from app.database import redis_client, async_session_factory
+from app.models import User
+from app.services.cache import LocalTTLCache
+from app.services.signing import signing_keys
+
+# Профиль в Redis живет час; изменения пользователя сбрасывают его явно
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "3600"))
+# Локальный слой: 0 — выключен
+PROFILE_LOCAL_CACHE_SIZE = int(os.getenv("PROFILE_LOCAL_CACHE_SIZE", "2000"))
+PROFILE_LOCAL_CACHE_TTL = 5
+# Профиль, прочитанный с реплики, мог отстать (бан/переименование секунду назад) —
+# кешируем его ненадолго, чтобы устаревшая версия не прожила в Redis целый час
+REPLICA_PROFILE_CACHE_TTL = 60
+
+_local = LocalTTLCache(PROFILE_LOCAL_CACHE_SIZE, PROFILE_LOCAL_CACHE_TTL)
+
+
+def profile_name_key(username: str) -> str:
+    # Ник в ключе — в нижнем регистре; точное совпадение проверяет вызывающий
+    return f"profile:name:{username.lower()}"
+
+
+def profile_uuid_key(mc_uuid_hex: str) -> str:
+    return f"profile:uuid:{mc_uuid_hex}"
+
+
+def build_profile(user: User) -> dict:
+    """Готовый к отдаче профиль + флаг бана (не отдается наружу)"""
+    properties = []
+    if user.textures_property:
+        properties.append({
+            "name": "textures",
+            "value": user.textures_property,
+            "signature": user.textures_signature,
+        })
+    return {
+        "id": user.mc_uuid.hex,
+        "name": user.username,
+        "properties": properties,
+        "banned": user.is_banned,
+        "kid": user.textures_key_id,
+    }
+
+
+def public_profile(profile: dict, signed: bool = True) -> dict:
+    properties = profile["properties"]
+    if not signed:
+        properties = [{"name": p["name"], "value": p["value"]} for p in properties]
+    return {"id": profile["id"], "name": profile["name"], "properties": properties}
+
+
+async def ensure_signed(profile: dict) -> dict:
+    """
+    Подпись из кеша, если она сделана активным ключом. После ротации профиль
+    переподписывается один раз — при первом обращении, а не весь кеш разом.
+    Запись идет в своей сессии основной базы: вызывающий может читать с реплики.
+    """
+    if not profile["properties"] or profile.get("kid") == signing_keys.active_kid:
+        return profile
+
+    textures = profile["properties"][0]
+    textures["signature"], profile["kid"] = signing_keys.sign(textures["value"])
+    async with async_session_factory() as db:
+        await db.execute(
+            update(User)
+            .where(User.mc_uuid == uuid.UUID(profile["id"]))
+            .values(textures_signature=textures["signature"], textures_key_id=profile["kid"])
+        )
+        await db.commit()
+    await store_profile(profile)
+    return profile
+
+
+def remember_local(profile: dict):
+    _local.set(profile_name_key(profile["name"]), profile)
+    _local.set(profile_uuid_key(profile["id"]), profile)
+
+
+def cache_ttl(db) -> int:
+    return REPLICA_PROFILE_CACHE_TTL if db.info.get("replica") else PROFILE_CACHE_TTL
+
+
+async def store_profiles(profiles: list, ttl: int = PROFILE_CACHE_TTL):
+    if not profiles:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for profile in profiles:
+            raw = json.dumps(profile)
+            pipe.set(profile_name_key(profile["name"]), raw, ex=ttl)
+            pipe.set(profile_uuid_key(profile["id"]), raw, ex=ttl)
+        await pipe.execute()
+    for profile in profiles:
+        remember_local(profile)
+
+
+async def store_profile(profile: dict, ttl: int = PROFILE_CACHE_TTL):
+    await store_profiles([profile], ttl)
+
+
+async def load_profile_by_name(db, username: str, cache_name: bool = True):
+    """
+    Промах кеша: идем в БД и прогреваем оба ключа.
+    cache_name=False — ключ по нику не трогаем: ник уникален с учетом регистра,
+    а ключ без, и под ним уже лежит "Steve", когда спрашивают "steve".
+    """
+    user = (await db.execute(select(User).where(User.username == username))).scalars().first()
+    if not user:
+        return None
+    profile = build_profile(user)
+    if cache_name:
+        await store_profile(profile, cache_ttl(db))
+    else:
+        await redis_client.set(profile_uuid_key(profile["id"]), json.dumps(profile), ex=cache_ttl(db))
+        _local.set(profile_uuid_key(profile["id"]), profile)
+    return profile
+
+
+async def get_profiles_by_names(db, names: list) -> list:
+    """
+    Пакетный поиск по никам без учета регистра: один MGET по кешу,
+    а все промахи — одним запросом по индексу lower(username).
+    """
+    wanted = list(dict.fromkeys(name.lower() for name in names))
+    if not wanted:
+        return []
+
+    cached = await redis_client.mget([profile_name_key(name) for name in wanted])
+    found = {}
+    missing = []
+    for name, raw in zip(wanted, cached):
+        if raw:
+            found[name] = json.loads(raw)
+        else:
+            missing.append(name)
+
+    if missing:
+        users = (await db.execute(
+            select(User).where(func.lower(User.username).in_(missing))
+        )).scalars().all()
+        loaded = [build_profile(user) for user in users]
+        await store_profiles(loaded, cache_ttl(db))
+        for profile in loaded:
+            found[profile["name"].lower()] = profile
+
+    return [found[name] for name in wanted if name in found]
+
+
+async def get_profile_by_uuid(db, mc_uuid: uuid.UUID):
+    key = profile_uuid_key(mc_uuid.hex)
+    profile = _local.get(key)
+    if profile is not None:
+        return profile
+
+    raw = await redis_client.get(key)
+    if raw:
+        profile = json.loads(raw)
+        remember_local(profile)
+        return profile
+
+    user = (await db.execute(select(User).where(User.mc_uuid == mc_uuid))).scalars().first()
+    if not user:
+        return None
+    profile = build_profile(user)
+    await store_profile(profile, cache_ttl(db))
+    return profile
+
+
+async def invalidate_profile(user: User, old_username: str = None):
+    """Сброс после бана/переименования/удаления. old_username — ник до переименования"""
+    keys = [profile_name_key(user.username), profile_uuid_key(user.mc_uuid.hex)]
+    if old_username:
+        keys.append(profile_name_key(old_username))
+    await redis_client.delete(*keys)
+    for key in keys:
+        _local.delete(key)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from app.database import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Все уведомления идут в каналы notify:<topic>; процесс держит ровно одну подписку на шаблон
+NOTIFY_PREFIX = "notify:"
+
+
+class PubSubNotifier:
+    """
+    Общий на процесс слушатель Redis pub/sub для long-poll эндпоинтов.
+    Вместо отдельной подписки на каждый висящий запрос — одна psubscribe
+    и словарь topic -> ожидающие futures. Тысяча агентов, ждущих обновления,
+    стоят одного соединения с Redis.
+    """
+
+    def __init__(self):
+        self._waiters = {}  # topic -> set(Future)
+        self._task = None
+        self._ready = None
+
+    async def _ensure_listener(self):
+        if self._task is None or self._task.done():
+            self._ready = asyncio.get_running_loop().create_future()
+            self._task = asyncio.create_task(self._listen())
+        await self._ready
+
+    async def _listen(self):
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.psubscribe(f"{NOTIFY_PREFIX}*")
+            if not self._ready.done():
+                self._ready.set_result(True)
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                topic = message["channel"][len(NOTIFY_PREFIX):]
+                for future in self._waiters.pop(topic, ()):
+                    if not future.done():
+                        future.set_result(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Pub/sub listener failed: {e}")
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            # Будим всех: пусть клиенты переспросят состояние сами
+            for futures in self._waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(None)
+            self._waiters.clear()
+        finally:
+            await pubsub.aclose()
+
+    async def subscribe(self, topic: str) -> asyncio.Future:
+        """
+        Регистрирует ожидание ДО проверки состояния вызывающим — иначе событие,
+        пришедшее между проверкой и подпиской, потеряется.
+        """
+        await self._ensure_listener()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(topic, set()).add(future)
+        return future
+
+    async def wait(self, topic: str, future: asyncio.Future, timeout: float):
+        """Ждет уведомление по topic; None — по таймауту"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.discard(topic, future)
+
+    def discard(self, topic: str, future: asyncio.Future):
+        """Снимает ожидание, если оно больше не нужно"""
+        waiters = self._waiters.get(topic)
+        if waiters is not None:
+            waiters.discard(future)
+            if not waiters:
+                self._waiters.pop(topic, None)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+async def notify(topic: str, message: str = "1"):
+    await redis_client.publish(f"{NOTIFY_PREFIX}{topic}", message)
+
+
+notifier = PubSubNotifier()
@@ -0,0 +1,270 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import jwt
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from app.database import redis_client
+from app.utils import SECRET_KEY, ALGORITHM
+
+logger = logging.getLogger(__name__)
+
+# Как часто локальные счетчики сливаются в Redis (секунды)
+SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", "1"))
+REDIS_PREFIX = "rl:"
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# Группы маршрутов по префиксу пути (первое совпадение; более длинные префиксы — выше)
+ROUTE_GROUPS = [
+    ("/api/admin", "admin"),
+    ("/api/auth", "auth"),
+    ("/api/agent", "agent"),
+    ("/api/client", "launcher"),
+    ("/authserver", "yggdrasil"),
+    ("/sessionserver", "yggdrasil"),
+    ("/api/profiles", "yggdrasil"),
+    ("/api/user", "yggdrasil"),
+]
+
+# Лимиты групп на один ключ. Ключ без проверенного токена — IP, а за одним NAT сидит целый
+# компьютерный класс, поэтому IP-лимиты с запасом на 30-40 машин разом.
+# Переопределяются через RATE_LIMIT_<GROUP>, например RATE_LIMIT_LAUNCHER=6000/minute
+DEFAULT_GROUP_LIMITS = {
+    "launcher": "3000/minute",
+    "yggdrasil": "1200/minute",
+    "admin": "600/minute",
+    "auth": "120/minute",
+    "agent": "120/minute",
+    "default": "300/minute",
+}
+
+
+class RateLimit:
+    """Лимит вида "10/minute": count запросов за period секунд"""
+    __slots__ = ("count", "period", "rate")
+
+    def __init__(self, count: int, period: int):
+        self.count = count
+        self.period = period
+        self.rate = count / period  # токенов в секунду
+
+    @classmethod
+    def parse(cls, value: str) -> "RateLimit":
+        count, _, unit = value.strip().partition("/")
+        unit = unit.strip().rstrip("s")
+        if unit not in _PERIODS:
+            raise ValueError(f"Bad rate limit: {value}")
+        return cls(int(count), _PERIODS[unit])
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "pending", "blocked_until", "limit")
+
+    def __init__(self, limit: RateLimit, now: float):
+        self.tokens = float(limit.count)
+        self.updated = now
+        self.pending = 0
+        self.blocked_until = 0.0
+        self.limit = limit
+
+
+class RateLimiter:
+    """
+    Двухуровневый лимитер.
+    1) В процессе: token bucket на (scope, key) — проверка запроса это поиск в dict
+       и пара арифметических операций, без сети.
+    2) Раз в SYNC_INTERVAL накопленные хиты одним pipeline уходят в Redis
+       (INCRBY в счетчик текущего окна). Если суммарно по всем воркерам окно
+       переполнено, ключ блокируется локально до конца окна.
+    Кластерный лимит поэтому приблизительный: перебор не больше того, что воркеры
+    успеют пропустить за один интервал синхронизации. Если Redis недоступен —
+    работают только локальные корзины.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false"
+        self._buckets = {}   # (scope, key) -> _Bucket
+        self._dirty = set()  # ключи с несинхронизированными хитами
+        self._task = None
+        self.group_limits = {
+            group: RateLimit.parse(os.getenv(f"RATE_LIMIT_{group.upper()}", default))
+            for group, default in DEFAULT_GROUP_LIMITS.items()
+        }
+
+    def hit(self, scope: str, key: str, limit: RateLimit):
+        """None — запрос разрешен, иначе через сколько секунд можно повторить"""
+        now = time.monotonic()
+        bucket_key = (scope, key)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = _Bucket(limit, now)
+            if self._task is None:
+                self._task = asyncio.get_running_loop().create_task(self._sync_loop())
+        else:
+            bucket.tokens = min(limit.count, bucket.tokens + (now - bucket.updated) * limit.rate)
+            bucket.updated = now
+
+        if bucket.blocked_until > now:
+            return bucket.blocked_until - now
+        if bucket.tokens < 1:
+            return (1 - bucket.tokens) / limit.rate
+        bucket.tokens -= 1
+        bucket.pending += 1
+        self._dirty.add(bucket_key)
+        return None
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(SYNC_INTERVAL)
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Rate limit sync failed, local buckets only: {e}")
+            self._prune()
+
+    async def sync(self):
+        """Сливает накопленные хиты в Redis и подтягивает кластерные счетчики"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        wall = time.time()
+        batch = []
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for scope, key in dirty:
+                bucket = self._buckets.get((scope, key))
+                if bucket is None or not bucket.pending:
+                    continue
+                period = bucket.limit.period
+                window = int(wall // period)
+                redis_key = f"{REDIS_PREFIX}{scope}:{key}:{window}"
+                pipe.incrby(redis_key, bucket.pending)
+                pipe.expire(redis_key, period * 2)
+                batch.append((bucket, (window + 1) * period - wall))
+                bucket.pending = 0
+            if not batch:
+                return
+            results = await pipe.execute()
+
+        now = time.monotonic()
+        for (bucket, window_left), total in zip(batch, results[::2]):
+            if total > bucket.limit.count:
+                bucket.blocked_until = now + window_left
+                bucket.tokens = 0.0
+
+    def _prune(self):
+        """Забываем корзины, которые давно не трогали и которые уже полные"""
+        now = time.monotonic()
+        stale = [
+            key for key, bucket in self._buckets.items()
+            if not bucket.pending and now - bucket.updated > bucket.limit.period
+            and bucket.blocked_until < now
+        ]
+        for key in stale:
+            del self._buckets[key]
+
+    def limit(self, rate: str, key_func=None):
+        """
+        Декоратор для отдельного эндпоинта (поверх лимита группы).
+        key_func(request, kwargs) -> ключ; по умолчанию IP клиента.
+        Эндпоинт обязан принимать request: Request.
+        """
+        parsed = RateLimit.parse(rate)
+
+        def decorator(func):
+            scope = func.__name__
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if self.enabled:
+                    request = kwargs["request"]
+                    key = key_func(request, kwargs) if key_func else client_ip(request.scope)
+                    retry_after = self.hit(scope, key, parsed)
+                    if retry_after is not None:
+                        raise HTTPException(
+                            status_code=429,
+                            detail="Rate limit exceeded",
+                            headers={"Retry-After": str(int(retry_after) + 1)},
+                        )
+                return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        try:
+            await self.sync()
+        except Exception:
+            pass
+
+
+def client_ip(scope) -> str:
+    # За nginx адрес клиента уже подставлен uvicorn'ом из X-Forwarded-For (--proxy-headers)
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def route_group(path: str) -> str:
+    for prefix, group in ROUTE_GROUPS:
+        if path.startswith(prefix):
+            return group
+    return "default"
+
+
+def request_key(scope) -> str:
+    """
+    Ключ для лимита группы. С JWT админки — пользователь из токена: вся кафедра за
+    одним NAT не делит один лимит. Токен проверяется по подписи: непроверенное
+    значение заголовка в ключ не берем, иначе каждый случайный Bearer — новая корзина.
+    Все остальное (агенты, Yggdrasil, без токена, битый токен) — по IP.
+    """
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            try:
+                payload = jwt.decode(value[7:].decode("latin-1"), SECRET_KEY, algorithms=[ALGORITHM])
+            except jwt.PyJWTError:
+                break
+            subject = payload.get("sub")
+            # scoped-токены (тикеты SSE) пользователя не несут
+            if subject is not None and not payload.get("scope"):
+                return f"u:{subject}"
+            break
+    return "ip:" + client_ip(scope)
+
+
+class RateLimitMiddleware:
+    """ASGI-middleware: лимит группы маршрутов на каждый HTTP-запрос"""
+
+    def __init__(self, app, limiter: RateLimiter = None):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiter
+        if scope["type"] != "http" or not limiter.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        group = route_group(scope["path"])
+        retry_after = limiter.hit(group, request_key(scope), limiter.group_limits[group])
+        if retry_after is not None:
+            response = JSONResponse(
+                {"detail": "Rate limit exceeded"},
+                status_code=429,
+                headers={"Retry-After": str(int(retry_after) + 1)},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,202 @@
+import asyncio
+import struct
+import logging
+import itertools
+
+logger = logging.getLogger(__name__)
+
+# Типы пакетов Source RCON (так же их использует Minecraft)
+PACKET_RESPONSE = 0
+PACKET_COMMAND = 2
+PACKET_AUTH = 3
+
+RCON_TIMEOUT = 10
+# Сколько команд может ждать ответа на одном соединении; дальше — отказ, а не бесконечная очередь
+RCON_MAX_PENDING = 64
+RCON_RECONNECT_ATTEMPTS = 3
+RCON_BACKOFF_MAX = 30
+
+
+class RCONError(Exception):
+    pass
+
+
+class RCONAuthError(RCONError):
+    pass
+
+
+def _encode_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    payload = struct.pack("<ii", request_id, packet_type) + body.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(payload)) + payload
+
+
+async def _read_packet(reader: asyncio.StreamReader):
+    (length,) = struct.unpack("<i", await reader.readexactly(4))
+    payload = await reader.readexactly(length)
+    request_id, packet_type = struct.unpack("<ii", payload[:8])
+    body = payload[8:-2].decode("utf-8", errors="replace")
+    return request_id, packet_type, body
+
+
+class RCONClient:
+    """
+    Постоянное авторизованное RCON-соединение с одним сервером.
+    Команды мультиплексируются по request id: можно слать несколько подряд, не дожидаясь ответов.
+    Длинные ответы Minecraft режет на пакеты по 4096 байт с тем же id, поэтому после
+    каждой команды шлем пустой пакет-маркер: ответ на него означает конец ответа на команду.
+    """
+
+    def __init__(self, host: str, port: int, password: str):
+        self.host = host
+        self.port = port
+        self.password = password
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = asyncio.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}     # command id -> [future, fragments]
+        self._sentinels = {}   # sentinel id -> command id
+        self._failures = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def command(self, command: str, timeout: float = RCON_TIMEOUT) -> str:
+        if len(self._pending) >= RCON_MAX_PENDING:
+            raise RCONError(f"RCON queue for {self.host}:{self.port} is full")
+
+        await self._ensure_connected()
+
+        command_id = self._next_id()
+        sentinel_id = self._next_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command_id] = [future, []]
+        self._sentinels[sentinel_id] = command_id
+
+        try:
+            # Оба пакета одним write — между ними никто не вклинится
+            self._writer.write(
+                _encode_packet(command_id, PACKET_COMMAND, command) +
+                _encode_packet(sentinel_id, PACKET_RESPONSE, "")
+            )
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RCONError(f"RCON command timed out on {self.host}:{self.port}")
+        finally:
+            self._pending.pop(command_id, None)
+            self._sentinels.pop(sentinel_id, None)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+        self._drop_connection(RCONError("RCON connection closed"))
+
+    def _next_id(self) -> int:
+        # id — знаковый int32, -1 зарезервирован сервером под "auth failed"
+        request_id = next(self._ids)
+        if request_id >= 2 ** 31 - 1:
+            self._ids = itertools.count(1)
+            request_id = next(self._ids)
+        return request_id
+
+    async def _ensure_connected(self):
+        if self.connected:
+            return
+        async with self._connect_lock:
+            if self.connected:
+                return
+            last_error = None
+            for attempt in range(RCON_RECONNECT_ATTEMPTS):
+                if self._failures:
+                    # Экспоненциальная пауза, чтобы не долбить лежащий сервер
+                    await asyncio.sleep(min(0.5 * 2 ** (self._failures - 1), RCON_BACKOFF_MAX))
+                try:
+                    await self._connect()
+                    self._failures = 0
+                    return
+                except RCONAuthError:
+                    # Неверный пароль повторами не исправить
+                    raise
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    self._failures += 1
+                    last_error = e
+                    logger.warning(f"RCON connect to {self.host}:{self.port} failed (attempt {attempt + 1}): {e}")
+            raise RCONError(f"RCON unavailable at {self.host}:{self.port}: {last_error}")
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), RCON_TIMEOUT
+        )
+        try:
+            auth_id = self._next_id()
+            writer.write(_encode_packet(auth_id, PACKET_AUTH, self.password))
+            await writer.drain()
+            while True:
+                request_id, packet_type, _ = await asyncio.wait_for(_read_packet(reader), RCON_TIMEOUT)
+                if request_id == -1:
+                    raise RCONAuthError(f"RCON authentication failed for {self.host}:{self.port}")
+                # Некоторые серверы перед ответом на auth шлют пустой RESPONSE_VALUE
+                if packet_type == PACKET_COMMAND and request_id == auth_id:
+                    break
+        except BaseException:
+            writer.close()
+            raise
+
+        self._reader, self._writer = reader, writer
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+        logger.info(f"RCON connected to {self.host}:{self.port}")
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                request_id, _, body = await _read_packet(reader)
+                if request_id in self._pending:
+                    self._pending[request_id][1].append(body)
+                elif request_id in self._sentinels:
+                    entry = self._pending.get(self._sentinels[request_id])
+                    if entry and not entry[0].done():
+                        entry[0].set_result("".join(entry[1]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._drop_connection(RCONError(f"RCON connection lost: {e}"))
+
+    def _drop_connection(self, error: Exception):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+
+class RCONManager:
+    """Реестр постоянных RCON-соединений: одно на (host, port)"""
+
+    def __init__(self):
+        self._clients = {}
+
+    def client_for(self, config) -> RCONClient:
+        if not config.rcon_password:
+            raise RCONError("RCON password is not configured for this server")
+        host = config.rcon_host or config.host
+        key = (host, config.rcon_port)
+        client = self._clients.get(key)
+        if client is None or client.password != config.rcon_password:
+            if client is not None:
+                asyncio.create_task(client.close())
+            client = RCONClient(host, config.rcon_port, config.rcon_password)
+            self._clients[key] = client
+        return client
+
+    async def close_all(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.close()
+
+
+rcon_manager = RCONManager()
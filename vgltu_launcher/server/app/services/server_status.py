@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import struct
+import time
+import logging
+from sqlalchemy import select
+from app.database import async_session_factory, redis_client
+from app.models import SFTPConnection
+
+logger = logging.getLogger(__name__)
+
+# Как часто опрашивать серверы и сколько живет результат в Redis
+SERVER_STATUS_INTERVAL = int(os.getenv("SERVER_STATUS_INTERVAL", "15"))
+SERVER_STATUS_TTL = SERVER_STATUS_INTERVAL * 3
+SLP_TIMEOUT = 3
+SLP_CONCURRENCY = 50
+
+
+def instance_status_key(instance_id: str) -> str:
+    return f"server_status:instance:{instance_id}"
+
+
+# --- Minecraft Server List Ping (протокол 1.7+) ---
+
+def _varint(value: int) -> bytes:
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+async def _read_varint(reader) -> int:
+    result = 0
+    for i in range(5):
+        byte = (await reader.readexactly(1))[0]
+        result |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return result
+    raise ValueError("VarInt is too big")
+
+
+def _packet(packet_id: int, payload: bytes = b"") -> bytes:
+    body = _varint(packet_id) + payload
+    return _varint(len(body)) + body
+
+
+def _motd_text(description) -> str:
+    """description бывает строкой или chat-компонентом с extra"""
+    if isinstance(description, str):
+        return description
+    if isinstance(description, dict):
+        return _motd_text(description.get("text", "")) + _motd_text(description.get("extra", []))
+    if isinstance(description, list):
+        return "".join(_motd_text(e) for e in description)
+    return ""
+
+
+def _int(value) -> int:
+    return value if isinstance(value, int) and not isinstance(value, bool) else 0
+
+
+def _parse_status(status) -> dict:
+    """Ответ сервера как есть не доверяем: моды и прокси шлют null, строки вместо объектов"""
+    if not isinstance(status, dict):
+        raise ValueError("Status is not a JSON object")
+    players = status.get("players")
+    players = players if isinstance(players, dict) else {}
+    version = status.get("version")
+    version = version.get("name") if isinstance(version, dict) else None
+    return {
+        "players_online": _int(players.get("online")),
+        "players_max": _int(players.get("max")),
+        "motd": _motd_text(status.get("description", "")),
+        "version": version if isinstance(version, str) else None,
+    }
+
+
+async def ping_server(host: str, port: int, timeout: float = SLP_TIMEOUT) -> dict:
+    """Handshake -> Status Request -> Ping. Возвращает словарь статуса (online=False при ошибке)"""
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        host_bytes = host.encode("utf-8")
+        handshake = _varint(-1) + _varint(len(host_bytes)) + host_bytes + struct.pack(">H", port) + _varint(1)
+        writer.write(_packet(0x00, handshake) + _packet(0x00))
+        await writer.drain()
+
+        async def read_status():
+            await _read_varint(reader)  # длина пакета
+            await _read_varint(reader)  # id пакета
+            length = await _read_varint(reader)
+            return json.loads((await reader.readexactly(length)).decode("utf-8"))
+
+        status = await asyncio.wait_for(read_status(), timeout)
+
+        started = time.monotonic()
+        writer.write(_packet(0x01, struct.pack(">q", int(started * 1000))))
+        await writer.drain()
+
+        async def read_pong():
+            await _read_varint(reader)
+            await _read_varint(reader)
+            await reader.readexactly(8)
+
+        await asyncio.wait_for(read_pong(), timeout)
+        latency_ms = round((time.monotonic() - started) * 1000)
+
+        return {"online": True, **_parse_status(status), "latency_ms": latency_ms}
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+        logger.debug(f"SLP {host}:{port} failed: {e}")
+        return {"online": False}
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# --- Поллер ---
+
+async def poll_all_servers():
+    """Пингует все настроенные серверы параллельно и кладет статусы в Redis одним pipeline"""
+    async with async_session_factory() as db:
+        targets = (await db.execute(select(SFTPConnection).order_by(SFTPConnection.id))).scalars().all()
+
+    semaphore = asyncio.Semaphore(SLP_CONCURRENCY)
+
+    async def ping_target(target):
+        async with semaphore:
+            try:
+                status = await ping_server(target.game_host or target.rcon_host or target.host, target.game_port)
+            except Exception as e:
+                # Один странный сервер не должен сорвать обновление статусов всех остальных
+                logger.warning(f"SLP {target.name} failed: {e}")
+                status = {"online": False}
+        return {"target_id": target.id, "name": target.name, "checked_at": int(time.time()), **status}
+
+    results = await asyncio.gather(*(ping_target(t) for t in targets))
+
+    by_instance = {}
+    for target, status in zip(targets, results):
+        by_instance.setdefault(target.instance_id, []).append(status)
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for instance_id, statuses in by_instance.items():
+            pipe.set(instance_status_key(instance_id), json.dumps(statuses, ensure_ascii=False), ex=SERVER_STATUS_TTL)
+        await pipe.execute()
+
+
+async def server_status_poller():
+    """
+    Фоновый цикл. Блокировка в Redis гарантирует, что при нескольких воркерах
+    серверы пингует только один из них.
+    """
+    while True:
+        try:
+            if await redis_client.set("server_status:poller", "1", nx=True, ex=SERVER_STATUS_INTERVAL):
+                await poll_all_servers()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Server status poll failed: {e}")
+        await asyncio.sleep(SERVER_STATUS_INTERVAL)
+
+
+async def get_instance_statuses(instance_ids: list) -> dict:
+    """Статусы серверов для списка сборок — один MGET, без обращения к игровым серверам"""
+    if not instance_ids:
+        return {}
+    try:
+        values = await redis_client.mget([instance_status_key(i) for i in instance_ids])
+        return {i: json.loads(v) for i, v in zip(instance_ids, values) if v}
+    except Exception as e:
+        # Статусы — украшение списка сборок: без Redis отдаем список без них
+        logger.warning(f"⚠️ Server statuses unavailable: {e}")
+        return {}
@@ -0,0 +1,92 @@
+import os
+import uuid
+from app.database import redis_client
+
+# Игровая сессия (accessToken) живет сутки и продлевается при refresh
+SESSION_TTL = int(os.getenv("YGGDRASIL_SESSION_TTL", str(24 * 3600)))
+# Сколько живет связка serverId -> ник между join и hasJoined
+JOIN_TTL = 60
+
+
+def session_key(access_token: str) -> str:
+    return f"ygg:session:{access_token}"
+
+
+def user_sessions_key(user_id: str) -> str:
+    return f"ygg:user_sessions:{user_id}"
+
+
+# Создание сессии одним походом в Redis: hash сессии + индекс сессий юзера.
+# Заодно вычищаем из индекса токены, которые уже истекли, — иначе он растет бесконечно.
+_CREATE_SESSION = redis_client.register_script("""
+local prefix = ARGV[1]
+for _, token in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    if redis.call('EXISTS', prefix .. token) == 0 then
+        redis.call('SREM', KEYS[2], token)
+    end
+end
+redis.call('HSET', KEYS[1], 'user_id', ARGV[4], 'username', ARGV[5], 'mc_uuid', ARGV[6], 'client_token', ARGV[7])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+""")
+
+# Отзыв всех сессий юзера — одна операция
+_REVOKE_USER_SESSIONS = redis_client.register_script("""
+local tokens = redis.call('SMEMBERS', KEYS[1])
+for _, token in ipairs(tokens) do
+    redis.call('DEL', ARGV[1] .. token)
+end
+redis.call('DEL', KEYS[1])
+return #tokens
+""")
+
+# join: проверка токена и профиля + запись serverId за один round trip
+_JOIN = redis_client.register_script("""
+local session = redis.call('HMGET', KEYS[1], 'username', 'mc_uuid')
+if not session[1] or session[2] ~= ARGV[1] then
+    return false
+end
+redis.call('SET', KEYS[2], session[1], 'EX', ARGV[2])
+return session[1]
+""")
+
+
+async def create_session(user_id: str, username: str, mc_uuid_hex: str, client_token: str) -> str:
+    access_token = uuid.uuid4().hex
+    await _CREATE_SESSION(
+        keys=[session_key(access_token), user_sessions_key(user_id)],
+        args=[session_key(""), access_token, SESSION_TTL, user_id, username, mc_uuid_hex, client_token],
+    )
+    return access_token
+
+
+async def get_session(access_token: str, client_token: str = None):
+    """Данные сессии или None. Если clientToken передан, он должен совпасть"""
+    session = await redis_client.hgetall(session_key(access_token))
+    if not session:
+        return None
+    if client_token and session.get("client_token") != client_token:
+        return None
+    return session
+
+
+async def delete_session(access_token: str, session: dict):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(session_key(access_token))
+        pipe.srem(user_sessions_key(session["user_id"]), access_token)
+        await pipe.execute()
+
+
+async def revoke_user_sessions(user_id) -> int:
+    """Выкидывает юзера из всех лаунчеров (бан, signout, удаление)"""
+    return await _REVOKE_USER_SESSIONS(keys=[user_sessions_key(str(user_id))], args=[session_key("")])
+
+
+async def join_session(access_token: str, mc_uuid_hex: str, server_id: str):
+    """Ник, если токен жив и принадлежит этому профилю; иначе None"""
+    return await _JOIN(
+        keys=[session_key(access_token), f"join:{server_id}"],
+        args=[mc_uuid_hex, JOIN_TTL],
+    )
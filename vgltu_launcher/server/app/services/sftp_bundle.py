@@ -0,0 +1,138 @@
+import shlex
+import tarfile
+import logging
+import weakref
+
+try:
+    import zstandard
+except ImportError:  # без zstandard пакуем в tar.gz
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Меньше этого числа файлов бандл не имеет смысла — дешевле залить по одному
+BUNDLE_MIN_FILES = 8
+
+# Результат проверки инструментов на сервере кешируем на время жизни SSH-сессии
+_tools_cache = weakref.WeakKeyDictionary()
+
+
+class _ChannelWriter:
+    """Минимальный file-like поверх SSH-канала для tarfile/zstd"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, data):
+        self.channel.sendall(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _exec(transport, command: str, stdin_data: bytes = b""):
+    """Выполняет команду через exec-канал уже открытой сессии (без нового рукопожатия)"""
+    channel = transport.open_session()
+    try:
+        channel.exec_command(command)
+        if stdin_data:
+            channel.sendall(stdin_data)
+        channel.shutdown_write()
+        stdout = channel.makefile("rb").read()
+        stderr = channel.makefile_stderr("rb").read()
+        return channel.recv_exit_status(), stdout, stderr
+    finally:
+        channel.close()
+
+
+def _remote_compression(transport):
+    """
+    Проверяет, что на сервере есть tar, sha256sum и распаковщик.
+    Возвращает "zstd", "gzip" или None (бандл недоступен).
+    """
+    if transport in _tools_cache:
+        return _tools_cache[transport]
+
+    compression = None
+    try:
+        code, out, _ = _exec(
+            transport,
+            "command -v tar >/dev/null && command -v sha256sum >/dev/null && "
+            "{ command -v zstd >/dev/null && echo zstd || { command -v gzip >/dev/null && echo gzip; }; }"
+        )
+        found = out.decode(errors="ignore").strip()
+        if code == 0 and found in ("zstd", "gzip"):
+            compression = found
+    except Exception as e:
+        # Например, SFTP-only аккаунт без shell
+        logger.info(f"SSH exec unavailable, bundle mode disabled: {e}")
+
+    if compression == "zstd" and zstandard is None:
+        compression = "gzip"
+    _tools_cache[transport] = compression
+    return compression
+
+
+def upload_bundle(sftp, root: str, items: list, logs, blobs):
+    """
+    Отправляет файлы одним tar-потоком через exec-канал и распаковывает в root на сервере.
+    items: [(relpath внутри root, FileModel)], blobs: BlobCache, откуда берем содержимое.
+    Возвращает список relpath, которые не прошли проверку sha256 (их нужно залить по одному),
+    или None, если бандл на этом сервере невозможен — тогда заливаем все по одному.
+    """
+    transport = sftp.get_channel().get_transport()
+    compression = _remote_compression(transport)
+    if compression is None:
+        return None
+
+    quoted_root = shlex.quote(root)
+    decompress = "zstd -dc" if compression == "zstd" else "gzip -dc"
+    channel = transport.open_session()
+    try:
+        channel.exec_command(
+            f"mkdir -p {quoted_root} && cd {quoted_root} && {decompress} | tar -xf - --no-same-owner"
+        )
+        writer = _ChannelWriter(channel)
+        if compression == "zstd":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(writer, closefd=False)
+            tar = tarfile.open(fileobj=stream, mode="w|")
+        else:
+            stream = None
+            tar = tarfile.open(fileobj=writer, mode="w|gz")
+
+        with tar:
+            for rel, file_obj in items:
+                info = tarfile.TarInfo(name=rel)
+                info.size = file_obj.size
+                info.mode = 0o644
+                with blobs.open(file_obj) as data:
+                    tar.addfile(info, data)
+        if stream is not None:
+            stream.close()
+
+        channel.shutdown_write()
+        stderr = channel.makefile_stderr("rb").read()
+        if channel.recv_exit_status() != 0:
+            raise Exception(f"remote extract failed: {stderr.decode(errors='ignore').strip()}")
+    finally:
+        channel.close()
+
+    logs.append(
+        f"📦 Bundle ({compression}): {len(items)} files -> {root}",
+        phase="bundle", files=len(items), bytes=sum(f.size for _, f in items)
+    )
+
+    # Проверка: sha256sum -c по списку с stdin, одним вызовом
+    checklist = "".join(f"{f.sha256}  {rel}\n" for rel, f in items).encode()
+    _, out, _ = _exec(transport, f"cd {quoted_root} && sha256sum -c - 2>/dev/null", checklist)
+    failed = []
+    ok = set()
+    for line in out.decode(errors="ignore").splitlines():
+        path, _, result = line.rpartition(": ")
+        if result == "OK":
+            ok.add(path)
+    for rel, _ in items:
+        if rel not in ok:
+            failed.append(rel)
+    return failed
@@ -0,0 +1,151 @@
+import paramiko
+import threading
+import socket
+import hashlib
+import logging
+import time
+import os
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Сколько живет неиспользуемая сессия до закрытия
+SFTP_POOL_IDLE_TIMEOUT = int(os.getenv("SFTP_POOL_IDLE_TIMEOUT", "300"))
+# Максимум одновременных сессий на один сервер (host, port)
+SFTP_POOL_MAX_PER_HOST = int(os.getenv("SFTP_POOL_MAX_PER_HOST", "4"))
+# Сессию, простоявшую дольше этого, перед выдачей проверяем живым запросом
+SFTP_POOL_HEALTHCHECK_AFTER = 30
+SFTP_CONNECT_TIMEOUT = 15
+
+
+class _PooledSession:
+    def __init__(self, transport, sftp, secret_hash):
+        self.transport = transport
+        self.sftp = sftp
+        self.secret_hash = secret_hash
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try: self.sftp.close()
+        except Exception: pass
+        try: self.transport.close()
+        except Exception: pass
+
+
+class SFTPSessionPool:
+    """
+    Пул SSH/SFTP сессий с ключом (host, port, username).
+    Рукопожатие и авторизация — раз в период простоя, а не на каждую операцию.
+    Потокобезопасный: вся работа с paramiko идет в threadpool.
+    """
+
+    def __init__(self, idle_timeout: int = SFTP_POOL_IDLE_TIMEOUT, max_per_host: int = SFTP_POOL_MAX_PER_HOST):
+        self.idle_timeout = idle_timeout
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._idle = {}   # (host, port, username) -> [_PooledSession]
+        self._slots = {}  # (host, port) -> BoundedSemaphore
+
+    @contextmanager
+    def session(self, config):
+        """
+        Выдает SFTPClient для конфига SFTPConnection.
+        Если внутри блока упала сетевая ошибка — сессия выбрасывается, а не возвращается в пул.
+        """
+        key = (config.host, config.port, config.username)
+        secret_hash = hashlib.sha256((config.password or "").encode()).hexdigest()
+
+        slots = self._get_slots((config.host, config.port))
+        if not slots.acquire(timeout=60):
+            raise Exception(f"SFTP pool exhausted for {config.host}:{config.port}")
+
+        try:
+            pooled = self._take_idle(key, secret_hash) or self._connect(config, secret_hash)
+        except BaseException:
+            slots.release()
+            raise
+
+        broken = False
+        try:
+            yield pooled.sftp
+        except (paramiko.SSHException, EOFError, ConnectionError, socket.timeout):
+            broken = True
+            raise
+        finally:
+            if broken or not pooled.transport.is_active():
+                pooled.close()
+            else:
+                self._put_idle(key, pooled)
+            slots.release()
+
+    def close_all(self):
+        with self._lock:
+            sessions = [s for bucket in self._idle.values() for s in bucket]
+            self._idle.clear()
+        for s in sessions:
+            s.close()
+
+    def _get_slots(self, host_key):
+        with self._lock:
+            slots = self._slots.get(host_key)
+            if slots is None:
+                slots = threading.BoundedSemaphore(self.max_per_host)
+                self._slots[host_key] = slots
+            return slots
+
+    def _take_idle(self, key, secret_hash):
+        now = time.monotonic()
+        expired = []
+        found = None
+        with self._lock:
+            # Заодно вычищаем протухшие сессии по всем ключам
+            for bucket_key, bucket in list(self._idle.items()):
+                alive = []
+                for s in bucket:
+                    if now - s.last_used > self.idle_timeout or not s.transport.is_active():
+                        expired.append(s)
+                    else:
+                        alive.append(s)
+                self._idle[bucket_key] = alive
+
+            bucket = self._idle.get(key, [])
+            while bucket and found is None:
+                s = bucket.pop()
+                if s.secret_hash != secret_hash:
+                    # Пароль в конфиге сменили — старую сессию не отдаем
+                    expired.append(s)
+                else:
+                    found = s
+
+        for s in expired:
+            s.close()
+
+        if found is not None and now - found.last_used > SFTP_POOL_HEALTHCHECK_AFTER:
+            try:
+                found.sftp.normalize(".")
+            except Exception:
+                found.close()
+                return None
+        return found
+
+    def _put_idle(self, key, pooled):
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault(key, []).append(pooled)
+
+    def _connect(self, config, secret_hash):
+        logger.info(f"Opening SFTP session to {config.host}:{config.port}")
+        transport = paramiko.Transport((config.host, config.port))
+        transport.banner_timeout = SFTP_CONNECT_TIMEOUT
+        try:
+            transport.connect(username=config.username, password=config.password)
+            # keepalive, чтобы NAT/фаервол не рвал простаивающие сессии
+            transport.set_keepalive(30)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+        except Exception:
+            transport.close()
+            raise
+        return _PooledSession(transport, sftp, secret_hash)
+
+
+sftp_pool = SFTPSessionPool()
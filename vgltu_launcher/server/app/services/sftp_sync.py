@@ -1,171 +1,406 @@
-import paramiko
-import os
-import io
+from paramiko.sftp import CMD_EXTENDED
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import stat
+import posixpath
 import logging
 from sqlalchemy.future import select
-from app.models import SFTPConnection, Instance, File as FileModel, instance_files, SideType
-from app.database import minio_client, BUCKET_NAME
+from app.models import SFTPConnection, File as FileModel
+from app.services.instance_versions import resolved_files, get_current_version_id, SERVER_SIDES
+from app.services.blob_cache import BlobCache
+from app.services.sync_events import SyncLog, SyncProgress
+from app.services.sftp_pool import sftp_pool
+from app.services.sftp_bundle import upload_bundle, BUNDLE_MIN_FILES
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Служебные папки для staged-деплоя (в корне SFTP, на той же ФС что и mods/ —
+# иначе rename не будет атомарным)
+STAGING_DIR = ".staging"
+PREVIOUS_DIR = ".previous"
+
+def folders_to_sync(config) -> list:
+    """Какие папки сборки раздаются на этот сервер (общая логика для SFTP и агента)"""
+    folders = []
+    if config.sync_mods: folders.append("mods")
+    if config.sync_config: folders.append("config")
+    if config.sync_scripts: folders.append("scripts")
+    if config.sync_shaderpacks: folders.append("shaderpacks")
+    if config.sync_resourcepacks: folders.append("resourcepacks")
+    return folders
+
 class SFTPSyncService:
     def __init__(self, db_session):
         self.db = db_session
+        # Кеш блобов текущей синхронизации (общий для всех целевых серверов)
+        self.blobs = None
 
-    async def sync_instance(self, instance_id: str):
-        # 1. Получаем конфиг
-        stmt = select(SFTPConnection).where(SFTPConnection.instance_id == instance_id)
-        config = (await self.db.execute(stmt)).scalars().first()
+    async def _load_targets(self, instance_id: str, target_id: int = None) -> list:
+        # Серверы с агентом сами забирают обновления — по SFTP к ним не ходим
+        stmt = select(SFTPConnection).where(
+            SFTPConnection.instance_id == instance_id,
+            SFTPConnection.transport == "sftp"
+        )
+        if target_id is not None:
+            stmt = stmt.where(SFTPConnection.id == target_id)
+        return list((await self.db.execute(stmt.order_by(SFTPConnection.id))).scalars().all())
+
+    async def sync_instance(self, instance_id: str, target_id: int = None, progress: SyncProgress = None):
+        """
+        Синхронизирует сборку на все ее серверы (или на один, если задан target_id).
+        Список файлов считается один раз, каждый блоб читается из MinIO один раз
+        и параллельно раздается всем серверам.
+        progress — куда публиковать события по ходу работы (для SSE в админке).
+        """
+        # 1. Получаем конфиги целевых серверов
+        targets = await self._load_targets(instance_id, target_id)
         
-        if not config:
+        if not targets:
             raise Exception("SFTP configuration not found")
 
-        # 2. Получаем файлы инстанса
-        # === ВАЖНО: Добавляем поле side в выборку ===
+        # 2. Получаем файлы опубликованной версии сборки
+        version_id = await get_current_version_id(self.db, instance_id)
+        resolved = resolved_files(version_id)
         stmt_files = (
-            select(FileModel, instance_files.c.path, instance_files.c.side) # <--- ADD side
-            .join(instance_files, FileModel.sha256 == instance_files.c.file_hash)
-            .where(instance_files.c.instance_id == instance_id)
+            select(FileModel, resolved.c.path)
+            .join(resolved, FileModel.sha256 == resolved.c.file_hash)
             # === ФИЛЬТР: Берем только то, что нужно серверу ===
-            .where(instance_files.c.side.in_([SideType.SERVER, SideType.BOTH])) 
+            .where(resolved.c.side.in_(SERVER_SIDES))
+        )
+        # files — список кортежей (FileModel, path)
+        files = [(f, path) for f, path in (await self.db.execute(stmt_files)).all()]
+
+        # 3. Раздаем на все серверы параллельно (paramiko блокирующий — каждый сервер в своем потоке)
+        self.blobs = BlobCache()
+        root_log = SyncLog(progress.emit if progress else None)
+        target_logs = [root_log.child(config.name) for config in targets]
+        results = await asyncio.gather(
+            *(run_in_threadpool(self._sync_target, config, files, log) for config, log in zip(targets, target_logs)),
+            return_exceptions=True
         )
-        # files теперь список кортежей (FileModel, path, side)
-        files_result = (await self.db.execute(stmt_files)).all() 
 
-        # Преобразуем в удобный список, отбрасывая side (он уже отфильтрован)
-        files = [(f, path) for f, path, side in files_result]
+        logs = []
+        errors = []
+        now = datetime.utcnow()
+        for config, log, result in zip(targets, target_logs, results):
+            prefix = f"[{config.name}] " if len(targets) > 1 else ""
+            logs.extend(prefix + line for line in log)
+            if isinstance(result, Exception):
+                errors.append(f"[{config.name}] {result}")
+                logs.append(f"❌ [{config.name}] SFTP Error: {result}")
+                log.append(f"❌ SFTP Error: {result}", phase="target_error")
+                continue
+            config.last_sync = now
+            log.append("✅ Target synced", phase="target_done")
 
-        # 3. Подключаемся по SFTP
-        transport = paramiko.Transport((config.host, config.port))
-        try:
-            transport.connect(username=config.username, password=config.password)
-            sftp = paramiko.SFTPClient.from_transport(transport)
-            
+        logs.append(f"📊 Storage reads: {self.blobs.storage_reads}, targets: {len(targets)}")
+        await self.db.commit()
+
+        if errors:
+            raise Exception("SFTP Error: " + "; ".join(errors))
+        return "\n".join(logs)
+
+    def _sync_target(self, config, files, logs: SyncLog):
+        """Синхронизация одного сервера (выполняется в threadpool)"""
+        folders_to_sync = self._folders_to_sync(config)
+        # Сессию берем из пула (без нового SSH-рукопожатия, если она еще жива)
+        with sftp_pool.session(config) as sftp:
+            if config.staged_deploy:
+                # Собираем новую версию рядом и подменяем папки переименованием
+                version = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+                self._deploy_staged(sftp, folders_to_sync, files, version, logs, config.bundle_transfer)
+            else:
+                for folder in folders_to_sync:
+                    self._sync_folder_in_place(sftp, folder, files, logs, config.bundle_transfer)
+
+    async def rollback_instance(self, instance_id: str, target_id: int = None):
+        """
+        Возвращает предыдущую версию папок, сохраненную staged-деплоем в .previous/.
+        Повторный вызов возвращает обратно (папки просто меняются местами).
+        """
+        targets = await self._load_targets(instance_id, target_id)
+
+        if not targets:
+            raise Exception("SFTP configuration not found")
+
+        def do_rollback(config):
             logs = []
-            
-            # 4. Определяем папки для синхра
-            folders_to_sync = []
-            if config.sync_mods: folders_to_sync.append("mods")
-            if config.sync_config: folders_to_sync.append("config")
-            if config.sync_scripts: folders_to_sync.append("scripts")
-            if config.sync_shaderpacks: folders_to_sync.append("shaderpacks")
-            if config.sync_resourcepacks: folders_to_sync.append("resourcepacks")
-
-            for folder in folders_to_sync:
-                logs.append(f"📂 Syncing folder: {folder}...")
-                
-                # Фильтруем файлы только для этой папки
-                folder_files = [
-                    (f, path) for f, path in files 
-                    if path.startswith(f"{folder}/")
-                ]
-                
-                # Создаем удаленную папку если нет
-                try: sftp.mkdir(folder)
-                except: pass
-
-                # А. Получаем список файлов на сервере (для удаления лишних)
-                remote_files = set()
-                try:
-                    remote_files = set(sftp.listdir(folder))
-                except: pass
-
-                # Б. Заливаем файлы
-                expected_filenames = set()
-                for file_obj, path_str in folder_files:
-                    filename = os.path.basename(path_str)
-                    expected_filenames.add(filename)
-                    remote_path = f"{folder}/{filename}"
-                    
-                    # Проверяем размер (простая проверка изменений)
-                    need_upload = True
-                    try:
-                        attrs = sftp.stat(remote_path)
-                        if attrs.st_size == file_obj.size:
-                            need_upload = False
-                    except: pass # Файла нет
-
-                    if need_upload:
-                        logs.append(f"⬆️ Uploading: {filename}")
-                        # Качаем с MinIO в память
-                        data = minio_client.get_object(BUCKET_NAME, file_obj.s3_path)
-                        # Лъем на SFTP
-                        sftp.putfo(io.BytesIO(data.read()), remote_path)
-                        data.close()
-                        data.release_conn()
-
-                # В. Удаляем лишнее (то, чего нет в базе, но есть на сервере)
-                for r_file in remote_files:
-                    if r_file not in expected_filenames:
-                        logs.append(f"🗑️ Deleting remote: {r_file}")
-                        try: sftp.remove(f"{folder}/{r_file}")
-                        except: pass
-
-            config.last_sync = datetime.utcnow()
-            await self.db.commit()
-            return "\n".join(logs)
-
-        except Exception as e:
-            raise Exception(f"SFTP Error: {str(e)}")
-        finally:
-            transport.close()
+            swap_tmp = f"{STAGING_DIR}/rollback-swap"
+            with sftp_pool.session(config) as sftp:
+                self._mkdir(sftp, STAGING_DIR)
+
+                for folder in self._folders_to_sync(config):
+                    previous = f"{PREVIOUS_DIR}/{folder}"
+                    if not self._exists(sftp, previous):
+                        logs.append(f"⚠️ [{config.name}] No previous version for: {folder}")
+                        continue
+
+                    # live -> tmp, previous -> live, tmp -> previous
+                    self._rmtree(sftp, swap_tmp)
+                    live_exists = self._exists(sftp, folder)
+                    if live_exists:
+                        sftp.rename(folder, swap_tmp)
+                    sftp.rename(previous, folder)
+                    if live_exists:
+                        sftp.rename(swap_tmp, previous)
+                    logs.append(f"↩️ [{config.name}] Rolled back: {folder}")
+            return logs
+
+        logs = []
+        for config in targets:
+            try:
+                logs.extend(await run_in_threadpool(do_rollback, config))
+            except Exception as e:
+                raise Exception(f"SFTP Error: [{config.name}] {str(e)}")
+        return "\n".join(logs)
 
     async def cleanup_instance(self, instance_id: str, target_folders: list = None):
         """
-        Удаляет указанные папки с удаленного сервера через SFTP.
+        Удаляет указанные папки со всех серверов сборки через SFTP.
         Используется при удалении сборки.
         """
         if target_folders is None:
             # Дефолтный набор для зачистки
             target_folders = ["mods", "config", "scripts", "shaderpacks", "resourcepacks"]
 
-        # 1. Получаем конфиг (пока он еще есть в БД)
-        stmt = select(SFTPConnection).where(SFTPConnection.instance_id == instance_id)
-        config = (await self.db.execute(stmt)).scalars().first()
+        # 1. Получаем конфиги (пока они еще есть в БД)
+        targets = await self._load_targets(instance_id)
         
-        if not config:
+        if not targets:
             logger.warning(f"Skipping remote cleanup for {instance_id}: No SFTP config found.")
             return
 
-        logger.info(f"Starting remote cleanup for {instance_id} on {config.host}...")
-        
-        transport = paramiko.Transport((config.host, config.port))
+        def do_cleanup(config):
+            with sftp_pool.session(config) as sftp:
+                for folder in target_folders + [STAGING_DIR, PREVIOUS_DIR]:
+                    logger.info(f"Removing remote folder: {folder}")
+                    self._rmtree(sftp, folder)
+
+        for config in targets:
+            logger.info(f"Starting remote cleanup for {instance_id} on {config.host}...")
+            try:
+                await run_in_threadpool(do_cleanup, config)
+                logger.info("Remote cleanup completed.")
+            except Exception as e:
+                logger.error(f"Remote cleanup failed: {e}")
+                # Не рейзим ошибку, чтобы не блокировать удаление сборки из БД
+
+    def _folders_to_sync(self, config) -> list:
+        return folders_to_sync(config)
+
+    def _expected_tree(self, folder, files) -> dict:
+        """Файлы из БД для папки: относительный путь внутри папки -> FileModel"""
+        prefix = f"{folder}/"
+        return {
+            path[len(prefix):]: f for f, path in files
+            if path.startswith(prefix) and len(path) > len(prefix)
+        }
+
+    def _list_remote_tree(self, sftp, root):
+        """
+        Обходит удаленное дерево: один listdir_attr на директорию.
+        Возвращает ({relpath: attrs} для файлов, {relpath} для папок).
+        """
+        remote_files = {}
+        remote_dirs = set()
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            full_dir = f"{root}/{rel_dir}" if rel_dir else root
+            try:
+                entries = sftp.listdir_attr(full_dir)
+            except IOError:
+                continue
+            for attrs in entries:
+                rel = f"{rel_dir}/{attrs.filename}" if rel_dir else attrs.filename
+                if stat.S_ISDIR(attrs.st_mode or 0):
+                    remote_dirs.add(rel)
+                    pending.append(rel)
+                else:
+                    remote_files[rel] = attrs
+        return remote_files, remote_dirs
+
+    def _parent_dirs(self, relpaths) -> set:
+        dirs = set()
+        for rel in relpaths:
+            parent = posixpath.dirname(rel)
+            while parent and parent not in dirs:
+                dirs.add(parent)
+                parent = posixpath.dirname(parent)
+        return dirs
+
+    def _make_dirs(self, sftp, root, dirs, existing=()):
+        """Создает недостающие папки одним проходом: родители раньше детей"""
+        for rel in sorted(set(dirs) - set(existing), key=lambda d: d.count("/")):
+            self._mkdir(sftp, f"{root}/{rel}")
+
+    def _sync_folder_in_place(self, sftp, folder, files, logs, bundle=False):
+        """Старый режим: заливаем прямо в живую папку и удаляем лишнее (рекурсивно)"""
+        logs.append(f"📂 Syncing folder: {folder}...", phase="folder", folder=folder)
+
+        expected = self._expected_tree(folder, files)
+        needed_dirs = self._parent_dirs(expected)
+
+        # Создаем удаленную папку если нет
+        self._mkdir(sftp, folder)
+
+        # А. Снимок удаленного дерева (для сравнения размеров и удаления лишних)
+        remote_files, remote_dirs = self._list_remote_tree(sftp, folder)
+
+        # Конфликты типов: на сервере файл там, где у нас папка, и наоборот
+        for rel in needed_dirs & remote_files.keys():
+            logs.append(f"🗑️ Deleting remote: {folder}/{rel}", phase="delete", file=f"{folder}/{rel}")
+            sftp.remove(f"{folder}/{rel}")
+            del remote_files[rel]
+        for rel in sorted(remote_dirs & expected.keys(), key=lambda d: -d.count("/")):
+            logs.append(f"🗑️ Deleting remote: {folder}/{rel}/", phase="delete", file=f"{folder}/{rel}/")
+            self._rmtree(sftp, f"{folder}/{rel}")
+            remote_dirs = {d for d in remote_dirs if d != rel and not d.startswith(f"{rel}/")}
+            remote_files = {f: a for f, a in remote_files.items() if not f.startswith(f"{rel}/")}
+
+        # Б. Папки — пачкой, только недостающие
+        self._make_dirs(sftp, folder, needed_dirs, remote_dirs)
+
+        # В. Заливаем только изменившиеся файлы (простая проверка по размеру)
+        changed = [
+            (rel, file_obj) for rel, file_obj in expected.items()
+            if remote_files.get(rel) is None or remote_files[rel].st_size != file_obj.size
+        ]
+        self._upload_many(sftp, folder, folder, changed, logs, bundle)
+
+        # Г. Удаляем лишнее снизу вверх: сначала файлы, потом опустевшие папки
+        for rel in remote_files.keys() - expected.keys():
+            logs.append(f"🗑️ Deleting remote: {folder}/{rel}", phase="delete", file=f"{folder}/{rel}")
+            try: sftp.remove(f"{folder}/{rel}")
+            except IOError: pass
+        for rel in sorted(remote_dirs - needed_dirs, key=lambda d: -d.count("/")):
+            logs.append(f"🗑️ Deleting remote: {folder}/{rel}/", phase="delete", file=f"{folder}/{rel}/")
+            try: sftp.rmdir(f"{folder}/{rel}")
+            except IOError: pass
+
+    def _deploy_staged(self, sftp, folders, files, version, logs, bundle=False):
+        """
+        Staged-режим: собираем полный набор в .staging/<version>/<folder>,
+        неизмененные файлы берем хардлинком из живой папки (без перезаливки),
+        затем подменяем папки rename'ами. Старая версия остается в .previous/.
+        """
+        staging_root = f"{STAGING_DIR}/{version}"
+        self._mkdir(sftp, STAGING_DIR)
+        self._mkdir(sftp, staging_root)
+        self._mkdir(sftp, PREVIOUS_DIR)
+
+        can_hardlink = True
+        for folder in folders:
+            logs.append(f"📦 Staging folder: {folder} -> {staging_root}/{folder}", phase="folder", folder=folder)
+            stage_dir = f"{staging_root}/{folder}"
+            self._mkdir(sftp, stage_dir)
+
+            expected = self._expected_tree(folder, files)
+            self._make_dirs(sftp, stage_dir, self._parent_dirs(expected))
+
+            # Размеры файлов в живой папке: один listdir_attr на директорию вместо stat на каждый файл
+            live_files, _ = self._list_remote_tree(sftp, folder)
+
+            to_upload = []
+            for rel, file_obj in expected.items():
+                live_attrs = live_files.get(rel)
+
+                if can_hardlink and live_attrs is not None and live_attrs.st_size == file_obj.size:
+                    try:
+                        self._hardlink(sftp, f"{folder}/{rel}", f"{stage_dir}/{rel}")
+                        continue
+                    except IOError:
+                        # Сервер не поддерживает hardlink@openssh.com — дальше просто заливаем
+                        can_hardlink = False
+                        logs.append("⚠️ Hardlinks not supported, falling back to upload", phase="warning")
+
+                to_upload.append((rel, file_obj))
+
+            self._upload_many(sftp, stage_dir, folder, to_upload, logs, bundle)
+
+        # Подмена: окно "полуживого" состояния — пара rename на папку
+        for folder in folders:
+            previous = f"{PREVIOUS_DIR}/{folder}"
+            self._rmtree(sftp, previous)
+            if self._exists(sftp, folder):
+                sftp.rename(folder, previous)
+            sftp.rename(f"{staging_root}/{folder}", folder)
+            logs.append(f"🔁 Swapped: {folder} (previous kept in {previous})", phase="swap", folder=folder)
+
+        self._rmtree(sftp, staging_root)
+
+    def _upload_many(self, sftp, root, label, items, logs, bundle=False):
+        """
+        Заливает [(relpath, FileModel)] в root. В bundle-режиме пробует одним
+        tar-потоком через SSH exec; что не удалось — докачивает по одному через SFTP.
+        """
+        if bundle and len(items) >= BUNDLE_MIN_FILES:
+            failed = upload_bundle(sftp, root, items, logs, self.blobs)
+            if failed is None:
+                logs.append("⚠️ Remote lacks tar/sha256sum or shell access, falling back to per-file SFTP", phase="warning")
+            else:
+                if failed:
+                    logs.append(f"⚠️ Checksum mismatch for {len(failed)} files, re-uploading via SFTP", phase="warning")
+                failed = set(failed)
+                items = [(rel, f) for rel, f in items if rel in failed]
+
+        for rel, file_obj in items:
+            logs.append(f"⬆️ Uploading: {label}/{rel}", phase="upload", file=f"{label}/{rel}", bytes=file_obj.size)
+            self._upload(sftp, file_obj, f"{root}/{rel}")
+
+    def _upload(self, sftp, file_obj, remote_path):
+        """
+        Берет объект из кеша блобов (или MinIO) и заливает через временный файл + rename.
+        Никогда не пишем поверх существующего файла: он может быть хардлинком
+        на копию в .previous/, и перезапись испортила бы откат.
+        """
+        tmp_path = f"{remote_path}.part"
+        with self.blobs.open(file_obj) as data:
+            sftp.putfo(data, tmp_path)
         try:
-            transport.connect(username=config.username, password=config.password)
-            sftp = paramiko.SFTPClient.from_transport(transport)
-
-            for folder in target_folders:
-                logger.info(f"Removing remote folder: {folder}")
-                self._rmtree(sftp, folder)
-                
-            logger.info("Remote cleanup completed.")
-        except Exception as e:
-            logger.error(f"Remote cleanup failed: {e}")
-            # Не рейзим ошибку, чтобы не блокировать удаление сборки из БД
-        finally:
-            transport.close()
+            sftp.posix_rename(tmp_path, remote_path)
+        except IOError:
+            # Без posix-rename@openssh.com обычный rename не перезаписывает цель
+            try: sftp.remove(remote_path)
+            except IOError: pass
+            sftp.rename(tmp_path, remote_path)
+
+    def _hardlink(self, sftp, src, dst):
+        # paramiko не умеет hardlink@openssh.com из коробки, шлем extended-запрос сами
+        # (так же paramiko реализует posix_rename)
+        sftp._request(CMD_EXTENDED, "hardlink@openssh.com", sftp._adjust_cwd(src), sftp._adjust_cwd(dst))
+
+    def _mkdir(self, sftp, remote_path):
+        try: sftp.mkdir(remote_path)
+        except IOError: pass
+
+    def _exists(self, sftp, remote_path) -> bool:
+        try:
+            sftp.stat(remote_path)
+            return True
+        except IOError:
+            return False
 
     def _rmtree(self, sftp, remote_path):
         """
         Рекурсивное удаление папки через SFTP (аналог rm -rf)
         """
         try:
-            files = sftp.listdir(remote_path)
+            entries = sftp.listdir_attr(remote_path)
         except IOError:
             # Папки нет или нет доступа
             return
 
-        for f in files:
-            filepath = os.path.join(remote_path, f).replace("\\", "/")
-            try:
-                # Пробуем удалить как файл
-                sftp.remove(filepath)
-            except IOError:
-                # Если ошибка, скорее всего это папка -> рекурсия
+        for attrs in entries:
+            filepath = f"{remote_path}/{attrs.filename}"
+            if stat.S_ISDIR(attrs.st_mode or 0):
                 self._rmtree(sftp, filepath)
+            else:
+                try: sftp.remove(filepath)
+                except IOError: pass
         
         try:
             sftp.rmdir(remote_path)
         except IOError:
-            pass
\ No newline at end of file
+            pass
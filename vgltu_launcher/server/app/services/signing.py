@@ -0,0 +1,113 @@
+import os
+import base64
+import logging
+import threading
+from datetime import datetime
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+
+logger = logging.getLogger(__name__)
+
+# Приватные ключи: <kid>.pem. Активный — YGGDRASIL_SIGNING_KEY_ID или самый новый по имени
+KEYS_DIR = os.getenv("YGGDRASIL_KEYS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "keys"))
+KEY_SIZE = 4096
+
+
+# Ключ, который воркеры создают при первом старте. Имя фиксированное: все воркеры
+# гонятся за один файл, а не создают каждый свой ключ со своей секундой в kid.
+# Сортируется раньше любого ключа от rotate_signing_key
+BOOTSTRAP_KEY_ID = "k00000000000000"
+
+
+def new_key_id() -> str:
+    return datetime.utcnow().strftime("k%Y%m%d%H%M%S")
+
+
+def generate_key(keys_dir: str = KEYS_DIR, kid: str = None) -> str:
+    """
+    Создает новый ключ. PEM пишется во временный файл и публикуется через os.link:
+    читатель не увидит недописанный <kid>.pem, а если файл уже есть — FileExistsError
+    """
+    kid = kid or new_key_id()
+    os.makedirs(keys_dir, exist_ok=True)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=KEY_SIZE)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    tmp_path = os.path.join(keys_dir, f".{kid}.{os.getpid()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pem)
+            f.flush()
+            os.fsync(f.fileno())
+        os.link(tmp_path, os.path.join(keys_dir, f"{kid}.pem"))
+    finally:
+        os.unlink(tmp_path)
+    return kid
+
+
+class SigningKeys:
+    """
+    Ключи подписи свойств профиля (SHA1withRSA, как у Mojang).
+    Загружаются один раз при старте; подписывается только активным ключом.
+    Профили, подписанные старым ключом, переподписываются лениво при первом чтении —
+    ротация не сбрасывает весь кеш профилей разом.
+    """
+
+    def __init__(self, keys_dir: str = KEYS_DIR):
+        self.keys_dir = keys_dir
+        self._lock = threading.Lock()
+        self._active_kid = None
+        self._private_key = None
+        self._public_pem = None
+
+    def load(self):
+        with self._lock:
+            if self._private_key is not None:
+                return
+            kids = self._list_kids()
+            if not kids:
+                try:
+                    generate_key(self.keys_dir, BOOTSTRAP_KEY_ID)
+                    logger.info(f"🔑 Generated Yggdrasil signing key in {self.keys_dir}")
+                except FileExistsError:
+                    pass  # соседний воркер успел раньше — берем его ключ
+                kids = self._list_kids()
+
+            kid = os.getenv("YGGDRASIL_SIGNING_KEY_ID") or kids[-1]
+            with open(os.path.join(self.keys_dir, f"{kid}.pem"), "rb") as f:
+                private_key = serialization.load_pem_private_key(f.read(), password=None)
+
+            self._public_pem = private_key.public_key().public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            ).decode()
+            self._active_kid = kid
+            self._private_key = private_key
+            logger.info(f"🔑 Yggdrasil signing key: {kid}")
+
+    def _list_kids(self) -> list:
+        if not os.path.isdir(self.keys_dir):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.keys_dir) if name.endswith(".pem"))
+
+    @property
+    def active_kid(self) -> str:
+        self.load()
+        return self._active_kid
+
+    def public_key_pem(self) -> str:
+        self.load()
+        return self._public_pem
+
+    def sign(self, value: str) -> tuple:
+        """(base64-подпись, kid)"""
+        self.load()
+        signature = self._private_key.sign(value.encode(), padding.PKCS1v15(), hashes.SHA1())
+        return base64.b64encode(signature).decode(), self._active_kid
+
+
+signing_keys = SigningKeys()
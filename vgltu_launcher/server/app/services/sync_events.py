@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+import logging
+from app.database import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних событий хранить в стриме одной сборки (хватает на переподключение)
+SYNC_STREAM_MAXLEN = 5000
+# Как долго XREAD ждет новых событий, прежде чем отправить keepalive
+SSE_BLOCK_MS = 15000
+
+
+def sync_stream_key(instance_id: str) -> str:
+    return f"sync:events:{instance_id}"
+
+
+def sync_lock_key(instance_id: str) -> str:
+    return f"sync:lock:{instance_id}"
+
+
+class SyncLog:
+    """
+    Лог синхронизации: строки для итогового текста + структурированные события.
+    append(message) совместим со старым list-логом; phase/file/bytes уходят в прогресс.
+    Потокобезопасен настолько, насколько потокобезопасен publish (SyncProgress.emit — да).
+    """
+
+    def __init__(self, publish=None, target: str = ""):
+        self.lines = []
+        self._publish = publish
+        self.target = target
+
+    def append(self, message: str, phase: str = "info", **fields):
+        self.lines.append(message)
+        if self._publish is not None:
+            self._publish({"phase": phase, "target": self.target, "message": message, **fields})
+
+    def child(self, target: str) -> "SyncLog":
+        return SyncLog(self._publish, target)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+class SyncProgress:
+    """
+    Публикует события синхронизации в Redis Stream sync:events:<instance_id>.
+    emit() можно вызывать из потоков threadpool: события складываются в asyncio.Queue
+    и пишутся одной фоновой задачей — порядок сохраняется.
+    """
+
+    def __init__(self, instance_id: str, sync_id: str):
+        self.instance_id = instance_id
+        self.sync_id = sync_id
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._drain())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._queue.put_nowait(None)
+        await self._task
+
+    def emit(self, event: dict):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    async def publish(self, phase: str, message: str = "", **fields) -> str:
+        """Публикация из event loop (в обход очереди) — возвращает id события"""
+        return await publish_sync_event(self.instance_id, self.sync_id, phase, message, **fields)
+
+    async def _drain(self):
+        while True:
+            event = await self._queue.get()
+            if event is None:
+                return
+            try:
+                await publish_sync_event(self.instance_id, self.sync_id, **event)
+            except Exception as e:
+                # Прогресс — не критичная часть: синхронизация продолжается
+                logger.warning(f"Failed to publish sync event: {e}")
+
+
+async def publish_sync_event(instance_id: str, sync_id: str, phase: str, message: str = "", **fields) -> str:
+    payload = {"sync_id": sync_id, "ts": time.time(), "phase": phase, "message": message, **fields}
+    return await redis_client.xadd(
+        sync_stream_key(instance_id),
+        {"data": json.dumps(payload, ensure_ascii=False)},
+        maxlen=SYNC_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+async def sse_sync_events(instance_id: str, last_event_id: str, request):
+    """
+    Генератор Server-Sent Events поверх XREAD.
+    id события = id в Redis Stream, поэтому браузер при переподключении
+    присылает Last-Event-ID и продолжает ровно с того места.
+    Закрывается после события done.
+    """
+    key = sync_stream_key(instance_id)
+    last_id = last_event_id
+    if not last_id:
+        # Без Last-Event-ID — только новые события. "$" нельзя держать между XREAD,
+        # иначе события между вызовами теряются: фиксируем конкретный id
+        latest = await redis_client.xrevrange(key, count=1)
+        last_id = latest[0][0] if latest else "0-0"
+    yield "retry: 3000\n\n"
+
+    while not await request.is_disconnected():
+        response = await redis_client.xread({key: last_id}, count=100, block=SSE_BLOCK_MS)
+        if not response:
+            yield ": keepalive\n\n"
+            continue
+
+        for _, entries in response:
+            for event_id, fields in entries:
+                last_id = event_id
+                data = fields.get("data", "{}")
+                yield f"id: {event_id}\ndata: {data}\n\n"
+                if json.loads(data).get("phase") == "done":
+                    return
@@ -0,0 +1,101 @@
+import io
+import os
+import json
+import time
+import base64
+import struct
+import hashlib
+from urllib.parse import urlparse
+from app.database import minio_client, BUCKET_NAME
+from app.services.signing import signing_keys
+
+STORAGE_URL = os.getenv("STORAGE_BASE_URL", "http://localhost:9000/launcher-files")
+# Домены, с которых authlib-injector разрешит грузить текстуры
+SKIN_DOMAINS = [urlparse(STORAGE_URL).hostname or "localhost"]
+
+TEXTURE_MAX_BYTES = 256 * 1024
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Текстура адресуется хешем содержимого — ее можно кешировать навсегда
+TEXTURE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class TextureError(ValueError):
+    pass
+
+
+def texture_s3_path(texture_hash: str) -> str:
+    return f"textures/{texture_hash}"
+
+
+def texture_url(texture_hash: str) -> str:
+    return f"{STORAGE_URL}/{texture_s3_path(texture_hash)}"
+
+
+def png_size(data: bytes) -> tuple:
+    """Ширина и высота из IHDR — без декодирования картинки"""
+    if len(data) < 24 or not data.startswith(PNG_SIGNATURE) or data[12:16] != b"IHDR":
+        raise TextureError("File is not a PNG image")
+    return struct.unpack(">II", data[16:24])
+
+
+def validate_texture(data: bytes, texture_type: str):
+    if len(data) > TEXTURE_MAX_BYTES:
+        raise TextureError("Texture file is too large")
+    width, height = png_size(data)
+    if texture_type == "skin":
+        # 64x64, старый формат 64x32 и HD-скины кратные 64
+        ok = width % 64 == 0 and width <= 512 and height in (width, width // 2)
+    else:
+        # Плащ 64x32 (и кратные), старый формат 22x17
+        ok = (width, height) == (22, 17) or (width % 64 == 0 and width <= 512 and height == width // 2)
+    if not ok:
+        raise TextureError(f"Invalid {texture_type} size: {width}x{height}")
+
+
+def store_texture(data: bytes) -> str:
+    """Кладет текстуру в бакет по хешу (повторная загрузка того же файла ничего не пишет заново)"""
+    texture_hash = hashlib.sha256(data).hexdigest()
+    path = texture_s3_path(texture_hash)
+    try:
+        minio_client.stat_object(BUCKET_NAME, path)
+    except Exception:
+        minio_client.put_object(
+            BUCKET_NAME, path, io.BytesIO(data), len(data),
+            content_type="image/png",
+            metadata={"Cache-Control": TEXTURE_CACHE_CONTROL},
+        )
+    return texture_hash
+
+
+def build_textures_property(user) -> str:
+    """
+    base64-значение свойства textures. Считается один раз при изменении скина/плаща/ника
+    и хранится в users.textures_property — профиль отдается без пересборки.
+    """
+    textures = {}
+    if user.skin_hash:
+        skin = {"url": texture_url(user.skin_hash)}
+        if user.skin_model == "slim":
+            skin["metadata"] = {"model": "slim"}
+        textures["SKIN"] = skin
+    if user.cape_hash:
+        textures["CAPE"] = {"url": texture_url(user.cape_hash)}
+    if not textures:
+        return None
+
+    payload = {
+        "timestamp": int(time.time() * 1000),
+        "profileId": user.mc_uuid.hex,
+        "profileName": user.username,
+        "textures": textures,
+    }
+    return base64.b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def apply_textures(user):
+    """Пересобирает свойство textures и сразу подписывает его активным ключом"""
+    user.textures_property = build_textures_property(user)
+    if user.textures_property:
+        user.textures_signature, user.textures_key_id = signing_keys.sign(user.textures_property)
+    else:
+        user.textures_signature = user.textures_key_id = None
@@ -0,0 +1,308 @@
+import io
+import os
+import gzip
+import json
+import stat
+import random
+import hashlib
+import tarfile
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
+from app.database import engine, minio_client, BUCKET_NAME
+from app.models import SFTPConnection, WorldSnapshot, BackupChunk
+from app.services.sftp_pool import sftp_pool
+from app.services.rcon import rcon_manager, RCONError
+
+logger = logging.getLogger(__name__)
+
+# Content-defined chunking (gear hash): граница чанка зависит от содержимого,
+# поэтому вставка/изменение в середине region-файла не сдвигает остальные чанки
+CHUNK_MIN = 256 * 1024
+CHUNK_AVG_BITS = 20          # ~1 МБ в среднем
+CHUNK_MAX = 4 * 1024 * 1024
+_CHUNK_MASK = ((1 << CHUNK_AVG_BITS) - 1) << (32 - CHUNK_AVG_BITS)
+# Таблица фиксирована (seed), иначе после рестарта границы поплывут и дедупликация пропадет
+_GEAR = [random.Random(0x56474C54 + i).getrandbits(32) for i in range(256)]
+
+SFTP_READ_SIZE = 1024 * 1024
+# Бэкап, который столько висит в running, считается упавшим (рестарт, падение воркера)
+RUNNING_TIMEOUT = int(os.getenv("WORLD_BACKUP_TIMEOUT", str(6 * 3600)))
+# Ключ advisory-lock набора чанков: бэкапы берут его разделяемым, сборка мусора — исключительным
+CHUNKS_LOCK_KEY = 0x57424B50
+# Файлы, которые сервер держит открытыми и которые не нужны для восстановления
+SKIP_FILES = {"session.lock"}
+
+
+@asynccontextmanager
+async def chunks_lock(exclusive: bool = False):
+    """
+    Блокировка набора чанков в Postgres. Бэкап держит ее разделяемой от чтения
+    backup_chunks до коммита манифеста, сборка мусора — исключительной и без
+    ожидания (yield False, если идут бэкапы). Блокировка сессионная, на своем
+    соединении: упал процесс — закрылось соединение — блокировка снята.
+    """
+    async with engine.connect() as conn:
+        if exclusive:
+            acquired = (await conn.execute(select(func.pg_try_advisory_lock(CHUNKS_LOCK_KEY)))).scalar()
+        else:
+            await conn.execute(select(func.pg_advisory_lock_shared(CHUNKS_LOCK_KEY)))
+            acquired = True
+        await conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                unlock = func.pg_advisory_unlock if exclusive else func.pg_advisory_unlock_shared
+                try:
+                    await conn.execute(select(unlock(CHUNKS_LOCK_KEY)))
+                    await conn.commit()
+                except Exception:
+                    # Соединение с висящей блокировкой не должно вернуться в пул
+                    await conn.invalidate()
+
+
+async def expire_stale_snapshots(db) -> int:
+    """Снапшоты, застрявшие в running дольше RUNNING_TIMEOUT, помечаются failed"""
+    result = await db.execute(
+        update(WorldSnapshot)
+        .where(WorldSnapshot.status == "running")
+        .where(WorldSnapshot.created_at < datetime.utcnow() - timedelta(seconds=RUNNING_TIMEOUT))
+        .values(status="failed", error="Interrupted", finished_at=datetime.utcnow())
+    )
+    await db.commit()
+    return result.rowcount
+
+
+def chunk_s3_path(sha256: str) -> str:
+    return f"chunks/{sha256[:2]}/{sha256}"
+
+
+def manifest_s3_path(snapshot: WorldSnapshot) -> str:
+    return f"backups/{snapshot.instance_id}/{snapshot.target_id}/{snapshot.id}.json.gz"
+
+
+def _find_boundary(buf) -> int:
+    n = len(buf)
+    if n <= CHUNK_MIN:
+        return n
+    end = min(n, CHUNK_MAX)
+    h = 0
+    gear = _GEAR
+    mask = _CHUNK_MASK
+    # Первые CHUNK_MIN байт не хешируем: граница там все равно запрещена
+    for i in range(CHUNK_MIN, end):
+        h = ((h << 1) + gear[buf[i]]) & 0xFFFFFFFF
+        if not h & mask:
+            return i + 1
+    return end
+
+
+def iter_chunks(stream):
+    """Режет поток на чанки переменной длины (CHUNK_MIN..CHUNK_MAX)"""
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < CHUNK_MAX:
+            data = stream.read(SFTP_READ_SIZE)
+            if data:
+                buf += data
+            else:
+                eof = True
+        if not buf:
+            return
+        cut = _find_boundary(buf)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+
+class WorldBackupService:
+    def __init__(self, db_session):
+        self.db = db_session
+
+    async def backup_target(self, target_id: int) -> WorldSnapshot:
+        """
+        Инкрементальный бэкап мира одного сервера.
+        Файлы с теми же size/mtime, что в прошлом снапшоте, не читаются вовсе;
+        измененные режутся на чанки, в MinIO уходят только новые чанки.
+        """
+        config = (await self.db.execute(
+            select(SFTPConnection).where(SFTPConnection.id == target_id)
+        )).scalars().first()
+        if not config:
+            raise Exception("Server not found")
+
+        await expire_stale_snapshots(self.db)
+
+        # Пока держим блокировку, сборка мусора чанков не начнется: чанки прошлого
+        # снапшота и known_chunks не пропадут до коммита манифеста, который на них ссылается
+        async with chunks_lock():
+            previous = (await self.db.execute(
+                select(WorldSnapshot)
+                .where(WorldSnapshot.target_id == target_id, WorldSnapshot.status == "success")
+                .order_by(WorldSnapshot.id.desc())
+                .limit(1)
+            )).scalars().first()
+            prev_files = (await run_in_threadpool(self.load_manifest, previous))["files"] if previous else {}
+            known_chunks = set((await self.db.execute(select(BackupChunk.sha256))).scalars().all())
+
+            snapshot = WorldSnapshot(
+                instance_id=config.instance_id,
+                target_id=config.id,
+                world_path=config.world_path,
+                status="running",
+            )
+            self.db.add(snapshot)
+            await self.db.commit()
+
+            # Пока копируем, сервер не должен дописывать region-файлы
+            saving_paused = await self._rcon(config, "save-off")
+            if saving_paused:
+                await self._rcon(config, "save-all flush")
+            try:
+                files, new_chunks, stats = await run_in_threadpool(
+                    self._backup_world, config, prev_files, known_chunks
+                )
+                if new_chunks:
+                    await self.db.execute(
+                        insert(BackupChunk)
+                        .values([{"sha256": sha, "size": size, "s3_path": chunk_s3_path(sha)} for sha, size in new_chunks])
+                        .on_conflict_do_nothing(index_elements=["sha256"])
+                    )
+
+                manifest = {
+                    "version": 1,
+                    "snapshot_id": snapshot.id,
+                    "world_path": config.world_path,
+                    "created_at": snapshot.created_at.isoformat(),
+                    "files": files,
+                }
+                snapshot.manifest_path = manifest_s3_path(snapshot)
+                await run_in_threadpool(self._put_manifest, snapshot.manifest_path, manifest)
+
+                snapshot.files_count = len(files)
+                snapshot.total_bytes = sum(f["size"] for f in files.values())
+                snapshot.files_changed = stats["changed"]
+                snapshot.new_bytes = stats["new_bytes"]
+                snapshot.status = "success"
+                snapshot.finished_at = datetime.utcnow()
+                await self.db.commit()
+                logger.info(
+                    f"💾 Backup #{snapshot.id} of {config.instance_id}/{config.name}: "
+                    f"{stats['changed']} changed files, {stats['new_bytes']} new bytes"
+                )
+                return snapshot
+            except Exception as e:
+                await self.db.rollback()
+                snapshot.status = "failed"
+                snapshot.error = str(e)[:1000]
+                snapshot.finished_at = datetime.utcnow()
+                await self.db.commit()
+                raise
+            finally:
+                if saving_paused:
+                    await self._rcon(config, "save-on")
+
+    async def _rcon(self, config, command: str) -> bool:
+        if not config.rcon_password:
+            return False
+        try:
+            await rcon_manager.client_for(config).command(command)
+            return True
+        except RCONError as e:
+            logger.warning(f"RCON '{command}' failed for {config.name}: {e}")
+            return False
+
+    def _backup_world(self, config, prev_files: dict, known_chunks: set):
+        files = {}
+        new_chunks = []
+        stats = {"changed": 0, "new_bytes": 0}
+        root = config.world_path.rstrip("/")
+
+        with sftp_pool.session(config) as sftp:
+            for rel, attrs in self._walk(sftp, root):
+                entry = {"size": attrs.st_size, "mtime": attrs.st_mtime}
+                prev = prev_files.get(rel)
+                if prev and prev["size"] == entry["size"] and prev["mtime"] == entry["mtime"]:
+                    entry["chunks"] = prev["chunks"]
+                    files[rel] = entry
+                    continue
+
+                stats["changed"] += 1
+                chunks = []
+                size = 0
+                with sftp.open(f"{root}/{rel}", "rb") as remote:
+                    remote.prefetch(attrs.st_size)
+                    for data in iter_chunks(remote):
+                        sha = hashlib.sha256(data).hexdigest()
+                        chunks.append(sha)
+                        size += len(data)
+                        if sha not in known_chunks:
+                            minio_client.put_object(BUCKET_NAME, chunk_s3_path(sha), io.BytesIO(data), len(data))
+                            known_chunks.add(sha)
+                            new_chunks.append((sha, len(data)))
+                            stats["new_bytes"] += len(data)
+                # Файл мог вырасти, пока читали: в манифест — реально прочитанный размер
+                entry["size"] = size
+                entry["chunks"] = chunks
+                files[rel] = entry
+
+        return files, new_chunks, stats
+
+    def _walk(self, sftp, root):
+        """Обход мира: один listdir_attr на директорию, отдает (relpath, attrs)"""
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            entries = sftp.listdir_attr(f"{root}/{rel_dir}" if rel_dir else root)
+            for attrs in entries:
+                rel = f"{rel_dir}/{attrs.filename}" if rel_dir else attrs.filename
+                if stat.S_ISDIR(attrs.st_mode or 0):
+                    pending.append(rel)
+                elif stat.S_ISREG(attrs.st_mode or 0) and attrs.filename not in SKIP_FILES:
+                    yield rel, attrs
+
+    def _put_manifest(self, path: str, manifest: dict):
+        data = gzip.compress(json.dumps(manifest, separators=(",", ":")).encode("utf-8"))
+        minio_client.put_object(BUCKET_NAME, path, io.BytesIO(data), len(data), content_type="application/gzip")
+
+    @staticmethod
+    def load_manifest(snapshot: WorldSnapshot) -> dict:
+        response = minio_client.get_object(BUCKET_NAME, snapshot.manifest_path)
+        try:
+            return json.loads(gzip.decompress(response.read()))
+        finally:
+            response.close()
+            response.release_conn()
+
+
+def iter_snapshot_tar(manifest: dict):
+    """
+    Восстановление: tar-поток собирается на лету из чанков, без временных файлов.
+    Память — один чанк, поэтому мир любого размера отдается с постоянным потреблением.
+    """
+    top = manifest["world_path"].rstrip("/").rsplit("/", 1)[-1] or "world"
+    for rel in sorted(manifest["files"]):
+        entry = manifest["files"][rel]
+        info = tarfile.TarInfo(name=f"{top}/{rel}")
+        info.size = entry["size"]
+        info.mtime = int(entry["mtime"] or 0)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+
+        for sha in entry["chunks"]:
+            response = minio_client.get_object(BUCKET_NAME, chunk_s3_path(sha))
+            try:
+                yield from response.stream(SFTP_READ_SIZE)
+            finally:
+                response.close()
+                response.release_conn()
+
+        remainder = entry["size"] % tarfile.BLOCKSIZE
+        if remainder:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+    # Конец архива — два пустых блока
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
@@ -6,14 +6,16 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.models import User
-from app.database import async_session_factory
+from app.database import async_session_factory, read_session_factory, replica_health
 import os
 import zipfile
 import rarfile
-import io
 import hashlib
 import tempfile
 import re
+import uuid
+from app.schemas import Principal
+from app.services.principal_cache import get_principal, store_principal
 
 # Секретный ключ — ОБЯЗАТЕЛЕН в проде
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -27,14 +29,48 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti — ключ кеша авторизации (см. get_current_user)
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_scoped_token(data: dict, scope: str, ttl_seconds: int) -> str:
+    """
+    Короткий токен для одного действия (например, подписка на SSE, где
+    EventSource не умеет заголовок Authorization). Как вход в админку не годится.
+    """
+    to_encode = data.copy()
+    to_encode.update({"exp": datetime.utcnow() + timedelta(seconds=ttl_seconds), "scope": scope})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_scoped_token(token: str, scope: str) -> dict:
+    """Содержимое scoped-токена или 401"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+    if payload.get("scope") != scope:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+    return payload
+
 async def get_db():
     async with async_session_factory() as session:
         yield session
 
+async def get_read_db():
+    """
+    Сессия только для чтения: реплика, если она задана, жива и не отстала,
+    иначе — основная база. Писать через нее нельзя.
+    """
+    if read_session_factory is not None and await replica_health.is_usable():
+        async with read_session_factory() as session:
+            # Метка для кешей: данные с реплики могут немного отставать
+            session.info["replica"] = True
+            yield session
+        return
+    async with async_session_factory() as session:
+        yield session
+
 # --- ГЛАВНАЯ ЗАЩИТА: Dependency для роутов ---
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
@@ -45,22 +81,44 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         telegram_id: str = payload.get("sub")
-        role: str = payload.get("role")
-        if telegram_id is None:
+        # scoped-токены (create_scoped_token) — только для своего действия
+        if telegram_id is None or payload.get("scope"):
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
+
+    # Токены, выданные до появления jti, кешируем по хешу самого токена
+    token_id = payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    # Сначала кеш (память процесса -> Redis), в БД — только при промахе
+    cached = await get_principal(token_id)
+    if cached is None:
+        stmt = select(User).where(User.telegram_id == int(telegram_id))
+        user = (await db.execute(stmt)).scalars().first()
         
-    # Достаем юзера из БД
-    stmt = select(User).where(User.telegram_id == int(telegram_id))
-    user = (await db.execute(stmt)).scalars().first()
-    
-    if user is None:
+        if user is None:
+            raise credentials_exception
+        cached = {
+            "id": str(user.id),
+            "telegram_id": str(user.telegram_id),
+            "username": user.username,
+            "role": user.role,
+            "is_banned": "1" if user.is_banned else "0",
+        }
+        await store_principal(token_id, cached)
+
+    if cached["is_banned"] == "1":
         raise credentials_exception
-    return user
+    return Principal(
+        id=cached["id"],
+        telegram_id=int(cached["telegram_id"]),
+        username=cached["username"],
+        role=cached["role"],
+        is_banned=False,
+    )
 
 # --- ЗАЩИТА АДМИНКИ ---
-async def get_current_admin(user: User = Depends(get_current_user)):
+async def get_current_admin(user: Principal = Depends(get_current_user)):
     if user.role != "admin":
         raise HTTPException(
             status_code=403, 
@@ -0,0 +1,192 @@
+"""
+Нагрузочный тест входа на сервер: authenticate -> join -> hasJoined.
+
+Приложение поднимается прямо в процессе (httpx + ASGITransport), вместо Postgres —
+SQLite (или DATABASE_URL), вместо Redis — fakeredis (или --redis-url).
+Результат — JSON с пропускной способностью и p50/p95/p99 по каждому эндпоинту,
+чтобы сравнивать коммиты между собой.
+
+    python bench/login_storm.py --players 500 --concurrency 100 --rounds 3 --output result.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import subprocess
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Yggdrasil login storm benchmark")
+    parser.add_argument("--players", type=int, default=200, help="How many distinct players")
+    parser.add_argument("--concurrency", type=int, default=50, help="Players logging in at the same time")
+    parser.add_argument("--rounds", type=int, default=2, help="Full login passes (first one hits cold caches)")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", "sqlite+aiosqlite:///:memory:"))
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL"), help="Real Redis instead of fakeredis")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    return parser.parse_args()
+
+
+def setup_environment(args):
+    """Окружение должно быть готово ДО импорта app.*: модули читают его при импорте"""
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("REDIS_URL", args.redis_url or "redis://localhost:6379")
+
+    import app.database as database
+    if args.redis_url is None:
+        import fakeredis
+        # Подменяем клиент до импорта роутов — они берут redis_client при импорте
+        database.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    if args.database_url.startswith("sqlite") and ":memory:" in args.database_url:
+        # Одна общая in-memory база на все соединения пула
+        from sqlalchemy.pool import StaticPool
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        database.engine = create_async_engine(
+            args.database_url, poolclass=StaticPool, connect_args={"check_same_thread": False}
+        )
+        database.async_session_factory = async_sessionmaker(database.engine, expire_on_commit=False)
+    return database
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 3)
+
+
+def summarize(samples: dict, errors: dict, elapsed: float) -> dict:
+    result = {}
+    for name, values in samples.items():
+        values.sort()
+        result[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "rps": round(len(values) / elapsed, 1) if elapsed else None,
+            "p50_ms": percentile(values, 0.50),
+            "p95_ms": percentile(values, 0.95),
+            "p99_ms": percentile(values, 0.99),
+            "max_ms": round(values[-1] * 1000, 3) if values else None,
+        }
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(args):
+    database = setup_environment(args)
+
+    import httpx
+    from app.main import app
+    from app.models import User
+    from app.services.rate_limit import rate_limiter
+
+    # Меряем сам поток входа, а не лимиты запросов
+    rate_limiter.enabled = False
+
+    # Для входа нужна только таблица пользователей
+    async with database.engine.begin() as conn:
+        await conn.run_sync(User.__table__.create, checkfirst=True)
+    async with database.async_session_factory() as db:
+        players = []
+        for i in range(args.players):
+            telegram_id = 10_000_000 + i
+            players.append(User(
+                telegram_id=telegram_id,
+                username=f"bench_{i}",
+                mc_uuid=uuid.uuid5(uuid.NAMESPACE_OID, str(telegram_id)),
+            ))
+        db.add_all(players)
+        await db.commit()
+
+    samples = {"authenticate": [], "join": [], "hasJoined": []}
+    errors = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def timed(name, request):
+        started = time.perf_counter()
+        response = await request
+        samples[name].append(time.perf_counter() - started)
+        if response.status_code >= 400 or (name == "hasJoined" and response.status_code != 200):
+            errors[name] = errors.get(name, 0) + 1
+            return None
+        return response
+
+    async def login(client, i):
+        async with semaphore:
+            response = await timed("authenticate", client.post(
+                "/authserver/authenticate", json={"username": f"bench_{i}", "password": "x"}
+            ))
+            if response is None:
+                return
+            session = response.json()
+            server_id = uuid.uuid4().hex
+            response = await timed("join", client.post("/sessionserver/session/minecraft/join", json={
+                "accessToken": session["accessToken"],
+                "selectedProfile": session["selectedProfile"]["id"],
+                "serverId": server_id,
+            }))
+            if response is None:
+                return
+            await timed("hasJoined", client.get(
+                "/sessionserver/session/minecraft/hasJoined",
+                params={"username": f"bench_{i}", "serverId": server_id},
+            ))
+
+    rounds = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for round_no in range(args.rounds):
+            for values in samples.values():
+                values.clear()
+            errors.clear()
+            started = time.perf_counter()
+            await asyncio.gather(*(login(client, i) for i in range(args.players)))
+            elapsed = time.perf_counter() - started
+            rounds.append({
+                "round": round_no + 1,
+                "elapsed_s": round(elapsed, 3),
+                "logins_per_s": round(args.players / elapsed, 1),
+                "endpoints": summarize(samples, errors, elapsed),
+            })
+
+    return {
+        "benchmark": "login_storm",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            "players": args.players,
+            "concurrency": args.concurrency,
+            "rounds": args.rounds,
+            "database": args.database_url.split("://", 1)[0],
+            "redis": "redis" if args.redis_url else "fakeredis",
+        },
+        "rounds": rounds,
+    }
+
+
+def main():
+    args = parse_args()
+    result = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import secrets
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-for-rate-limit-tests")
+os.environ.setdefault("RATE_LIMIT_SYNC_INTERVAL", "3600")
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from app.services.rate_limit import RateLimiter, RateLimitMiddleware, RateLimit
+from app.utils import create_access_token, create_scoped_token
+
+
+def make_client(limit: str = "5/minute"):
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    limiter = RateLimiter()
+    limiter.group_limits["admin"] = RateLimit.parse(limit)
+    app = Starlette(routes=[Route("/api/admin/instances", ok)])
+    transport = httpx.ASGITransport(app=RateLimitMiddleware(app, limiter), client=("10.0.0.1", 1234))
+    return limiter, httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+async def statuses(client, headers_list):
+    return [(await client.get("/api/admin/instances", headers=h)).status_code for h in headers_list]
+
+
+def run(coro_factory):
+    async def main():
+        limiter, client = make_client()
+        try:
+            async with client:
+                return await coro_factory(client)
+        finally:
+            await limiter.close()
+    return asyncio.run(main())
+
+
+def test_random_bearer_tokens_share_ip_bucket():
+    headers = [{"Authorization": f"Bearer {secrets.token_urlsafe(48)}"} for _ in range(10)]
+    codes = run(lambda client: statuses(client, headers))
+    assert codes[:5] == [200] * 5
+    assert 429 in codes[5:]
+
+
+def test_scoped_ticket_does_not_get_own_bucket():
+    ticket = create_scoped_token({"instance_id": "pack"}, "sync_events", 60)
+    headers = [{"Authorization": f"Bearer {ticket}"}] * 3 + [{}] * 3
+    codes = run(lambda client: statuses(client, headers))
+    assert codes[-1] == 429
+
+
+def test_verified_tokens_are_limited_per_user():
+    alice = {"Authorization": f"Bearer {create_access_token({'sub': '1', 'role': 'admin'})}"}
+    bob = {"Authorization": f"Bearer {create_access_token({'sub': '2', 'role': 'admin'})}"}
+    codes = run(lambda client: statuses(client, [alice] * 6 + [bob]))
+    assert codes[5] == 429
+    assert codes[6] == 200
@@ -1,14 +1,91 @@
 import asyncio
 import os
 import sys
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import select
-from minio import Minio
 
 # Добавляем путь к приложению, чтобы импортировать модули
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.database import async_session_factory, minio_client, BUCKET_NAME
-from app.models import File as FileModel
+from app.models import File as FileModel, WorldSnapshot, BackupChunk, User
+from app.services.world_backup import WorldBackupService, chunks_lock, expire_stale_snapshots
+
+def remove_objects(paths: list):
+    """Пакетное удаление из MinIO (remove_objects ждет итератор DeleteObject)"""
+    from minio.deleteobjects import DeleteObject
+    for error in minio_client.remove_objects(BUCKET_NAME, [DeleteObject(path) for path in paths]):
+        print(f"❌ Error deleting {error.name}: {error}")
+
+async def gc_backup_chunks() -> int:
+    """
+    Чанки бэкапов, на которые не ссылается ни один оставшийся манифест.
+    Все — под исключительной блокировкой чанков: бэкап, начатый во время сборки,
+    ждет ее конца и читает backup_chunks уже без удаленных чанков.
+    """
+    async with chunks_lock(exclusive=True) as acquired:
+        if not acquired:
+            # Идущий бэкап опирается на текущий набор чанков — не трогаем
+            print("⏳ Backup in progress, skipping chunk GC.")
+            return 0
+
+        async with async_session_factory() as session:
+            expired = await expire_stale_snapshots(session)
+            if expired:
+                print(f"⌛ Marked {expired} stuck backups as failed.")
+
+            snapshots = (await session.execute(
+                select(WorldSnapshot).where(WorldSnapshot.manifest_path.isnot(None))
+            )).scalars().all()
+
+            print(f"📥 Reading {len(snapshots)} backup manifests...")
+            referenced = set()
+            for snapshot in snapshots:
+                try:
+                    manifest = WorldBackupService.load_manifest(snapshot)
+                except Exception as e:
+                    # Без манифеста не знаем, какие чанки нужны — лучше ничего не удалять
+                    print(f"❌ Cannot read manifest {snapshot.manifest_path}: {e}. Skipping chunk GC.")
+                    return 0
+                for entry in manifest["files"].values():
+                    referenced.update(entry["chunks"])
+
+            # Сначала строки, потом объекты: если упадем посередине, останутся
+            # объекты без строк (бэкап зальет их заново), а не строки без объектов
+            known = set((await session.execute(select(BackupChunk.sha256))).scalars().all())
+            stale_rows = list(known - referenced)
+            for i in range(0, len(stale_rows), 1000):
+                await session.execute(
+                    BackupChunk.__table__.delete().where(BackupChunk.sha256.in_(stale_rows[i:i + 1000]))
+                )
+            await session.commit()
+
+        orphans = [
+            obj.object_name
+            for obj in minio_client.list_objects(BUCKET_NAME, prefix="chunks/", recursive=True)
+            if obj.object_name.rsplit("/", 1)[-1] not in referenced
+        ]
+        if orphans:
+            remove_objects(orphans)
+
+    print(f"✅ Backups reference {len(referenced)} chunks, {len(orphans)} orphaned chunks burned.")
+    return len(orphans)
+
+async def collect_orphan_textures():
+    """Скины и плащи, которые больше никто не носит"""
+    async with async_session_factory() as session:
+        rows = (await session.execute(select(User.skin_hash, User.cape_hash))).all()
+    referenced = {h for row in rows for h in row if h}
+
+    # Свежие текстуры не трогаем: загрузка могла еще не дойти до коммита в БД
+    fresh_after = datetime.now(timezone.utc) - timedelta(hours=1)
+    orphans = [
+        obj.object_name
+        for obj in minio_client.list_objects(BUCKET_NAME, prefix="textures/", recursive=True)
+        if obj.object_name.rsplit("/", 1)[-1] not in referenced and obj.last_modified < fresh_after
+    ]
+    print(f"✅ Users reference {len(referenced)} textures, {len(orphans)} orphaned.")
+    return orphans
 
 async def run_gc():
     print(f"🗑️  Starting Garbage Collection for bucket: {BUCKET_NAME}")
@@ -28,7 +105,8 @@ async def run_gc():
     total_objects = 0
     
     # list_objects возвращает генератор
-    objects = minio_client.list_objects(BUCKET_NAME, recursive=True)
+    # Только objects/: у бэкапов миров (chunks/, backups/) и текстур (textures/) своя сборка мусора
+    objects = minio_client.list_objects(BUCKET_NAME, prefix="objects/", recursive=True)
     
     for obj in objects:
         total_objects += 1
@@ -39,25 +117,16 @@ async def run_gc():
     print(f"✅ MinIO has {total_objects} total objects.")
     print(f"⚠️  Found {len(orphaned_objects)} orphans to delete.")
 
+    # Чанки удаляются сразу, пока держится блокировка
+    await gc_backup_chunks()
+    orphaned_objects += await collect_orphan_textures()
+
     if not orphaned_objects:
         print("🎉 Clean! No garbage found.")
         return
 
     # 3. Удаление
-    # MinIO client умеет удалять списком (batch delete), но в python sdk это remove_objects
-    # Требует итератор DeleteObject
-    from minio.deleteobjects import DeleteObject
-    
-    delete_list = [DeleteObject(path) for path in orphaned_objects]
-    
-    errors = minio_client.remove_objects(BUCKET_NAME, delete_list)
-    
-    deleted_count = 0
-    for error in errors:
-        print(f"❌ Error deleting {error.name}: {error}")
-    
-    # Если ошибок нет, итератор пустой, считаем что все удалено (грубая оценка)
-    # Но надежнее просто поверить, что операция прошла
+    remove_objects(orphaned_objects)
     print(f"🔥 Burned {len(orphaned_objects)} orphaned files.")
 
 if __name__ == "__main__":
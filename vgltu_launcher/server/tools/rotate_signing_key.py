@@ -0,0 +1,14 @@
+import os
+import sys
+
+# Добавляем путь к приложению, чтобы импортировать модули
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.signing import generate_key, KEYS_DIR
+
+if __name__ == "__main__":
+    # Новый ключ становится активным (самый новый по имени) после перезапуска бэкенда.
+    # Профили со старой подписью переподписываются при первом обращении.
+    kid = generate_key()
+    print(f"🔑 New signing key: {kid} ({KEYS_DIR})")
+    print("♻️  Restart the backend to start signing with it.")